@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+
+"""
+alerts v1.0
+Collects the alerts raised during a scan and gets them out the door
+
+Rather than opening a new SMTP connection for every alert, everything
+raised during a run is handed over at once by flush() and delivered
+over a single SMTP session (or as a single digest mail). Delivery
+happens on a background thread, or by dropping the messages in a spool
+directory for somebody else to send, so a slow MTA never holds up the
+scan. Each (mac, alert type) is only alerted on once per window, and
+that is remembered between runs in a small state file, but only once
+the alert has actually been sent or spooled. Mail the MTA won't take
+is spooled to fallback_dir, and goes out ahead of the next batch.
+"""
+
+import os
+import json
+import time
+import smtplib
+import syslog
+import threading
+import Queue
+from argparse import ArgumentParser
+from email import message_from_file
+from email.mime.text import MIMEText
+
+
+class AlertDispatcher:
+    def __init__(self, mail_from, mail_to, smtp_host='localhost', digest=False, window=60,
+                 state_file='/var/tmp/sauron_alerts.json', spool_dir=None, metrics=None,
+                 queue_size=10, fallback_dir='/var/tmp/sauron_undelivered', smtp_timeout=60):
+        """
+            Parms:
+                mail_from, mail_to = who the mail comes from and goes to
+                smtp_host = where to send it
+                digest = roll every alert from a run into one mail
+                window = minutes before we'll alert on the same mac
+                    for the same reason again. 0 alerts every time.
+                state_file = where to remember what we alerted on, so
+                    the window holds across runs. None to not bother.
+                spool_dir = if set, write messages here instead of
+                    sending them, see deliver_spool
+                metrics = optional Metrics to count alerts and time
+                    delivery in
+                queue_size = batches that can be waiting on the
+                    delivery thread. Any more go straight to
+                    fallback_dir rather than holding up the scan.
+                fallback_dir = where to spool mail that couldn't be
+                    sent, to try again with the next batch. None to
+                    just log it and alert again next time.
+                smtp_timeout = seconds to give the MTA to answer
+        """
+        self.mail_from = mail_from
+        self.mail_to = mail_to
+        self.smtp_host = smtp_host
+        self.smtp_timeout = smtp_timeout
+        self.digest = digest
+        self.window = window
+        self.state_file = state_file
+        self.spool_dir = spool_dir
+        self.fallback_dir = fallback_dir
+        self.metrics = metrics
+        if spool_dir:
+            make_spool(spool_dir)
+
+        # "mac|kind" -> when we last alerted on it. The delivery thread
+        # updates this too, hence the lock.
+        self.last_alerted = self.load_state()
+        self.lock = threading.Lock()
+
+        # "mac|kind" handed off for delivery but not out the door yet,
+        # so they aren't alerted on twice in the meantime
+        self.in_flight = set()
+
+        # Alerts raised since the last flush: (subject, message, doc_list, keys)
+        self.pending = []
+
+        # Batches of messages waiting on the delivery thread
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.worker = None
+
+    def load_state(self):
+        """
+            Reads back the last alerted times from state_file
+        """
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            syslog.syslog("Unable to read alert state from %s: %s" % (self.state_file, e))
+            return {}
+
+    def save_state(self):
+        """
+            Writes the last alerted times out to state_file, dropping
+            anything that's already outside the window.
+        """
+        if not self.state_file:
+            return
+        cutoff = time.time() - self.window * 60
+        self.last_alerted = dict((key, when) for (key, when) in self.last_alerted.items() if when > cutoff)
+        try:
+            # Write it somewhere else first so a crash can't leave us
+            # with half a file
+            with open(self.state_file + '.tmp', 'w') as f:
+                json.dump(self.last_alerted, f)
+            os.rename(self.state_file + '.tmp', self.state_file)
+        except (IOError, OSError) as e:
+            syslog.syslog("Unable to save alert state to %s: %s" % (self.state_file, e))
+
+    def add(self, kind, subject, message, doc_list):
+        """
+            Queues up an alert for the next flush. kind is what the
+            dedupe window is keyed on along with the mac, something
+            like 'new' or 'macwatch'. Any doc we've already alerted on
+            for the same kind inside the window is dropped. Returns
+            how many docs are left to alert on.
+        """
+        cutoff = time.time() - self.window * 60
+        fresh = []
+        keys = []
+        with self.lock:
+            for doc in doc_list:
+                key = "%s|%s" % (doc['_id'], kind)
+                if key in self.in_flight or (self.window and self.last_alerted.get(key, 0) > cutoff):
+                    continue
+                self.in_flight.add(key)
+                fresh.append(doc)
+                keys.append(key)
+
+        if fresh:
+            self.pending.append((subject, message, fresh, keys))
+        return len(fresh)
+
+    def delivered(self, keys):
+        """
+            Starts the window for everything in keys, now that it's been
+            sent or spooled, and saves that for next time
+        """
+        rightnow = time.time()
+        with self.lock:
+            for key in keys:
+                self.last_alerted[key] = rightnow
+            self.in_flight.difference_update(keys)
+            self.save_state()
+
+    def undelivered(self, keys):
+        """
+            Gives up on keys for now, so they get alerted on next time
+        """
+        with self.lock:
+            self.in_flight.difference_update(keys)
+
+    def flush(self):
+        """
+            Turns everything queued since the last flush into mail and
+            hands it off for delivery. This does not wait around for
+            it to actually be sent.
+        """
+        if not self.pending:
+            return
+
+        (pending, self.pending) = (self.pending, [])
+        keys = [key for (subject, message, doc_list, keys) in pending for key in keys]
+        try:
+            if self.digest:
+                body = ""
+                for (subject, message, doc_list, doc_keys) in pending:
+                    body += "=== %s ===\n" % subject
+                    body += format_alert(message, doc_list)
+                    body += "\n"
+                subjects = [subject for (subject, message, doc_list, doc_keys) in pending]
+                messages = [self.make_message(body, "Sauron: " + ", ".join(subjects))]
+            else:
+                messages = [self.make_message(format_alert(message, doc_list), subject)
+                            for (subject, message, doc_list, doc_keys) in pending]
+        except Exception as e:
+            # Don't let one bad alert wedge every flush after it
+            syslog.syslog("Unable to build %d alert(s): %s" % (len(pending), e))
+            self.undelivered(keys)
+            return
+
+        if self.metrics:
+            self.metrics.incr('alerts', len(messages))
+
+        if self.spool_dir:
+            if self.spool(self.spool_dir, messages):
+                self.delivered(keys)
+            else:
+                self.undelivered(keys)
+        else:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.deliver_forever)
+                self.worker.daemon = True
+                self.worker.start()
+            try:
+                self.queue.put_nowait((messages, keys))
+            except Queue.Full:
+                # Delivery has fallen way behind, don't wait on it
+                syslog.syslog("Alert delivery is backed up, spooling %d alert(s) to %s" %
+                              (len(messages), self.fallback_dir))
+                if self.fallback_dir and self.spool(self.fallback_dir, messages):
+                    self.delivered(keys)
+                else:
+                    self.undelivered(keys)
+
+    def spool(self, spool_dir, messages):
+        """
+            Writes messages to spool_dir, logging it if that fails.
+            Returns: True if they're all there
+        """
+        try:
+            make_spool(spool_dir)
+            spool_messages(spool_dir, messages)
+            return True
+        except (IOError, OSError) as e:
+            syslog.syslog("Unable to spool %d alert(s) to %s: %s" % (len(messages), spool_dir, e))
+            return False
+
+    def make_message(self, body, subject):
+        """
+            Wraps up a body and subject as a mail
+        """
+        # Docs from couchdb are unicode, and vendor names needn't be ASCII
+        msg = MIMEText(body.encode('utf-8'), 'plain', 'utf-8')
+        msg['Subject'] = subject
+        msg['From'] = self.mail_from
+        msg['To'] = self.mail_to
+        return msg
+
+    def deliver_forever(self):
+        """
+            The delivery thread. Sends each batch of messages over one
+            SMTP session until it's told to stop.
+        """
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            (messages, keys) = batch
+            started = time.time()
+            try:
+                # Whatever didn't make it last time goes first
+                if self.fallback_dir and os.path.isdir(self.fallback_dir):
+                    deliver_spool(self.fallback_dir, self.smtp_host, self.smtp_timeout)
+                send_messages(self.smtp_host, messages, self.smtp_timeout)
+                self.delivered(keys)
+            except Exception as e:
+                # Whatever it is, this thread has to keep going
+                syslog.syslog("Unable to send %d alert(s): %s" % (len(messages), e))
+                if self.fallback_dir and self.spool(self.fallback_dir, messages):
+                    self.delivered(keys)
+                else:
+                    self.undelivered(keys)
+            if self.metrics:
+                self.metrics.add_time('alert_delivery', time.time() - started)
+
+    def close(self):
+        """
+            Waits for anything still being delivered to go out and
+            stops the delivery thread.
+        """
+        if self.worker is not None:
+            self.queue.put(None)
+            self.worker.join()
+            self.worker = None
+
+
+def format_alert(message, doc_list):
+    """
+        Forms the body for one alert: the message and then the
+        details of every doc it is about.
+    """
+    # Built up as a list, since the docs are unicode and adding
+    # unicode strings together over and over gets slow fast
+    body = ["An alert has been triggered for the following event:\n", message]
+    for entry in doc_list:
+        body.append("MAC Address: %s\n" % entry['_id'])
+        body.append("IP Address: %s\n" % entry['ip'])
+        if entry.get('previousIp'):
+            body.append("Previous IP Address: %s\n" % entry['previousIp'])
+        body.append("OUI: %s\n" % entry['oui'])
+        body.append("\n")
+    return "".join(body)
+
+def send_messages(smtp_host, messages, timeout=60):
+    """
+        Sends every message over a single SMTP session, giving up on
+        an MTA that doesn't answer within timeout seconds
+    """
+    s = smtplib.SMTP(smtp_host, timeout=timeout)
+    try:
+        for msg in messages:
+            s.sendmail(msg['From'], msg['To'], msg.as_string())
+    finally:
+        s.quit()
+
+def make_spool(spool_dir):
+    """
+        Creates spool_dir if it isn't there yet
+    """
+    try:
+        os.makedirs(spool_dir)
+    except OSError:
+        if not os.path.isdir(spool_dir):
+            raise
+
+def spool_messages(spool_dir, messages):
+    """
+        Writes each message into the spool directory as its own file.
+        Files are written under a temporary name and renamed into
+        place, so deliver_spool never picks up half a message.
+    """
+    for (count, msg) in enumerate(messages):
+        name = "%f-%d-%d.eml" % (time.time(), os.getpid(), count)
+        path = os.path.join(spool_dir, name)
+        with open(path + '.tmp', 'w') as f:
+            f.write(msg.as_string())
+        os.rename(path + '.tmp', path)
+
+def deliver_spool(spool_dir, smtp_host='localhost', timeout=60):
+    """
+        Sends everything sitting in the spool directory over one SMTP
+        session, removing each file once it has gone out. Returns the
+        number of messages sent.
+    """
+    names = sorted(name for name in os.listdir(spool_dir) if name.endswith('.eml'))
+    if not names:
+        return 0
+
+    sent = 0
+    s = smtplib.SMTP(smtp_host, timeout=timeout)
+    try:
+        for name in names:
+            path = os.path.join(spool_dir, name)
+            with open(path) as f:
+                msg = message_from_file(f)
+            s.sendmail(msg['From'], msg['To'], msg.as_string())
+            os.remove(path)
+            sent += 1
+    finally:
+        s.quit()
+    return sent
+
+
+def main():
+    parser = ArgumentParser(description='Send the alerts waiting in a sauron spool directory.')
+    parser.add_argument('spool_dir', metavar='SPOOL_DIR', help="Spool directory to deliver")
+    parser.add_argument('-s', '--smtp-host', action="store", dest="smtp_host", help="SMTP server to send through", default='localhost')
+
+    options = parser.parse_args()
+
+    print "Sent %d message(s)" % deliver_spool(options.spool_dir, options.smtp_host)
+
+if __name__ == '__main__':
+    main()
@@ -11,32 +11,93 @@ v1.1 -- Now with logging
 import couchdb
 import smtplib
 import datetime
+import time
 import re
 import syslog
 from email.mime.text import MIMEText
+from alerts import AlertDispatcher
+from metrics import Metrics, CountingSession
+from storage import open_storage, chunks
+from pipeline import read_ahead, Worker, log, flush_log
+
+# How dates get stored in couchdb. ISO-8601 sorts the same as a string as
+# it does as a date, which is what lets the by_lastseen view do range
+# queries. Older versions stored '%x %X', see normalize_date.
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+LEGACY_DATE_FORMAT = '%x %X'
+
+# Fewest keys worth a lookup request of their own, see get_docs
+MIN_LOOKUP_SIZE = 100
 
-# TODO: find a way to delete an entry from macwatch if the persistent
-#       flag is set to false
 
 class MacWatch:
-    def __init__(self, server='localhost', port=5984, database_name='all_seeing_eye'):
+    def __init__(self, server='localhost', port=5984, database_name='all_seeing_eye', session=None,
+                 storage=None):
         """
             Initializes server connection to couchDB. This does all the ususal
             shit that couchcoop does but in a more limited sense, being more
             specific towards the macwatch database.
+
+            session is an optional couchdb.http.Session to make requests with.
+
+            storage is where the watchlist actually lives (see storage.py).
+            If it's given, server, port, database_name and session aren't
+            used.
         """
         self.server = server
         self.port = port
         self.database_name = database_name
-        self.server = couchdb.Server(url="http://%s:%d" % (self.server, self.port))
-        try:
-            # create if database doesn't exist
-            self.server.create(database_name)
-        except couchdb.PreconditionFailed:
-            # Database already exists
-            pass
-        finally:
-            self.db = self.server[database_name]
+        if storage is None:
+            storage = open_storage("http://%s:%d" % (server, port), macwatch_name=database_name,
+                                   session=session)
+        self.storage = storage
+
+        # In-memory copy of the watchlist, mac -> persistent. This is kept
+        # current off of the _changes feed (see refresh) so that checking
+        # a scanned mac doesn't cost a trip to the database.
+        self.watchlist = {}
+        # We need the revision of a doc to delete it later
+        self.revs = {}
+        # Where we left off in the _changes feed
+        self.since = 0
+        # Non-persistent macs we found, to be deleted in one go by flush()
+        self.pending_delete = []
+
+    def refresh(self):
+        """
+            Brings the in-memory watchlist up to date by reading the
+            _changes feed from the last sequence we saw. The first call
+            starts from 0 and so loads the whole watchlist in one request,
+            every call after that only picks up what changed since.
+        """
+        (changes, self.since) = self.storage.watch_changes(self.since)
+        for (mac, persistent, rev) in changes:
+            if persistent is None:
+                self.watchlist.pop(mac, None)
+                self.revs.pop(mac, None)
+            else:
+                self.watchlist[mac] = persistent
+                self.revs[mac] = rev
+
+    def flush(self):
+        """
+            Deletes every non-persistent mac that act_on_mac found since
+            the last flush, all in one _bulk_docs request. Returns the
+            number of entries removed.
+        """
+        if not self.pending_delete:
+            return 0
+
+        entries = [(mac, self.revs.pop(mac, None)) for mac in self.pending_delete]
+        self.pending_delete = []
+
+        failed = self.storage.watch_remove(entries)
+        for (identifier, exc) in failed:
+            # Somebody changed it underneath us. The next refresh will
+            # pick up whatever they did, so just make a note of it.
+            syslog.syslog("Unable to remove %s from macwatch: %s" % (identifier, exc))
+
+        return len(entries) - len(failed)
 
     def add_mac(self, mac, persistent=False):
         """
@@ -51,46 +112,56 @@ class MacWatch:
                   PROPER formatting! I am expecting the following
                   IEEE format: aa:bb:cc:11:22:33
         """
-        if mac in self.db:
-            # If this exists already, update it -- overwrite
-            doc = self.db[mac]
-            doc['persistent'] = persistent
-            self.db.update([doc])
-        
-        self.db[mac] = {'persistent': persistent}
+        return not self.add_macs([(mac, persistent)])
+
+    def add_macs(self, entries, chunk_size=1000):
+        """
+            Adds a whole bunch of macs at once, overwriting any that
+            are already there. Works chunk_size macs at a time: one
+            request to find the revisions of the ones that exist and
+            one _bulk_docs to write them all.
+
+            Parms:
+                entries = iterable of (mac, persistent), formatted the
+                    same way add_mac wants
+            Returns: List of Tuples: (mac, exception) for any that
+                     couldn't be written
+        """
+        failed = []
+        for chunk in chunks(entries, chunk_size):
+            for (identifier, exc) in self.storage.watch_save(chunk):
+                syslog.syslog("Unable to add %s to macwatch: %s" % (identifier, exc))
+                failed.append((identifier, exc))
+
+        return failed
 
     def del_mac(self, mac):
         """
             Removes the entry from the database altogether
         """
-        # First, let's pull the doc from the database
-        if mac in self.db:
-            # This entry exists, so let's do this
-            doc = self.db[mac]
-            self.db.delete(doc)
-            return True
-        else:
-            return False
+        return self.storage.watch_delete(mac)
 
     def does_mac_exist(self, mac):
         """
             Returns T/F to determine if mac exists or not
         """
-        if mac in self.db:
-            return True
-        else:
-            return False
+        return self.storage.watch_exists(mac)
 
     def maclist(self):
         """
             Returns list of macs listed in macwatch.
             Returns empty list if db is empty.
         """
-        retlist = []
-        for entry in self.db:
-            retlist.append(entry)
+        return [mac for (mac, persistent) in self.iter_macs()]
 
-        return retlist
+    def iter_macs(self, page_size=1000):
+        """
+            Reads through the macwatch database page_size entries at a
+            time, so the whole thing never has to fit in memory.
+
+            Yields: Tuple: (mac, persistent)
+        """
+        return self.storage.watch_iter(page_size)
 
     def act_on_mac(self, mac):
         """
@@ -98,51 +169,109 @@ class MacWatch:
             is in the macwatch database. If it is not, it will
             return false. If it is, it will check if it is marked
             as persistent. If it is, it will do nothing. If it
-            is not, it will remove it.
+            is not, it will be queued up for removal by flush().
+
+            This only looks at the in-memory watchlist, so make sure
+            refresh() has been called first.
         """
-        if mac in self.db:
-            doc = self.db[mac]
-            if doc['persistent']:
-                return True
-            else:
-                self.db.delete(doc)
-                return True
+        if mac in self.watchlist:
+            if not self.watchlist[mac]:
+                del self.watchlist[mac]
+                self.pending_delete.append(mac)
+            return True
         else:
             return False
 
 
 class CouchCoop:
     def __init__(self, server='localhost', port=5984, database_name='sauron', ageout=30,
-                 mail_to='dan@example.com', mail_from='sauron@example.com'):
+                 mail_to='dan@example.com', mail_from='sauron@example.com', chunk_size=1000,
+                 granularity=0, alert_window=60, digest=False, spool_dir=None, history=None,
+                 ouis=None, storage=None, timeout=None, retries=3, workers=4, sensor=None,
+                 conflict_retries=3, alert_ip_changes=False, read_ahead=1000, write_behind=2,
+                 metrics=None):
         """
             Initializes server connection to couchDB
+
+            chunk_size is how many keys we ask couchdb for in a single
+            bulk lookup, so huge scans don't turn into one giant request.
+
+            granularity is how many minutes old lastSeen has to be before
+            we bother writing a device back just to bump it. Every write
+            is a new revision in couchdb, so on a busy scan schedule this
+            saves a lot of space. 0 writes every device on every scan.
+
+            alert_window, digest and spool_dir are handed to the
+            AlertDispatcher, see alerts.py.
+
+            history is a SightingLog to append every sighting to, so
+            there's a record of more than just the last time a device
+            was seen. See sightings.py. None to not keep one.
+
+            ouis is an OUIDatabase to fill in vendors from, rather than
+            going with whatever arp-scan said. See oui.py.
+
+            storage is a URL for open_storage (see storage.py), such as
+            sqlite:/var/lib/sauron/sauron.db. None means couchdb on
+            server and port, with the database called database_name.
+
+            timeout is how many seconds to give couchdb to answer, None
+            to wait forever, and retries how many more times to try a
+            request when the connection fails. workers is how many bulk
+            lookups may be in flight at once, see get_docs. MacWatch
+            shares the same connections.
+
+            sensor names this host, for when more than one sauron writes
+            to the same database. Every device it sees is tagged with it
+            (see read_scan_data). Writes that conflict with another
+            sensor's are merged and tried again, up to conflict_retries
+            times, see save_docs.
+
+            alert_ip_changes alerts whenever a known device turns up on
+            a different IP. Two devices claiming the same IP in one scan
+            are always alerted on.
+
+            read_ahead is how many scan entries can be read before
+            read_scan_data gets to them, so arp-scan doesn't sit on a
+            full pipe while we wait on the database. write_behind is
+            how many batches can be waiting to be written while the
+            next ones are looked up. 0 turns either off. See pipeline.py.
+
+            metrics is the Metrics to count in, for a caller that was
+            already counting before it connected. A new one if None.
         """
         self.server = server
         self.port = port
         self.mail_to = mail_to
         self.mail_from = mail_from
         self.ageout = ageout
-        # Macwatch is a list of mac addresses we care about if we see them again
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.sensor = sensor
+        self.conflict_retries = conflict_retries
+        self.alert_ip_changes = alert_ip_changes
+        self.read_ahead = read_ahead
+        self.write_behind = write_behind
+        self.granularity = granularity
+        self.history = history
+        self.ouis = ouis
+        # Timings and counters for each run, see metrics.py
+        self.metrics = metrics or Metrics()
+        self.alerts = AlertDispatcher(mail_from, mail_to, digest=digest, window=alert_window,
+                                      spool_dir=spool_dir, metrics=self.metrics)
+        # Count every request we make to couchdb
+        session = CountingSession(self.metrics, timeout=timeout, retries=retries)
         self.database_name = database_name
-        self.server = couchdb.Server(url="http://%s:%d" % (self.server, self.port))
-        self.macwatch = MacWatch()
-        try:
-            # create if database doesn't exist
-            self.server.create(database_name)
-        except couchdb.PreconditionFailed:
-            # Database already exists
-            pass
-        finally:
-            self.db = self.server[database_name]
+        self.storage = open_storage(storage or "http://%s:%d" % (server, port), database_name,
+                                    session=session, workers=workers)
+        # Macwatch is a list of mac addresses we care about if we see them again
+        self.macwatch = MacWatch(server, port, storage=self.storage)
 
     def does_mac_exist(self, mac):
         """
             Checks if we have a record of this mac in the database
         """
-        if mac in self.db:
-            return True
-        else:
-            return False
+        return self.storage.exists(mac)
 
     def date_from_database(self, identifier, field):
         """
@@ -150,56 +279,292 @@ class CouchCoop:
             of a date and work it into a date object that we can
             manipulate in the python way. Field is the datetime object
         """
-        return datetime.datetime.strptime(self.db[identifier][field], '%x %X')
+        return date_from_database(self.storage.get(identifier)[field])
 
     def date_to_database(self, datetime_obj):
         """
             Just a wrapper for the strftime function, the return of this
             would get stored in couchdb
         """
-        return datetime_obj.strftime('%x %X')
+        return date_to_database(datetime_obj)
+
+    def seen_between(self, start, end):
+        """
+            Range query on the by_lastseen view. Returns a list of
+            (mac, ip, lastSeen) for everything last seen between the
+            start and end datetimes, oldest first. Either one can be
+            None to leave that end of the range open.
+        """
+        return self.storage.seen_between(date_to_database(start) if start is not None else None,
+                                         date_to_database(end) if end is not None else None)
+
+    def who_has(self, ip):
+        """
+            Every device the database has on ip, off the by_ip view.
+            Returns a list of (mac, lastSeen), usually just the one.
+        """
+        return self.storage.holders([ip]).get(ip, [])
+
+    def aged_out_devices(self):
+        """
+            Everything we haven't seen in at least ageout days.
+        """
+        return self.seen_between(None, datetime.datetime.now() - datetime.timedelta(days=self.ageout))
+
+    def departed_devices(self, minutes):
+        """
+            Devices that have left the network, meaning we haven't seen
+            them for at least the given number of minutes. Anything that
+            has already aged out is left off, otherwise this would just
+            be a list of every device we've ever seen.
+        """
+        rightnow = datetime.datetime.now()
+        return self.seen_between(rightnow - datetime.timedelta(days=self.ageout),
+                                 rightnow - datetime.timedelta(minutes=minutes))
+
+    def migrate_timestamps(self):
+        """
+            One-time conversion of every doc still holding the old
+            '%x %X' dates over to DATE_FORMAT. Works through the
+            database chunk_size docs at a time and only writes back
+            the ones that needed it. Returns how many were converted.
+        """
+        converted = 0
+        update_doc_list = []
+        for doc in self.storage.iter_devices(self.chunk_size):
+            changed = False
+            for field in ('lastSeen', 'firstSeen'):
+                if field in doc and normalize_date(doc[field]) != doc[field]:
+                    doc[field] = normalize_date(doc[field])
+                    changed = True
+            if changed:
+                update_doc_list.append(doc)
+
+            if len(update_doc_list) >= self.chunk_size:
+                converted += len(update_doc_list) - len(self.save_docs(update_doc_list))
+                update_doc_list = []
+
+        converted += len(update_doc_list) - len(self.save_docs(update_doc_list))
+        return converted
+
+    def enrich_vendors(self):
+        """
+            Goes back over every doc filling in vendors from self.ouis
+            and flagging locally administered macs, like read_scan_data
+            does as devices show up. Works through the database
+            chunk_size docs at a time and only writes back the ones
+            that changed. Returns how many were updated.
+        """
+        updated = 0
+        update_doc_list = []
+        for doc in self.storage.iter_devices(self.chunk_size):
+            try:
+                if self.ouis.enrich(doc):
+                    update_doc_list.append(doc)
+            except ValueError:
+                # Not a mac, somebody's been putting other things in here
+                continue
+
+            if len(update_doc_list) >= self.chunk_size:
+                updated += len(update_doc_list) - len(self.save_docs(update_doc_list))
+                update_doc_list = []
+
+        updated += len(update_doc_list) - len(self.save_docs(update_doc_list))
+        return updated
 
     def get_doc(self, identifier):
         """
             Returns the doc from couchdb as a document object. Note that
             this returns "None" if the object does not exist.
         """
-        if self.does_mac_exist(identifier):
-            return self.db[identifier]
-        else:
-            return None
+        return self.storage.get(identifier)
 
-    def alert(self, alert_list, message, subject):
+    def get_docs(self, identifiers):
+        """
+            Bulk version of get_doc. Pulls every identifier in one
+            _all_docs?include_docs=true request (per chunk_size keys)
+            instead of a HEAD and a GET for each one. A big enough
+            lookup is split up between the workers so a few requests
+            are in flight at once.
+
+            Returns a dict of identifier -> doc object. Anything that
+            doesn't exist (or was deleted) just won't be in the dict.
+        """
+        identifiers = list(identifiers)
+        size = min(self.chunk_size, max(MIN_LOOKUP_SIZE, -(-len(identifiers) // self.workers)))
+        # Anything missing or deleted is a new device as far as we
+        # are concerned
+        return self.storage.get_chunks(chunks(identifiers, size))
+
+    def save_docs(self, doc_list, conflicted=None):
+        """
+            Writes every doc in doc_list to couchdb in one _bulk_docs
+            request and checks what came back for each one.
+
+            A doc that conflicted because somebody else wrote it in the
+            meantime is fetched again (all of them in one go), merged
+            with what they wrote (see merge_docs) and written again, up
+            to conflict_retries times. The merged doc replaces ours in
+            place, so anything holding on to it sees what went in.
+            Anything that still didn't make it gets logged.
+
+            conflicted, if given, is a set that gets the identifier of
+            every doc somebody else had written, merged or not.
+
+            Returns a list of (identifier, exception) for the failures,
+            which is empty if everything went in.
+        """
+        if not doc_list:
+            return []
+
+        failed = []
+        docs_by_id = dict((doc['_id'], doc) for doc in doc_list)
+        pending = doc_list
+        for attempt in range(self.conflict_retries + 1):
+            with self.metrics.phase('update'):
+                results = self.storage.save_many(pending)
+
+            conflicts = []
+            for (success, identifier, rev_or_exc) in results:
+                if success:
+                    self.metrics.incr('writes')
+                elif isinstance(rev_or_exc, couchdb.ResourceConflict):
+                    self.metrics.incr('conflicts')
+                    conflicts.append((identifier, rev_or_exc))
+                else:
+                    failed.append((identifier, rev_or_exc))
+                    self.metrics.incr('write_failures')
+                    logger(identifier, docs_by_id[identifier].get('ip'),
+                           'UPDATE FAILED, DOCUMENT NOT SAVED: %s' % rev_or_exc)
+
+            if not conflicts:
+                break
+
+            # Somebody beat us to it. See what they wrote.
+            with self.metrics.phase('lookup'):
+                current = self.get_docs([identifier for (identifier, exc) in conflicts])
+
+            # Unless it was us, a request that went in but got sent again
+            ours = [(identifier, exc) for (identifier, exc) in conflicts
+                    if identifier in current and same_doc(docs_by_id[identifier], current[identifier])]
+            for (identifier, exc) in ours:
+                docs_by_id[identifier]['_rev'] = current[identifier]['_rev']
+                self.metrics.incr('writes')
+            conflicts = [conflict for conflict in conflicts if conflict not in ours]
+
+            if conflicted is not None:
+                conflicted.update(identifier for (identifier, exc) in conflicts)
+            if not conflicts or attempt == self.conflict_retries:
+                break
+
+            # Merge what they wrote with ours
+            pending = []
+            for (identifier, exc) in conflicts:
+                doc = docs_by_id[identifier]
+                if identifier in current:
+                    merged = merge_docs(doc, current[identifier])
+                else:
+                    # Deleted out from under us, start it over
+                    merged = dict(doc)
+                    merged.pop('_rev', None)
+                doc.clear()
+                doc.update(merged)
+                pending.append(doc)
+            self.metrics.incr('conflicts_merged', len(pending))
+
+        for (identifier, exc) in conflicts:
+            failed.append((identifier, exc))
+            logger(identifier, docs_by_id[identifier].get('ip'), 'UPDATE CONFLICT, DOCUMENT NOT SAVED')
+
+        if failed:
+            syslog.syslog("%d of %d documents failed to save" % (len(failed), len(doc_list)))
+
+        return failed
+
+    def save_batch(self, update_doc_list, sightings, started):
+        """
+            Writes out one batch from read_scan_data and records its
+            sightings in the history. This is what runs behind the
+            scan, see write_behind.
+
+            Returns: Tuple: (set of identifiers that failed to save,
+                             set of identifiers somebody else wrote)
+        """
+        conflicted = set()
+        failed = set(identifier for (identifier, exc) in self.save_docs(update_doc_list, conflicted))
+
+        if self.history and sightings:
+            with self.metrics.phase('history'):
+                self.history.record(sightings, started)
+        return (failed, conflicted)
+
+    def alert(self, alert_list, message, subject, kind=None):
         """
             Raises an alert with a customized message
-            based on pre-defined criteria.
+            based on pre-defined criteria. Alerts are only
+            queued up here, they go out together when
+            read_scan_data is done (see alerts.py).
             Parms: alert_list -- list of docs from couchdb
                    message -- customized message header
                    subject -- customized subject line
+                   kind -- what sort of alert this is, for
+                           the dedupe window. Defaults to subject.
         """
-        body = "An alert has been triggered for the following event:\n"
-        body += message
-        for entry in alert_list:
-            body += "MAC Address: %s\n" % entry['_id']
-            body += "IP Address: %s\n" % entry['ip']
-            body += "OUI: %s\n" % entry['oui']
-            body += "\n"
-
-        mail_exec(body, subject, self.mail_from, self.mail_to)
+        self.alerts.add(kind or subject, subject, message, alert_list)
 
+    def close(self):
+        """
+            Waits for any alerts and log lines still on their way out,
+            and lets go of the database. Call this before exiting.
+        """
+        self.alerts.close()
+        self.storage.close()
+        flush_log()
 
-    def read_scan_data(self, scan_data):
+    def read_scan_data(self, scan_data, record_history=True):
         """
             Reads the scan data from the below function
             and adds to the database as necessary. This
             is the "meat and potatoes" function.
+
+            How long each part of this takes, and how much
+            it did, is kept track of in self.metrics.
+
+            An entry seen some other time than right now, like a
+            scan being replayed from the journal (see journal.py),
+            carries 'seen' and optionally 'first_seen' epoch times.
+            Nothing ever moves backwards: a sighting older than what
+            the database has doesn't touch lastSeen or ip, so going
+            over the same scan twice changes nothing the second time.
+
+            With a sensor name, every device records the sensor that
+            saw it last ('sensor'), and every sensor ('sensors') and
+            IP ('ips') it has been seen by or with. A device another
+            sensor wrote at the same time is merged rather than lost,
+            and only the one that actually created it alerts on it
+            being new.
+
+            Every IP is tracked as the scan goes, so more than one mac
+            answering for the same one on the same interface gets
+            alerted on, as does (with alert_ip_changes) a device
+            turning up on a different IP.
+
+            record_history False leaves the sightings out of the
+            history, for a caller that records them itself.
         """
+        started = time.time()
         rightnow = datetime.datetime.now()
         delta = datetime.timedelta(days=self.ageout)
-        comparedate = rightnow - delta
+        # Dates in the database compare fine as strings, so don't bother
+        # turning every one of them back into a datetime
+        timestamp = date_to_database(rightnow)
+        comparedate = date_to_database(rightnow - delta)
 
-        # List of docs to update in one swath
-        update_doc_list = []
+        # Anything last seen after this doesn't need its lastSeen bumped
+        refreshdate = date_to_database(rightnow - datetime.timedelta(minutes=self.granularity))
+
+        # How many unchanged devices we didn't bother writing back
+        writes_avoided = 0
 
         # What new entries should we alert on?
         new_devices_doc_list = []
@@ -210,70 +575,217 @@ class CouchCoop:
         # Create a list for aged-out entries
         old_devices_found_doc_list = []
 
-        for entry in scan_data:
-            if self.does_mac_exist(entry['mac']):
-                # We know about this already. Check the date.
-                # Pull the doc.
-                doc = self.get_doc(entry['mac'])
-                working_date = datetime.datetime.strptime(doc['lastSeen'], '%x %X')
-                if working_date < comparedate:
-                    # This is a really old mac that we haven't seen in a while.
-                    old_devices_found_doc_list.append(doc)
-                    # Log appropriately
-                    logger(entry['mac'], entry['ip'], 'OLD DEVICE DISCOVERED')
-                else:
-                    # This is a fairly new mac that we've seen before.
-                    # Log it and move on
-                    logger(entry['mac'], entry['ip'], 'DEVICE ACTIVE ON NETWORK')
-
-                # Now update the doc
-                doc['lastSeen'] = rightnow.strftime('%x %X')
-                doc['ip'] = entry['ip']
-
-                # Is this device on macwatch?
-                if self.macwatch.act_on_mac(doc['_id']):
-                    macwatch_found_list.append(doc)
-                    logger(doc['_id'], doc['ip'], 'DISCOVERED DEVICE ON MACWATCH')
-
-                update_doc_list.append(doc)
-
-            else:
-                # This is a new mac on the network. Should we alert?
-                self.db[entry['mac']] = {'ip': entry['ip'], 'lastSeen': rightnow.strftime('%x %X'),
-                                         'firstSeen': rightnow.strftime('%x %X'), 'oui': entry['oui']}
-
-                doc = self.get_doc(entry['mac'])
-
-                # Log to macwatch if this is what we were looking for
-                if self.macwatch.act_on_mac(doc['_id']):
-                    macwatch_found_list.append(doc)
-                    logger(doc['_id'], doc['ip'], 'DISCOVERED PREVIOUSLY UNSEEN DEVICE ON MACWATCH')
-
-                # Append to new devices list
-                new_devices_doc_list.append(doc)
-                logger(doc['_id'], doc['ip'], 'DISCOVERED NEW DEVICE ON NETWORK')
-
-
-        # Update all the timestamps. Basically if we found you and know about
-        # you already, we're just going to update the last seen timestamp and
-        # move on with our lives.
-        self.db.update(update_doc_list)
+        # Known devices that turned up on a different IP, with
+        # previousIp filled in for the alert
+        ip_changed_doc_list = []
+
+        # (ip, interface, scan) -> docs of every device that answered
+        # on it, so a second mac claiming an IP in the same scan stands
+        # out without asking the database anything. Two segments (VLANs,
+        # say) can use the same addresses, so it only counts on the same
+        # interface, and scans rolled together from the journal each
+        # carry a 'scan' of their own.
+        claims = {}
+
+        # Keep track of what we've handled already, in case a mac shows
+        # up more than once in the same scan.
+        seen = set()
+
+        # Epoch times from 'seen' and 'first_seen' -> database dates.
+        # There's only one or two per scan, so work each out once.
+        dates = {}
+
+        def database_date(when):
+            if when not in dates:
+                dates[when] = date_to_database(datetime.datetime.fromtimestamp(when))
+            return dates[when]
+
+        # Get macwatch up to speed so every check below is just a lookup
+        with self.metrics.phase('macwatch'):
+            self.macwatch.refresh()
+
+        if self.read_ahead:
+            # Keep arp-scan's output moving while we're busy with the database
+            scan_data = read_ahead(scan_data, self.read_ahead)
+
+        # Each batch gets written while the next one is looked up, on
+        # storage that can do that. SQLite writes it then and there.
+        writer = Worker(self.save_batch, self.write_behind if self.storage.concurrent else 0)
+
+        # On storage that has them, the whole scan is one transaction
+        with self.storage.transaction(), writer:
+            # scan_data can be a generator that is still being fed by arp-scan,
+            # so work through it a batch at a time. By the time the scan is
+            # done, most of the database work should be too. Any time spent
+            # waiting on it counts as scan time.
+            for batch in chunks(self.metrics.timed('scan', scan_data), self.chunk_size):
+                # List of docs to update in one swath
+                update_doc_list = []
+
+                # (mac, ip) of everything in this batch, for the history
+                sightings = []
+
+                # Pull everything in this batch we already know about in one
+                # go, rather than asking couchdb about each mac one at a time.
+                with self.metrics.phase('lookup'):
+                    known_docs = self.get_docs([entry['mac'] for entry in batch if entry['mac'] not in seen])
+
+                for entry in batch:
+                    if entry['mac'] in seen:
+                        continue
+                    seen.add(entry['mac'])
+                    sightings.append((entry['mac'], entry['ip'], entry.get('seen', started)))
+                    self.metrics.incr('devices_seen')
+
+                    last_seen = database_date(entry['seen']) if 'seen' in entry else timestamp
+                    first_seen = database_date(entry['first_seen']) if 'first_seen' in entry else last_seen
+
+                    if entry['mac'] in known_docs:
+                        # We know about this already. Check the date.
+                        doc = known_docs[entry['mac']]
+                        working_date = normalize_date(doc['lastSeen'])
+                        if working_date < comparedate:
+                            # This is a really old mac that we haven't seen in a while.
+                            old_devices_found_doc_list.append(doc)
+                            self.metrics.incr('devices_aged_out')
+                            # Log appropriately
+                            logger(entry['mac'], entry['ip'], 'OLD DEVICE DISCOVERED')
+                        else:
+                            # This is a fairly new mac that we've seen before.
+                            # Log it and move on
+                            logger(entry['mac'], entry['ip'], 'DEVICE ACTIVE ON NETWORK')
+
+                        # Is there actually anything worth writing?
+                        # (Old style dates count as a change so they get upgraded.)
+                        newer = last_seen >= working_date
+                        if newer:
+                            changed = (working_date <= refreshdate or working_date != doc['lastSeen'] or
+                                       doc.get('ip') != entry['ip'] or
+                                       (entry.get('interface') and doc.get('interface') != entry['interface']))
+                        else:
+                            # We already know about something more recent
+                            changed = working_date != doc['lastSeen']
+
+                        # Fix up the vendor while we're here
+                        if self.ouis and self.ouis.enrich(doc):
+                            changed = True
+
+                        # Now update the doc
+                        doc['firstSeen'] = normalize_date(doc['firstSeen'])
+                        if first_seen < doc['firstSeen']:
+                            doc['firstSeen'] = first_seen
+                            changed = True
+                        doc['lastSeen'] = working_date
+                        if newer and doc.get('ip') and doc['ip'] != entry['ip']:
+                            logger(entry['mac'], entry['ip'], 'IP CHANGED FROM %s' % doc['ip'])
+                            self.metrics.incr('ip_changes')
+                            if self.alert_ip_changes:
+                                ip_changed_doc_list.append(dict(doc, ip=entry['ip'], previousIp=doc['ip']))
+                        if newer:
+                            doc['lastSeen'] = last_seen
+                            doc['ip'] = entry['ip']
+                            if entry.get('interface'):
+                                doc['interface'] = entry['interface']
+                        if self.sensor:
+                            # Not worth a write on its own when a couple of
+                            # sensors take turns seeing a device
+                            if newer:
+                                doc['sensor'] = self.sensor
+                            for (field, value) in (('sensors', self.sensor), ('ips', entry['ip'])):
+                                values = doc.get(field, [])
+                                if value not in values:
+                                    doc[field] = sorted(values + [value])
+                                    changed = True
+
+                        # Is this device on macwatch?
+                        if self.macwatch.act_on_mac(doc['_id']):
+                            macwatch_found_list.append(doc)
+                            self.metrics.incr('macwatch_hits')
+                            logger(doc['_id'], doc['ip'], 'DISCOVERED DEVICE ON MACWATCH')
+
+                        if changed:
+                            update_doc_list.append(doc)
+                        else:
+                            writes_avoided += 1
+                            self.metrics.incr('writes_avoided')
+
+                    else:
+                        # This is a new mac on the network. Should we alert? Build
+                        # the doc here and let it ride along with the bulk update
+                        # below, rather than a PUT and a re-GET for every new device.
+                        doc = {'_id': entry['mac'], 'ip': entry['ip'], 'lastSeen': last_seen,
+                               'firstSeen': first_seen, 'oui': entry['oui']}
+                        if entry.get('interface'):
+                            doc['interface'] = entry['interface']
+                        if self.sensor:
+                            doc.update(sensor=self.sensor, sensors=[self.sensor], ips=[entry['ip']])
+                        if self.ouis:
+                            self.ouis.enrich(doc)
+
+                        # Log to macwatch if this is what we were looking for
+                        if self.macwatch.act_on_mac(doc['_id']):
+                            macwatch_found_list.append(doc)
+                            self.metrics.incr('macwatch_hits')
+                            logger(doc['_id'], doc['ip'], 'DISCOVERED PREVIOUSLY UNSEEN DEVICE ON MACWATCH')
+
+                        # Append to new devices list
+                        new_devices_doc_list.append(doc)
+                        update_doc_list.append(doc)
+                        self.metrics.incr('devices_new')
+                        logger(doc['_id'], doc['ip'], 'DISCOVERED NEW DEVICE ON NETWORK')
+
+                    claims.setdefault((entry['ip'], entry.get('interface'), entry.get('scan')), []).append(doc)
+
+                # Update all the timestamps and write out the new devices. Basically
+                # if we found you and know about you already, we're just going to
+                # update the last seen timestamp and move on with our lives.
+                writer.put(update_doc_list, sightings if record_history else [], started)
+
+            # Wait for the last of the writes
+            failed = set()
+            conflicted = set()
+            for (batch_failed, batch_conflicted) in writer.close():
+                failed |= batch_failed
+                conflicted |= batch_conflicted
+
+            # Don't tell anybody about new devices we couldn't record,
+            # or that another sensor got in first with (they'll tell)
+            new_devices_doc_list = [doc for doc in new_devices_doc_list
+                                    if doc['_id'] not in failed and doc['_id'] not in conflicted]
+
+            # Clear out the non-persistent macwatch entries we just found
+            with self.metrics.phase('macwatch'):
+                self.macwatch.flush()
+
+        if writes_avoided:
+            syslog.syslog("Skipped writing %d unchanged devices" % writes_avoided)
+
+        # Anybody sharing an IP with somebody else?
+        duplicate_ip_doc_list = []
+        for ((ip, interface, scan), claimants) in sorted(claims.items()):
+            if len(claimants) > 1:
+                self.metrics.incr('duplicate_ips')
+                for doc in claimants:
+                    logger(doc['_id'], ip, 'DUPLICATE IP, CLAIMED BY %d DEVICES' % len(claimants))
+                    duplicate_ip_doc_list.append(dict(doc, ip=ip))
+
+        alerts_started = time.time()
 
         # Old device found? Form the alert.
-        message = "A device that we haven't seen for at least %d days just showed up\n"
+        message = "A device that we haven't seen for at least %d days just showed up\n" % self.ageout
         message += "on your network! Just thought you should know.\n"
         message += "\n"
         if len(old_devices_found_doc_list):
-            self.alert(old_devices_found_doc_list, message, "Long-lost Device Discovered!")
+            self.alert(old_devices_found_doc_list, message, "Long-lost Device Discovered!", 'old')
 
         # Cater to macwatch now.
         message = "A device which was manually placed in macwatch was just found\n"
-        message += "on your network! This message will repeat A LOT until you disable it\n"
+        message += "on your network! This message will keep repeating until you disable it\n"
         message += "manually! Unless you chose to not make this persistent, in which case\n"
         message += "this will most likely be the last message you see about this.\n"
         message += "\n"
         if len(macwatch_found_list):
-            self.alert(macwatch_found_list, message, "MACWATCH: Found Device!")
+            self.alert(macwatch_found_list, message, "MACWATCH: Found Device!", 'macwatch')
 
         # And finally, formulate an alert with new mac addresses we find
         message = "I discovered one or more devices using our network.\n"
@@ -281,8 +793,86 @@ class CouchCoop:
         message += "\n"
 
         if len(new_devices_doc_list):
-            self.alert(new_devices_doc_list, message, "New Device(s) found on network")
+            self.alert(new_devices_doc_list, message, "New Device(s) found on network", 'new')
+
+        # More than one device answering for the same IP is somebody
+        # spoofing ARP, or DHCP handing the same address out twice
+        message = "More than one device answered for the same IP address. That's either\n"
+        message += "somebody spoofing ARP or a DHCP/static addressing mixup.\n"
+        message += "\n"
+        if len(duplicate_ip_doc_list):
+            self.alert(duplicate_ip_doc_list, message, "Duplicate IP Address(es) on network", 'duplicate_ip')
+
+        message = "One or more devices we know about turned up on a different IP address.\n"
+        message += "\n"
+        if len(ip_changed_doc_list):
+            self.alert(ip_changed_doc_list, message, "Device(s) changed IP address", 'ip_change')
+
+        # Send everything off in one go
+        self.alerts.flush()
 
+        self.metrics.add_time('alerts', time.time() - alerts_started)
+        self.metrics.add_time('read_scan_data', time.time() - started)
+
+
+def date_to_database(datetime_obj):
+    """
+        Turns a datetime into the string we store in couchdb
+    """
+    return datetime_obj.strftime(DATE_FORMAT)
+
+def date_from_database(value):
+    """
+        Turns a date string from couchdb back into a datetime. Copes
+        with the old '%x %X' style dates too.
+    """
+    try:
+        return datetime.datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        return datetime.datetime.strptime(value, LEGACY_DATE_FORMAT)
+
+def normalize_date(value):
+    """
+        Returns a date string from couchdb in DATE_FORMAT. Those are
+        already fine and come straight back, it's only the old '%x %X'
+        style ones that need to be parsed and converted.
+    """
+    if value[4:5] == '-':
+        return value
+    return date_to_database(datetime.datetime.strptime(value, LEGACY_DATE_FORMAT))
+
+def same_doc(ours, theirs):
+    """
+        Is theirs what we were trying to write, revision aside?
+    """
+    return (dict((key, value) for (key, value) in ours.items() if key != '_rev') ==
+            dict((key, value) for (key, value) in theirs.items() if key != '_rev'))
+
+def merge_docs(ours, theirs):
+    """
+        Merges a device doc we tried to write with what somebody else
+        (another sensor, most likely) wrote in the meantime. Whichever
+        was seen last wins for ip, interface and the like, firstSeen
+        is the earliest of the two, and the sensors and ips that saw
+        it are put together.
+
+        Parms: ours -- the doc that conflicted
+               theirs -- the doc as it is in the database now
+        Returns: Dict: the merged doc, with theirs' _rev
+    """
+    ours_last = normalize_date(ours['lastSeen'])
+    theirs_last = normalize_date(theirs['lastSeen'])
+    (older, newer) = (theirs, ours) if ours_last >= theirs_last else (ours, theirs)
+
+    merged = dict(older)
+    merged.update(newer)
+    merged['_rev'] = theirs['_rev']
+    merged['lastSeen'] = max(ours_last, theirs_last)
+    merged['firstSeen'] = min(normalize_date(ours['firstSeen']), normalize_date(theirs['firstSeen']))
+    for field in ('sensors', 'ips'):
+        if field in ours or field in theirs:
+            merged[field] = sorted(set(ours.get(field, [])) | set(theirs.get(field, [])))
+    return merged
 
 def mail_exec(body, subj, m_from, m_to):
     """Does all the gruntwork for emailing data. Just
@@ -312,4 +902,4 @@ def logger(mac, address, status):
         This function simply forms the log message
         which will be sent to syslog for processing.
     """
-    syslog.syslog("%s was seen with the IP of %s STATUS: %s" % (mac, address, status))
+    log("%s was seen with the IP of %s STATUS: %s" % (mac, address, status))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""
+backfill v1.0
+Loads archived arp-scan output into the sauron database
+
+Years of arp-scan output saved off by hand or by cron before sauron
+came along is still a record of who was on the network and when.
+read_scan_data can't use it, it stamps everything with the time it
+runs and sends alerts, so instead:
+
+    backfill.py /var/log/arp-scans --storage http://localhost:5984
+
+reads every file in the directory, one arp-scan run per file, in the
+format get_macs reads. When each run happened comes from the file name
+(anything with a YYYYMMDD[HHMM[SS]] or YYYY-MM-DD[THH:MM[:SS]] in it,
+or an epoch time) or failing that from when the file was last changed.
+
+The files are split up between processes, one per core, and each
+boils its share down to one entry per mac: first and last time seen,
+the IP it had last, and every IP it had along the way. Those get
+merged together and written out chunk_size at a time, merged with
+whatever the database already has the same way two sensors would be
+(see merge_docs), so nothing already there moves backwards and it's
+safe to run over the same files twice. No alerts go out.
+"""
+
+import os
+import re
+import sys
+import time
+import datetime
+import multiprocessing
+from argparse import ArgumentParser
+from arpobj import CouchCoop, date_to_database, merge_docs
+from storage import chunks
+from sauron import parse_line
+from oui import OUIDatabase
+
+# YYYYMMDD, YYYY-MM-DD, optionally followed by HHMM[SS] or HH:MM[:SS]
+DATE_IN_NAME = re.compile(r'(?<!\d)(\d{4})-?(\d{2})-?(\d{2})(?:[T_ .-]?(\d{2}):?(\d{2})(?::?(\d{2}))?)?(?!\d)')
+# Or just the epoch time
+EPOCH_IN_NAME = re.compile(r'(?<!\d)(1\d{9})(?!\d)')
+
+
+def file_time(path):
+    """
+        When the scan in path was taken, going by its name if there's
+        a date in it and when it was last changed if not.
+
+        Returns: epoch time
+    """
+    name = os.path.basename(path)
+    match = EPOCH_IN_NAME.search(name)
+    if match:
+        return int(match.group(1))
+    match = DATE_IN_NAME.search(name)
+    if match:
+        fields = [int(field or 0) for field in match.groups()]
+        try:
+            return int(time.mktime(datetime.datetime(*fields).timetuple()))
+        except ValueError:
+            pass
+    return int(os.path.getmtime(path))
+
+def add_sighting(devices, mac, ip, oui, when):
+    """
+        Folds one sighting into devices, which maps
+        mac -> [first, last, ip at last, oui, {ip: None}]
+    """
+    device = devices.get(mac)
+    if device is None:
+        devices[mac] = [when, when, ip, oui, {ip: None}]
+        return
+    if when < device[0]:
+        device[0] = when
+    if when >= device[1]:
+        device[1] = when
+        device[2] = ip
+        device[3] = oui
+    device[4][ip] = None
+
+def merge_devices(devices, more):
+    """
+        Folds devices from another set of files into devices
+    """
+    for (mac, (first, last, ip, oui, ips)) in more.iteritems():
+        device = devices.get(mac)
+        if device is None:
+            devices[mac] = [first, last, ip, oui, ips]
+            continue
+        device[0] = min(device[0], first)
+        if last >= device[1]:
+            (device[1], device[2], device[3]) = (last, ip, oui)
+        device[4].update(ips)
+
+def read_files(paths):
+    """
+        Boils down every scan file in paths to one entry per mac, see
+        add_sighting. This is what each process runs.
+    """
+    devices = {}
+    for path in paths:
+        when = file_time(path)
+        with open(path) as f:
+            for line in f:
+                entry = parse_line(line)
+                if entry is not None:
+                    add_sighting(devices, entry['mac'].lower(), entry['ip'], entry['oui'], when)
+    return devices
+
+def read_directory(directory, processes=None, files_per_task=200):
+    """
+        Reads every file in directory, processes of them at once
+        (one per core if None).
+
+        Returns: Tuple: (number of files, devices as add_sighting has them)
+    """
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if os.path.isfile(os.path.join(directory, name)))
+    devices = {}
+    pool = multiprocessing.Pool(processes)
+    try:
+        for more in pool.imap_unordered(read_files, list(chunks(paths, files_per_task))):
+            merge_devices(devices, more)
+    finally:
+        pool.close()
+        pool.join()
+    return (len(paths), devices)
+
+def to_doc(mac, device):
+    """
+        A sauron doc for one of read_directory's devices
+    """
+    (first, last, ip, oui, ips) = device
+    return {'_id': mac, 'ip': ip, 'oui': oui, 'ips': sorted(ips),
+            'firstSeen': date_to_database(datetime.datetime.fromtimestamp(first)),
+            'lastSeen': date_to_database(datetime.datetime.fromtimestamp(last))}
+
+def backfill(macs, devices):
+    """
+        Writes devices into the database through the given CouchCoop,
+        chunk_size at a time, merged with what's already there.
+
+        Returns: Tuple: (written, unchanged, failed)
+    """
+    (written, unchanged, failed) = (0, 0, 0)
+    for chunk in chunks(sorted(devices), macs.chunk_size):
+        known_docs = macs.get_docs(chunk)
+        update_doc_list = []
+        for mac in chunk:
+            doc = to_doc(mac, devices[mac])
+            theirs = None
+            if mac in known_docs:
+                theirs = dict(known_docs[mac])
+                if theirs.get('ip'):
+                    doc['ips'] = sorted(set(doc['ips']) | set([theirs['ip']]))
+                doc = merge_docs(doc, theirs)
+            if macs.ouis:
+                macs.ouis.enrich(doc)
+            if doc == theirs:
+                unchanged += 1
+                continue
+            update_doc_list.append(doc)
+        errors = len(macs.save_docs(update_doc_list))
+        failed += errors
+        written += len(update_doc_list) - errors
+    return (written, unchanged, failed)
+
+
+def main():
+    parser = ArgumentParser(description='Load a directory of archived arp-scan output into the sauron database, without alerting.')
+    parser.add_argument('directory', metavar='DIR', help="Directory of arp-scan output, one scan per file, with when it was taken in the file name")
+    parser.add_argument('--storage', action="store", dest="storage", metavar="URL", help="Where the database is: sqlite:PATH for SQLite, or http://host:port for couchdb (the default, on localhost)")
+    parser.add_argument('--oui-db', action="store", dest="oui_db", metavar="FILE", help="Look vendors up in this database (see oui.py) instead of trusting the files")
+    parser.add_argument('--processes', action="store", type=int, dest="processes", help="Files to read at once, one per core by default")
+    parser.add_argument('--chunk-size', action="store", type=int, dest="chunk_size", help="Devices to write in each bulk request", default=1000)
+
+    options = parser.parse_args()
+
+    started = time.time()
+    (files, devices) = read_directory(options.directory, options.processes)
+    print "Read %d files, %d devices in %.1f seconds" % (files, len(devices), time.time() - started)
+
+    ouis = OUIDatabase(options.oui_db) if options.oui_db else None
+    macs = CouchCoop(chunk_size=options.chunk_size, ouis=ouis, storage=options.storage)
+    (written, unchanged, failed) = backfill(macs, devices)
+    macs.close()
+    print "Done {Written: [%d], unchanged: [%d], failed: [%d]} in %.1f seconds" % (
+        written, unchanged, failed, time.time() - started)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
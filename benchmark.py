@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+"""
+benchmark v1.0
+Measures how read_scan_data holds up as the network gets bigger
+
+No live CouchDB, arp-scan or MTA needed. Each run gets its own
+couchstub for the database, a synthetic network whose arp-scan
+output goes through the real parser, and an SMTP sink that just
+counts what it's sent. For each network size we do one cold scan
+(every device is new) and then a few warm ones with some churn,
+and report wall time, HTTP requests and bytes each way per scan.
+
+Save the results with --save and check a later run against them
+with --baseline to catch regressions in the hot path.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import smtpd
+import asyncore
+import tempfile
+import threading
+from argparse import ArgumentParser
+
+import sauron
+from arpobj import CouchCoop
+from pipeline import flush_log
+from couchstub import CouchStub
+
+# A handful of real looking vendor prefixes to hand out
+VENDORS = [
+    ('00:1b:63', 'Apple, Inc.'),
+    ('00:50:56', 'VMware, Inc.'),
+    ('3c:d9:2b', 'Hewlett Packard'),
+    ('b8:27:eb', 'Raspberry Pi Foundation'),
+    ('f4:f5:d8', 'Google, Inc.'),
+    ('00:1a:11', 'Google, Inc.'),
+    ('ac:de:48', '(Unknown)'),
+]
+
+
+class SMTPSink(smtpd.SMTPServer):
+    """
+        Accepts mail and throws it away, counting sessions and messages
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        smtpd.SMTPServer.__init__(self, (host, port), None)
+        self.address = "%s:%d" % self.socket.getsockname()
+        self.sessions = 0
+        self.messages = 0
+
+    def handle_accept(self):
+        self.sessions += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages += 1
+
+    def start(self):
+        thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def random_mac(rng, taken):
+    """
+        A mac from one of the VENDORS that isn't already taken
+    """
+    while True:
+        (prefix, vendor) = rng.choice(VENDORS)
+        mac = "%s:%02x:%02x:%02x" % (prefix, rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+        if mac not in taken:
+            taken.add(mac)
+            return (mac, vendor)
+
+def address(index):
+    """
+        The index'th host address in 10.0.0.0/16 (a /24 if it fits)
+    """
+    index += 1
+    return "10.0.%d.%d" % (index // 256, index % 256)
+
+def synthetic_network(size, rng):
+    """
+        Builds a network of size devices. Returns a dict of
+        ip -> (mac, vendor), which is what arp-scan would see.
+    """
+    taken = set()
+    return dict((address(index), random_mac(rng, taken)) for index in range(size))
+
+def churn(network, rate, rng):
+    """
+        Shakes up the network a bit between scans: rate of the devices
+        leave and are replaced by new ones, and another rate of them
+        swap addresses with each other, as if DHCP handed them out
+        again. Returns the new network.
+    """
+    network = dict(network)
+    taken = set(mac for (mac, vendor) in network.values())
+    count = int(len(network) * rate)
+
+    for ip in rng.sample(sorted(network), count):
+        network[ip] = random_mac(rng, taken)
+
+    moving = rng.sample(sorted(network), count - count % 2)
+    for (first, second) in zip(moving[::2], moving[1::2]):
+        (network[first], network[second]) = (network[second], network[first])
+
+    return network
+
+def arp_scan_output(network, rng, dup_rate=0.01):
+    """
+        Yields the lines arp-scan would print scanning this network,
+        header and footer included, with the odd (DUP: 2) thrown in.
+    """
+    yield "Interface: eth0, type: EN10MB, MAC: 00:11:22:33:44:55, IPv4: 10.0.0.1\n"
+    yield "Starting arp-scan 1.9.7 with %d hosts (https://github.com/royhills/arp-scan)\n" % len(network)
+    for ip in sorted(network, key=lambda ip: [int(octet) for octet in ip.split('.')]):
+        (mac, vendor) = network[ip]
+        yield "%s\t%s\t%s\n" % (ip, mac, vendor)
+        if rng.random() < dup_rate:
+            yield "%s\t%s\t%s (DUP: 2)\n" % (ip, mac, vendor)
+    yield "\n"
+    yield "%d packets received by filter, 0 packets dropped by kernel\n" % len(network)
+    yield "Ending arp-scan 1.9.7: %d hosts scanned in 1.000 seconds. %d responded\n" % (len(network), len(network))
+
+def run_size(size, scans, churn_rate, chunk_size, granularity, seed, sink, sqlite=False):
+    """
+        Benchmarks one network size against a fresh couchstub (or
+        SQLite file), sending alerts to sink. Returns a list of result
+        dicts, one per scan.
+    """
+    rng = random.Random(seed)
+    stub = CouchStub().start()
+    state_dir = tempfile.mkdtemp()
+    storage = 'sqlite:' + os.path.join(state_dir, 'sauron.db') if sqlite else None
+
+    macs = CouchCoop(server=stub.host, port=stub.port, chunk_size=chunk_size, granularity=granularity,
+                     storage=storage)
+    macs.alerts.smtp_host = sink.address
+    macs.alerts.state_file = os.path.join(state_dir, 'alerts.json')
+
+    results = []
+    network = synthetic_network(size, rng)
+    for scan in range(scans):
+        stub.reset_counters()
+        macs.metrics.reset()
+        (sessions, messages) = (sink.sessions, sink.messages)
+
+        started = time.time()
+        macs.read_scan_data(sauron.parse_lines(arp_scan_output(network, rng)))
+        # Count the time to get the mail and log lines out the door too
+        macs.alerts.close()
+        flush_log()
+        wall = time.time() - started
+
+        results.append({'size': size, 'scan': scan, 'wall': wall, 'requests': stub.requests,
+                        'bytes_sent': stub.bytes_in, 'bytes_received': stub.bytes_out,
+                        'smtp_sessions': sink.sessions - sessions, 'mails': sink.messages - messages,
+                        'timings': macs.metrics.snapshot()['timings']})
+        network = churn(network, churn_rate, rng)
+
+    macs.close()
+    stub.stop()
+    return results
+
+def check_baseline(results, baseline, tolerance):
+    """
+        Compares results against a saved run. Requests and bytes have
+        to match or go down, wall time gets some slack. Returns a list
+        of what got worse.
+    """
+    saved = dict(((entry['size'], entry['scan']), entry) for entry in baseline)
+    problems = []
+    for entry in results:
+        old = saved.get((entry['size'], entry['scan']))
+        if old is None:
+            continue
+        for field in ('requests', 'bytes_sent', 'bytes_received'):
+            # These should be the same run to run, give or take a
+            # few bytes of revision ids
+            if entry[field] > old[field] * 1.01:
+                problems.append("%d devices, scan %d: %s went from %d to %d" %
+                                (entry['size'], entry['scan'], field, old[field], entry[field]))
+        if entry['wall'] > old['wall'] * (1 + tolerance):
+            problems.append("%d devices, scan %d: wall time went from %.2fs to %.2fs" %
+                            (entry['size'], entry['scan'], old['wall'], entry['wall']))
+    return problems
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark read_scan_data against a local CouchDB stand-in.')
+    parser.add_argument('-s', '--sizes', action="store", dest="sizes", help="Comma separated network sizes to try", default='100,1000,10000,65000')
+    parser.add_argument('-n', '--scans', action="store", type=int, dest="scans", help="Scans per size, the first one is always cold", default=3)
+    parser.add_argument('-c', '--churn', action="store", type=float, dest="churn", help="Fraction of devices that come, go or move between scans", default=0.02)
+    parser.add_argument('--chunk-size', action="store", type=int, dest="chunk_size", help="CouchCoop chunk_size", default=1000)
+    parser.add_argument('-g', '--granularity', action="store", type=int, dest="granularity", help="CouchCoop granularity", default=0)
+    parser.add_argument('--sqlite', action="store_true", dest="sqlite", help="Use SQLite storage instead of the couchdb stand-in", default=False)
+    parser.add_argument('--seed', action="store", type=int, dest="seed", help="Random seed, so runs are comparable", default=1)
+    parser.add_argument('--save', action="store", dest="save", metavar="FILE", help="Save the results here as JSON")
+    parser.add_argument('--baseline', action="store", dest="baseline", metavar="FILE", help="Fail if anything got worse than the results saved here")
+    parser.add_argument('--tolerance', action="store", type=float, dest="tolerance", help="How much slower than the baseline is still OK", default=0.25)
+
+    options = parser.parse_args()
+
+    # asyncore only has the one socket map, so everything shares a sink
+    sink = SMTPSink().start()
+
+    results = []
+    print "%8s %5s %9s %9s %12s %12s %6s" % ('devices', 'scan', 'wall (s)', 'requests', 'sent (KB)', 'recv (KB)', 'mails')
+    for size in [int(size) for size in options.sizes.split(',')]:
+        for entry in run_size(size, options.scans, options.churn, options.chunk_size,
+                              options.granularity, options.seed, sink, options.sqlite):
+            print "%8d %5s %9.2f %9d %12.1f %12.1f %6d" % (
+                entry['size'], 'cold' if entry['scan'] == 0 else entry['scan'], entry['wall'],
+                entry['requests'], entry['bytes_sent'] / 1024.0, entry['bytes_received'] / 1024.0,
+                entry['mails'])
+            results.append(entry)
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            problems = check_baseline(results, json.load(f), options.tolerance)
+        for problem in problems:
+            print "REGRESSION: %s" % problem
+        if problems:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+
+"""
+couchstub v1.0
+A little in-process stand-in for CouchDB
+
+Implements just enough of the CouchDB HTTP API for everything sauron
+does: databases, documents, _all_docs, _bulk_docs, _changes, views and
+compaction. Everything lives in memory. It also counts the requests
+and bytes going each way, which is what benchmark.py reports on.
+
+Views can't run the javascript in a design document, so each view
+sauron uses has a python twin in VIEWS below. If you add a view to
+storage.py, add it here too.
+"""
+
+import json
+import uuid
+import threading
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+def by_lastseen(doc):
+    """ Mirrors sauron/by_lastseen """
+    if doc.get('lastSeen'):
+        yield (doc['lastSeen'], doc.get('ip'))
+
+def by_ip(doc):
+    """ Mirrors sauron/by_ip """
+    if doc.get('ip'):
+        yield (doc['ip'], doc.get('lastSeen'))
+
+# View name -> python version of its map function
+VIEWS = {
+    'sauron/by_lastseen': by_lastseen,
+    'sauron/by_ip': by_ip,
+}
+
+
+class StubDatabase:
+    def __init__(self):
+        """
+            One database: the latest revision of every doc (deleted
+            ones included, as tombstones) and the changes feed.
+        """
+        self.docs = {}
+        self.update_seq = 0
+        # id -> (seq, rev, deleted), latest change only like the real thing
+        self.changes = {}
+
+    def live(self, identifier):
+        """
+            Returns the doc, or None if it doesn't exist or was deleted
+        """
+        doc = self.docs.get(identifier)
+        if doc is None or doc.get('_deleted'):
+            return None
+        return doc
+
+    def save(self, doc):
+        """
+            Saves one doc, checking its revision the way CouchDB does.
+            Returns the same result dict _bulk_docs would.
+        """
+        identifier = doc.get('_id') or uuid.uuid4().hex
+        current = self.docs.get(identifier)
+        if current is None or current.get('_deleted'):
+            # New doc, or recreating a deleted one
+            if doc.get('_rev') and (current is None or doc['_rev'] != current['_rev']):
+                return {'id': identifier, 'error': 'conflict', 'reason': 'Document update conflict.'}
+        elif doc.get('_rev') != current['_rev']:
+            return {'id': identifier, 'error': 'conflict', 'reason': 'Document update conflict.'}
+
+        generation = int(current['_rev'].split('-')[0]) + 1 if current else 1
+        doc = dict(doc)
+        doc['_id'] = identifier
+        doc['_rev'] = '%d-%s' % (generation, uuid.uuid4().hex)
+        self.docs[identifier] = doc
+        self.update_seq += 1
+        self.changes[identifier] = (self.update_seq, doc['_rev'], bool(doc.get('_deleted')))
+        return {'id': identifier, 'rev': doc['_rev'], 'ok': True}
+
+    def info(self, name):
+        """
+            Roughly what GET /db returns
+        """
+        live = [doc for doc in self.docs.values() if not doc.get('_deleted')]
+        size = sum(len(json.dumps(doc)) for doc in self.docs.values())
+        return {'db_name': name, 'doc_count': len(live), 'doc_del_count': len(self.docs) - len(live),
+                'update_seq': self.update_seq, 'disk_size': size, 'data_size': size,
+                'sizes': {'file': size, 'active': size, 'external': size}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep quiet, we're only pretending
+        pass
+
+    def respond(self, code, content):
+        """
+            Sends content back as JSON, in a single write
+        """
+        body = json.dumps(content)
+        head = "%s %d %s\r\n" % (self.protocol_version, code, self.responses.get(code, ('',))[0])
+        head += "Content-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(body)
+        data = head if self.command == 'HEAD' else head + body
+        self.server.count(0, len(data))
+        self.wfile.write(data)
+
+    def request_parts(self):
+        """
+            Splits up the request. Returns (path parts, query, body)
+        """
+        url = urlparse.urlsplit(self.path)
+        parts = [urlparse.unquote(part) for part in url.path.split('/') if part]
+        query = dict((key, values[0]) for (key, values) in urlparse.parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        self.server.count(len(self.requestline) + len(str(self.headers)) + len(body), 0)
+        return (parts, query, json.loads(body) if body else None)
+
+    def do_HEAD(self):
+        self.handle_request()
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_PUT(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def do_DELETE(self):
+        self.handle_request()
+
+    def handle_request(self):
+        (parts, query, body) = self.request_parts()
+        with self.server.lock:
+            (code, content) = self.server.route(self.command, parts, query, body)
+        self.respond(code, content)
+
+
+class CouchStub(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+            Sets up the stand-in. Port 0 picks any free port, see
+            self.port. Call start() to get it answering requests.
+        """
+        HTTPServer.__init__(self, (host, port), StubHandler)
+        self.host = host
+        self.port = self.server_address[1]
+        self.databases = {}
+        self.lock = threading.Lock()
+        self.reset_counters()
+
+    def start(self):
+        """
+            Starts answering requests on a background thread
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset_counters(self):
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def count(self, bytes_in, bytes_out):
+        """
+            Keeps track of traffic. A request always comes in before
+            it goes out, so counting on the way in counts requests.
+        """
+        with self.lock:
+            if bytes_in:
+                self.requests += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def route(self, method, parts, query, body):
+        """
+            Works out what the request was after. Returns (status, content)
+        """
+        if not parts:
+            return (200, {'couchdb': 'Welcome', 'version': '2.3.1'})
+
+        name = parts[0]
+        if len(parts) == 1:
+            if method == 'PUT':
+                if name in self.databases:
+                    return (412, {'error': 'file_exists', 'reason': 'The database could not be created, the file already exists.'})
+                self.databases[name] = StubDatabase()
+                return (201, {'ok': True})
+            if name not in self.databases:
+                return (404, {'error': 'not_found', 'reason': 'Database does not exist.'})
+            if method == 'DELETE':
+                del self.databases[name]
+                return (200, {'ok': True})
+            return (200, self.databases[name].info(name))
+
+        db = self.databases.get(name)
+        if db is None:
+            return (404, {'error': 'not_found', 'reason': 'Database does not exist.'})
+
+        resource = parts[1]
+        if resource == '_all_docs':
+            return (200, self.all_docs(db, query, body))
+        elif resource == '_bulk_docs':
+            return (201, [db.save(doc) for doc in body['docs']])
+        elif resource == '_changes':
+            return (200, self.changes(db, query))
+        elif resource in ('_compact', '_view_cleanup', '_ensure_full_commit'):
+            return (202, {'ok': True})
+        elif resource == '_design' and len(parts) == 5 and parts[3] == '_view':
+            return self.view(db, '%s/%s' % (parts[2], parts[4]), query, body)
+        elif resource == '_design' and len(parts) == 4 and parts[3] == '_info':
+            return (200, {'name': parts[2], 'view_index': {'compact_running': False, 'disk_size': 0,
+                                                           'sizes': {'file': 0, 'active': 0}}})
+
+        return self.document(db, '/'.join(parts[1:]), method, query, body)
+
+    def document(self, db, identifier, method, query, body):
+        """
+            Plain old document GET/HEAD/PUT/DELETE
+        """
+        if method == 'PUT':
+            body['_id'] = identifier
+            result = db.save(body)
+            return (409, result) if 'error' in result else (201, result)
+        elif method == 'DELETE':
+            result = db.save({'_id': identifier, '_rev': query.get('rev'), '_deleted': True})
+            return (409, result) if 'error' in result else (200, result)
+
+        doc = db.live(identifier)
+        if doc is None:
+            return (404, {'error': 'not_found', 'reason': 'missing'})
+        return (200, doc)
+
+    def all_docs(self, db, query, body):
+        """
+            _all_docs, either for a list of keys or a range
+        """
+        include_docs = query.get('include_docs') == 'true'
+        rows = []
+        if body and 'keys' in body:
+            for key in body['keys']:
+                doc = db.docs.get(key)
+                if doc is None:
+                    rows.append({'key': key, 'error': 'not_found'})
+                elif doc.get('_deleted'):
+                    rows.append({'id': key, 'key': key, 'value': {'rev': doc['_rev'], 'deleted': True}, 'doc': None})
+                else:
+                    row = {'id': key, 'key': key, 'value': {'rev': doc['_rev']}}
+                    if include_docs:
+                        row['doc'] = doc
+                    rows.append(row)
+            return {'total_rows': len(db.docs), 'offset': 0, 'rows': rows}
+
+        for identifier in sorted(db.docs):
+            doc = db.docs[identifier]
+            if not doc.get('_deleted'):
+                row = {'id': identifier, 'key': identifier, 'value': {'rev': doc['_rev']}}
+                if include_docs:
+                    row['doc'] = doc
+                rows.append(row)
+        return {'total_rows': len(rows), 'offset': 0, 'rows': page(rows, query)}
+
+    def changes(self, db, query):
+        """
+            A normal (non-continuous) _changes feed
+        """
+        since = int(query.get('since') or 0)
+        include_docs = query.get('include_docs') == 'true'
+        results = []
+        for (identifier, (seq, rev, deleted)) in sorted(db.changes.items(), key=lambda item: item[1][0]):
+            if seq <= since:
+                continue
+            change = {'seq': seq, 'id': identifier, 'changes': [{'rev': rev}]}
+            if deleted:
+                change['deleted'] = True
+            if include_docs:
+                change['doc'] = db.docs[identifier]
+            results.append(change)
+        return {'results': results, 'last_seq': db.update_seq}
+
+    def view(self, db, name, query, body):
+        """
+            Runs one of the VIEWS over every doc
+        """
+        (design, view) = name.split('/')
+        if db.live('_design/' + design) is None or name not in VIEWS:
+            return (404, {'error': 'not_found', 'reason': 'missing_named_view'})
+
+        rows = []
+        for (identifier, doc) in db.docs.items():
+            if doc.get('_deleted') or identifier.startswith('_design/'):
+                continue
+            for (key, value) in VIEWS[name](doc):
+                rows.append({'id': identifier, 'key': key, 'value': value})
+        rows.sort(key=lambda row: (row['key'], row['id']))
+
+        if body and 'keys' in body:
+            keys = body['keys']
+            rows = [row for row in rows if row['key'] in keys]
+        if 'key' in query:
+            key = json.loads(query['key'])
+            rows = [row for row in rows if row['key'] == key]
+        total_rows = len(rows)
+        rows = page(rows, query)
+
+        if query.get('include_docs') == 'true':
+            for row in rows:
+                row['doc'] = db.docs[row['id']]
+        return (200, {'total_rows': total_rows, 'offset': 0, 'rows': rows})
+
+
+def page(rows, query):
+    """
+        Applies startkey/endkey/startkey_docid/descending/skip/limit
+        to a list of sorted rows
+    """
+    if query.get('descending') == 'true':
+        rows = rows[::-1]
+        (before, after) = (lambda a, b: a > b, lambda a, b: a < b)
+    else:
+        (before, after) = (lambda a, b: a < b, lambda a, b: a > b)
+
+    for option in ('startkey', 'start_key'):
+        if option in query:
+            start = json.loads(query[option])
+            start_docid = query.get('startkey_docid')
+            rows = [row for row in rows if not before(row['key'], start) and
+                    not (row['key'] == start and start_docid is not None and row['id'] < start_docid)]
+    for option in ('endkey', 'end_key'):
+        if option in query:
+            end = json.loads(query[option])
+            rows = [row for row in rows if not after(row['key'], end)]
+
+    skip = int(query.get('skip') or 0)
+    rows = rows[skip:]
+    if 'limit' in query:
+        rows = rows[:int(query['limit'])]
+    return rows
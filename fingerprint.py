@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+fingerprint v1.0
+Remembers what the last scan saw, so a run that sees the same thing
+can leave the database alone
+
+On a quiet network most runs find exactly the same devices on exactly
+the same IPs as the run before, and with --granularity there's nothing
+to write for any of them, yet every one still gets looked up. With
+sauron.py --fingerprint FILE, each scan is boiled down to the sorted
+set of its (mac, ip) pairs, 48 and 32 bit integers, and a hash of them,
+kept in FILE. Then for the next --granularity minutes after the last
+time everything was written:
+
+    same hash as last time -- the database isn't touched at all
+    different              -- only the devices that turned up or
+                              changed IP since last time go through
+                              read_scan_data
+
+Either way, every device on an IP that more than one mac answered
+for goes through too, so duplicate IPs are still alerted on.
+
+After that, the next scan goes through in full so every lastSeen gets
+bumped, same as it would without this. A device that left doesn't
+need anything done about it, it's only forgotten from the fingerprint.
+
+Anything that only changes in the database, like a mac added to
+macwatch, can take up to --granularity minutes to be noticed.
+"""
+
+import os
+import time
+import socket
+import struct
+import hashlib
+from metrics import write_atomic
+from sightings import mac_to_int, ip_to_int
+
+MAGIC = 'SAURFP01'
+# Last time everything was written, number of pairs, sha1 of the pairs
+HEADER = struct.Struct('<dI20s')
+PAIR = struct.Struct('<QI')
+
+
+class ScanFingerprint:
+    def __init__(self, path):
+        """
+            Loads the fingerprint at path, if there is one yet
+        """
+        self.path = path
+        self.refreshed = None
+        self.digest = None
+        self.pairs = frozenset()
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError("%s is not a scan fingerprint" % path)
+        (self.refreshed, count, self.digest) = HEADER.unpack_from(data, len(MAGIC))
+        start = len(MAGIC) + HEADER.size
+        self.pairs = frozenset(PAIR.unpack_from(data, start + index * PAIR.size) for index in xrange(count))
+
+    def compare(self, entries, window, now=None):
+        """
+            Works out how much of a scan needs to go to the database.
+
+            Parms: entries -- list of device dicts from the scan
+                   window -- minutes everything can go without being
+                       written, see --granularity
+            Returns: Tuple: (entries to ingest, whether that's all of them)
+        """
+        now = now or time.time()
+        if self.refreshed is None or now - self.refreshed >= window * 60:
+            return (entries, True)
+        # More than one mac on an IP always goes through, so
+        # read_scan_data can alert on it
+        shared = shared_ips(entries)
+        pairs = pair_set(entries)
+        if digest(pairs) == self.digest and not shared:
+            return ([], False)
+        return ([entry for entry in entries
+                 if pair_of(entry) not in self.pairs or claim_of(entry) in shared], False)
+
+    def update(self, entries, full, now=None):
+        """
+            Remembers entries as the last scan, once it's in the
+            database. full says whether all of it was written, which
+            starts the window over.
+        """
+        if full or self.refreshed is None:
+            self.refreshed = now or time.time()
+        pairs = pair_set(entries)
+        self.digest = digest(pairs)
+        self.pairs = frozenset(pairs)
+        write_atomic(self.path, MAGIC + HEADER.pack(self.refreshed, len(pairs), self.digest) +
+                     ''.join(PAIR.pack(*pair) for pair in sorted(pairs)))
+
+
+def pair_of(entry):
+    """
+        (mac, ip) of a scan entry as integers, None if either is bogus
+    """
+    try:
+        return (mac_to_int(entry['mac']), ip_to_int(entry['ip']))
+    except (ValueError, KeyError, socket.error):
+        return None
+
+def claim_of(entry):
+    """
+        What read_scan_data counts as one IP, see its claims
+    """
+    return (entry.get('ip'), entry.get('interface'))
+
+def shared_ips(entries):
+    """
+        Every claim_of more than one mac in entries
+    """
+    claimants = {}
+    for entry in entries:
+        claimants.setdefault(claim_of(entry), set()).add(entry.get('mac'))
+    return set(claim for (claim, macs) in claimants.items() if len(macs) > 1)
+
+def pair_set(entries):
+    return set(pair for pair in (pair_of(entry) for entry in entries) if pair is not None)
+
+def digest(pairs):
+    return hashlib.sha1(''.join(PAIR.pack(*pair) for pair in sorted(pairs))).digest()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+journal v1.0
+Write-behind journal of scans, so the database can't lose us one
+
+With sauron.py --journal DIR, every scan goes to disk before the
+database ever hears about it. Each scan is its own file in DIR,
+a line of JSON per device, written as the scan comes in and only
+fsync'd every sync_every devices and once at the end. It's named
+<epoch ms>-<pid>.part while being written and renamed to .scan once
+it's all safely down, so a half written scan is never replayed.
+
+replay() then hands every finished scan to CouchCoop.read_scan_data,
+oldest first, a bunch of them at a time rolled into one pass: the
+latest sighting of each device wins, and the earliest is kept for
+firstSeen. Every scan's sightings still go into the history (see
+sightings.py) on their own, so an outage doesn't leave a hole in it.
+A scan's file is only removed once the database has it.
+read_scan_data never moves a device backwards in time, so if we die
+in between, replaying the same scan again does no harm.
+
+If the database is down or slow, the scans just wait here until it
+isn't. Only one process replays at a time, anybody else leaves it
+to them.
+"""
+
+import os
+import json
+import time
+import fcntl
+import syslog
+
+SUFFIX = '.scan'
+PARTIAL_SUFFIX = '.part'
+LOCK_NAME = '.lock'
+
+
+class ScanJournal:
+    def __init__(self, directory, sync_every=1000, max_scans=50):
+        """
+            Parms:
+                directory = where the scans are kept
+                sync_every = devices written between fsyncs
+                max_scans = most scans rolled into a single
+                    read_scan_data when replaying
+        """
+        self.directory = directory
+        self.sync_every = sync_every
+        self.max_scans = max_scans
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, scan_data, when=None):
+        """
+            Writes a scan to the journal as it comes in.
+
+            Parms: scan_data -- iterable of device dicts, like get_macs
+                   when -- epoch time of the scan, now if None
+            Returns: Number of devices written
+        """
+        when = when or time.time()
+        name = "%013d-%d" % (when * 1000, os.getpid())
+        partial = os.path.join(self.directory, name + PARTIAL_SUFFIX)
+
+        count = 0
+        try:
+            with open(partial, 'w') as f:
+                f.write(json.dumps({'time': when}) + "\n")
+                for entry in scan_data:
+                    f.write(json.dumps(entry) + "\n")
+                    count += 1
+                    if count % self.sync_every == 0:
+                        f.flush()
+                        os.fsync(f.fileno())
+                f.flush()
+                os.fsync(f.fileno())
+        except:
+            # A scan that fell over part way isn't worth keeping
+            os.unlink(partial)
+            raise
+
+        os.rename(partial, os.path.join(self.directory, name + SUFFIX))
+        self.sync_directory()
+        return count
+
+    def sync_directory(self):
+        """
+            Makes sure renames and removals in the directory stick
+        """
+        descriptor = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    def pending(self):
+        """
+            Returns: List of paths to finished scans, oldest first
+        """
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.endswith(SUFFIX)]
+
+    def read(self, path):
+        """
+            Reads a scan back. A line that didn't make it all the way
+            to disk is skipped.
+
+            Returns: Tuple: (epoch time, list of device dicts)
+        """
+        entries = []
+        with open(path) as f:
+            when = json.loads(f.readline())['time']
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return (when, entries)
+
+    def merge(self, paths):
+        """
+            Rolls a bunch of scans into one, oldest first, so each
+            device ends up with its latest sighting as 'seen' and its
+            earliest as 'first_seen', and which scan that was as 'scan'
+            (so two devices on one IP in different scans aren't taken
+            for a duplicate).
+
+            Returns: Tuple: (list of device dicts, list of (mac, ip,
+                     when) for every sighting in every scan)
+        """
+        devices = {}
+        sightings = []
+        for path in paths:
+            (when, entries) = self.read(path)
+            for entry in entries:
+                previous = devices.get(entry['mac'])
+                entry['seen'] = when
+                entry['scan'] = os.path.basename(path)
+                entry['first_seen'] = previous['first_seen'] if previous else when
+                devices[entry['mac']] = entry
+                sightings.append((entry['mac'], entry['ip'], when))
+        return (devices.values(), sightings)
+
+    def replay(self, macs):
+        """
+            Applies every finished scan to the database through the
+            given CouchCoop, max_scans at a time, removing each scan
+            once it's in. Gives up (leaving the rest for next time) if
+            the database falls over, and does nothing if another
+            process is already replaying.
+
+            Returns: Number of scans applied
+        """
+        lock = open(os.path.join(self.directory, LOCK_NAME), 'w')
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                syslog.syslog("Journal is already being replayed, leaving it to them")
+                return 0
+
+            applied = 0
+            pending = self.pending()
+            while pending:
+                (batch, pending) = (pending[:self.max_scans], pending[self.max_scans:])
+                (devices, sightings) = self.merge(batch)
+                # The history gets every scan, not just the last one
+                macs.read_scan_data(devices, record_history=False)
+                if macs.history:
+                    with macs.metrics.phase('history'):
+                        macs.history.record(sightings)
+                for path in batch:
+                    os.unlink(path)
+                self.sync_directory()
+                applied += len(batch)
+                macs.metrics.incr('journal_replayed', len(batch))
+            return applied
+        finally:
+            lock.close()
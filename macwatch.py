@@ -5,21 +5,55 @@
 """
 
 import re
+import sys
 from arpobj import MacWatch
+from storage import open_storage
 from argparse import ArgumentParser
 
 def convert_mac_to_proper(mac):
     """
         Converts any mac address to a flat format
-        and then formatted back to the correct format
+        and then formatted back to the correct format.
+        Returns '' if it isn't a mac address.
     """
     mac = mac.replace('-', '')
     mac = mac.replace('.', '')
     mac = mac.replace(':', '')
     mac = mac.lower()
-    if not len(mac) == 12:
+    if not len(mac) == 12 or not re.match(r'^[0-9a-f]{12}$', mac):
         return ''
-    
+    return ':'.join(mac[position:position + 2] for position in range(0, 12, 2))
+
+def read_macs(lines, persistent=False):
+    """
+        Reads macs out of an import file. One per line, in any
+        notation convert_mac_to_proper understands, optionally
+        followed by "persistent" or "transient". Blank lines and
+        anything after a # are ignored.
+
+        Parms: lines -- lines of the file
+               persistent -- for lines that don't say either way
+        Returns: Tuple: (list of (mac, persistent), list of bad lines)
+    """
+    entries = []
+    bad = []
+    for (number, line) in enumerate(lines, 1):
+        fields = line.split('#', 1)[0].replace(',', ' ').split()
+        if not fields:
+            continue
+        mac = convert_mac_to_proper(fields[0])
+        flag = fields[1].lower() if len(fields) > 1 else None
+        if not mac or flag not in (None, 'persistent', 'transient') or len(fields) > 2:
+            bad.append((number, line.rstrip('\r\n')))
+            continue
+        entries.append((mac, persistent if flag is None else flag == 'persistent'))
+    return (entries, bad)
+
+def open_file(path, mode):
+    """ Opens path, or stdin/stdout if it's - """
+    if path == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    return open(path, mode)
 
 
 def main():
@@ -29,29 +63,55 @@ def main():
     mutually_exclusive_group.add_argument('-a', '--add', action="store", dest="add", metavar="ma:ca:dd:re:ss:00", help="Add MAC Address to macwatch database")
     mutually_exclusive_group.add_argument('-d', '--del', action="store", dest="delete", metavar="ma:ca:dd:re:ss:00", help="Deletes MAC Address from macwatch database")
     mutually_exclusive_group.add_argument('-s', '--show', action="store_true", dest="show", help="Dump macwatch database", default=False)
+    mutually_exclusive_group.add_argument('-i', '--import', action="store", dest="import_file", metavar="FILE", help="Add every MAC in FILE (one per line, - for stdin), optionally followed by persistent or transient")
+    mutually_exclusive_group.add_argument('-e', '--export', action="store", dest="export_file", metavar="FILE", help="Write the macwatch database to FILE (- for stdout) in the format --import reads")
+    parser.add_argument('--storage', action="store", dest="storage", metavar="URL", help="Where the database is: sqlite:PATH for SQLite, or http://host:port for couchdb (the default, on localhost)")
     parser.add_argument('-p', '--make-persistent', action="store_true", dest="persistent", help="When adding a MAC, delete after found or keep alerting?", default=False)
 
     options=parser.parse_args()
 
-    db = MacWatch()
+    db = MacWatch(storage=open_storage(options.storage) if options.storage else None)
 
     if options.add:
-        db.add_mac(options.add, options.persistent)
-        print "Done {Add: [%s], make_persistent: [%s]}" % (options.add, options.persistent)
+        mac = convert_mac_to_proper(options.add)
+        if not mac:
+            parser.error("%s is not a MAC address" % options.add)
+        db.add_mac(mac, options.persistent)
+        print "Done {Add: [%s], make_persistent: [%s]}" % (mac, options.persistent)
     elif options.delete:
-        db.del_mac(options.delete)
-        print "Done {Del: [%s]}" % options.delete
+        mac = convert_mac_to_proper(options.delete) or options.delete
+        db.del_mac(mac)
+        print "Done {Del: [%s]}" % mac
     elif options.show:
         print "Showing MacWatch Database:"
-        if db.maclist():
-            for row in db.maclist():
-                print row
-        else:
+        empty = True
+        for (mac, persistent) in db.iter_macs():
+            empty = False
+            print "%s%s" % (mac, " (persistent)" if persistent else "")
+        if empty:
             print "MacWatch database is empty."
+    elif options.import_file:
+        f = open_file(options.import_file, 'r')
+        (entries, bad) = read_macs(f, options.persistent)
+        for (number, line) in bad:
+            print >> sys.stderr, "Line %d: can't make sense of %r, skipping it" % (number, line)
+        failed = db.add_macs(entries)
+        for (mac, exc) in failed:
+            print >> sys.stderr, "Couldn't add %s: %s" % (mac, exc)
+        print "Done {Imported: [%d], skipped: [%d], failed: [%d]}" % (len(entries) - len(failed), len(bad), len(failed))
+    elif options.export_file:
+        f = open_file(options.export_file, 'w')
+        exported = 0
+        for (mac, persistent) in db.iter_macs():
+            f.write("%s %s\n" % (mac, "persistent" if persistent else "transient"))
+            exported += 1
+        if f is not sys.stdout:
+            f.close()
+            print "Done {Exported: [%d]}" % exported
 
     else:
         parser.print_help()
-        
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+metrics v1.0
+Timings and counters for a sauron run
+
+Every phase of a run (waiting on arp-scan, the couchdb lookups and
+updates, macwatch, alerts) is timed, and the interesting numbers
+(devices seen, new devices, writes, HTTP requests, conflicts...) are
+counted. At the end of a run they can be written out as a Prometheus
+textfile for node_exporter to pick up, or as plain JSON.
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from storage import RetryingSession
+
+
+class Metrics:
+    def __init__(self):
+        """
+            Starts out with nothing timed or counted. The scanner
+            threads add to these too, hence the lock.
+        """
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+            Clears everything out, ready for the next run
+        """
+        with self.lock:
+            # phase -> seconds spent in it
+            self.timings = {}
+            # name -> count
+            self.counters = {}
+            self.started = time.time()
+
+    def add_time(self, phase, seconds):
+        """
+            Adds seconds to the time spent in phase
+        """
+        with self.lock:
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def incr(self, name, count=1):
+        """
+            Bumps a counter
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    @contextmanager
+    def phase(self, phase):
+        """
+            Times whatever runs inside the with block:
+
+                with metrics.phase('lookup'):
+                    ...
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start)
+
+    def timed(self, phase, iterable):
+        """
+            Passes iterable through untouched, counting the time spent
+            waiting on each item against phase. This is how we time
+            arp-scan, since we're reading it while it's still running.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(phase, time.time() - start)
+                return
+            self.add_time(phase, time.time() - start)
+            yield item
+
+    def snapshot(self):
+        """
+            Returns everything collected so far as a dict
+        """
+        with self.lock:
+            return {'started': self.started,
+                    'elapsed': time.time() - self.started,
+                    'timings': dict(self.timings),
+                    'counters': dict(self.counters)}
+
+    def write_json(self, path):
+        """
+            Writes a snapshot out as JSON
+        """
+        write_atomic(path, json.dumps(self.snapshot(), indent=2, sort_keys=True) + "\n")
+
+    def write_prometheus(self, path):
+        """
+            Writes a snapshot out in the Prometheus text format, for
+            node_exporter's textfile collector.
+        """
+        snapshot = self.snapshot()
+        lines = ["# HELP sauron_phase_seconds Seconds spent in each phase of the last run",
+                 "# TYPE sauron_phase_seconds gauge"]
+        for (phase, seconds) in sorted(snapshot['timings'].items()):
+            lines.append('sauron_phase_seconds{phase="%s"} %f' % (phase, seconds))
+
+        lines.append("# HELP sauron_run_count Counters from the last run")
+        lines.append("# TYPE sauron_run_count gauge")
+        for (name, count) in sorted(snapshot['counters'].items()):
+            lines.append('sauron_run_count{counter="%s"} %d' % (name, count))
+
+        lines.append("# HELP sauron_last_run_timestamp_seconds When the last run started")
+        lines.append("# TYPE sauron_last_run_timestamp_seconds gauge")
+        lines.append("sauron_last_run_timestamp_seconds %f" % snapshot['started'])
+        lines.append("# HELP sauron_last_run_duration_seconds How long the last run took")
+        lines.append("# TYPE sauron_last_run_duration_seconds gauge")
+        lines.append("sauron_last_run_duration_seconds %f" % snapshot['elapsed'])
+
+        write_atomic(path, "\n".join(lines) + "\n")
+
+
+class CountingSession(RetryingSession):
+    """
+        A couchdb HTTP session that counts every request it makes
+        in the http_requests counter of a Metrics, and every retry
+        in http_retries.
+    """
+    def __init__(self, metrics, **kwargs):
+        RetryingSession.__init__(self, **kwargs)
+        self.metrics = metrics
+
+    def request(self, method, url, *args, **kwargs):
+        self.metrics.incr('http_requests')
+        return RetryingSession.request(self, method, url, *args, **kwargs)
+
+    def retrying(self, method, url, error, delay):
+        self.metrics.incr('http_retries')
+        RetryingSession.retrying(self, method, url, error, delay)
+
+
+def write_atomic(path, data):
+    """
+        Writes to a temporary file and renames it over path, so
+        anything reading the file never sees half of it.
+    """
+    with open(path + '.tmp', 'w') as f:
+        f.write(data)
+    os.rename(path + '.tmp', path)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+"""
+oui v1.0
+Local vendor lookups from the IEEE registries
+
+arp-scan's idea of a vendor depends on which version is installed and
+how old its ieee-oui.txt is, and a device that came in as (Unknown)
+stays that way forever. Instead, build a database from the IEEE
+registries once:
+
+    oui.py build /usr/local/share/sauron/oui.db oui.csv mam.csv oui36.csv
+
+(from https://standards-oui.ieee.org, MA-L, MA-M and MA-S, either the
+.csv or .txt versions, or arp-scan's own ieee-oui.txt) and hand it to
+sauron.py with --oui-db.
+
+The MA-L, MA-M and MA-S blocks nest inside each other, so building
+flattens them into a sorted list of where each vendor's range starts,
+most specific assignment winning. A lookup is then a single bisect.
+The file is just those starts and vendor numbers as packed arrays,
+followed by the vendor names, so loading it is a couple of reads.
+"""
+
+import re
+import csv
+import sys
+import array
+import bisect
+import struct
+from argparse import ArgumentParser
+from metrics import write_atomic
+from sightings import mac_to_int
+
+MAGIC = 'SAUROUI1'
+HEADER = struct.Struct('<II')
+# Vendor number for a range nobody has been assigned
+NO_VENDOR = -1
+
+# Bits of prefix each registry hands out
+REGISTRY_BITS = {'MA-L': 24, 'MA-M': 28, 'MA-S': 36}
+
+# The IEEE .txt registries give each assignment as a pair of lines:
+#     00-11-22   (hex)        Vendor
+#     001122     (base 16)    Vendor
+# or, for MA-M and MA-S, where the second line has the rest of it:
+#     70-B3-D5   (hex)        Vendor
+#     F4F000-F4FFFF (base 16) Vendor
+HEX_LINE = re.compile(r'^\s*([0-9A-Fa-f]{2}-[0-9A-Fa-f]{2}-[0-9A-Fa-f]{2})\s+\(hex\)')
+BASE16_LINE = re.compile(r'^\s*([0-9A-Fa-f]{6})(?:-([0-9A-Fa-f]{6}))?\s+\(base 16\)\s*(\S.*?)\s*$')
+# Anything else is a prefix, maybe with a length, and a vendor:
+#     001122<tab>Vendor  or  00:11:22:33:40/28 Vendor
+PREFIX_LINE = re.compile(r'^\s*([0-9A-Fa-f]{2}(?:[-:]?[0-9A-Fa-f]{1,2}){2,5})(?:/(\d+))?\s+(\S.*?)\s*$')
+
+# Second lowest bit of the first octet
+LOCAL_BIT = 0x02 << 40
+
+
+class OUIDatabase:
+    def __init__(self, path):
+        """
+            Loads a database written by build()
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not an OUI database" % path)
+            (count, names_length) = HEADER.unpack(f.read(HEADER.size))
+            # array has no 64 bit integer type in python 2, but a
+            # double holds a 48 bit mac exactly
+            starts = array.array('d')
+            starts.fromfile(f, count)
+            vendors = array.array('i')
+            vendors.fromfile(f, count)
+            names = f.read(names_length).decode('utf-8')
+        if sys.byteorder == 'big':
+            starts.byteswap()
+            vendors.byteswap()
+
+        # bisect is quickest over a list of ints
+        self.starts = [int(start) for start in starts]
+        self.vendors = vendors
+        self.names = names.split('\n') if names else []
+
+        # Most MA-L blocks belong to one vendor from end to end, so
+        # those can skip the bisect. Any block something starts part
+        # way through has to take the long way round.
+        split = set(start >> 24 for start in self.starts if start & 0xffffff)
+        self.blocks = dict((start >> 24, vendor) for (start, vendor) in zip(self.starts, vendors)
+                           if not start & 0xffffff and start >> 24 not in split)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup(self, mac):
+        """
+            Returns the vendor for mac (a string in any notation
+            mac_to_int takes, or an int), or None if it isn't
+            assigned to anybody. Locally administered addresses
+            never are.
+        """
+        if not isinstance(mac, (int, long)):
+            mac = mac_to_int(mac)
+        if mac & LOCAL_BIT:
+            return None
+        vendor = self.blocks.get(mac >> 24)
+        if vendor is None:
+            position = bisect.bisect_right(self.starts, mac) - 1
+            vendor = self.vendors[position] if position >= 0 else NO_VENDOR
+        if vendor == NO_VENDOR:
+            return None
+        return self.names[vendor]
+
+    def enrich(self, doc):
+        """
+            Fills in the vendor of a sauron doc from the registry, and
+            flags it if its mac is locally administered (randomized,
+            most likely). A vendor the registry doesn't know about is
+            left alone.
+
+            Returns: True if the doc changed
+        """
+        changed = False
+        mac = mac_to_int(doc['_id'])
+        vendor = self.lookup(mac)
+        if vendor is not None and doc.get('oui') != vendor:
+            doc['oui'] = vendor
+            changed = True
+        if mac & LOCAL_BIT and not doc.get('local'):
+            doc['local'] = True
+            changed = True
+        return changed
+
+
+def is_local(mac):
+    """ Is this a locally administered (randomized, usually) mac? """
+    return bool(mac_to_int(mac) & LOCAL_BIT)
+
+def prefix_range(prefix, bits):
+    """
+        Turns a hex prefix into the range of macs it covers.
+        Returns: Tuple: (start, end), end not included
+    """
+    value = int(prefix, 16) >> (len(prefix) * 4 - bits)
+    start = value << (48 - bits)
+    return (start, start + (1 << (48 - bits)))
+
+def parse_registry(path):
+    """
+        Reads an IEEE registry, in the .csv or .txt format, or a
+        list of prefixes and vendors like arp-scan's ieee-oui.txt.
+
+        Yields: Tuple: (start, end, vendor)
+    """
+    with open(path, 'rb') as f:
+        first = f.readline()
+        f.seek(0)
+        if first.startswith('Registry,'):
+            for row in csv.DictReader(f):
+                bits = REGISTRY_BITS.get(row['Registry'])
+                vendor = row['Organization Name'].decode('utf-8', 'replace').strip()
+                if bits and vendor:
+                    (start, end) = prefix_range(row['Assignment'], bits)
+                    yield (start, end, vendor)
+            return
+
+        # MA-L part of the assignment, from the last (hex) line
+        block = None
+        for line in f:
+            if line.startswith('#'):
+                continue
+            match = HEX_LINE.match(line)
+            if match:
+                block = match.group(1).replace('-', '')
+                continue
+
+            match = BASE16_LINE.match(line)
+            if match:
+                vendor = match.group(3).decode('utf-8', 'replace')
+                if not match.group(2):
+                    (start, end) = prefix_range(match.group(1), 24)
+                    yield (start, end, vendor)
+                elif block:
+                    start = (int(block, 16) << 24) | int(match.group(1), 16)
+                    end = (int(block, 16) << 24) | int(match.group(2), 16)
+                    yield (start, end + 1, vendor)
+                continue
+
+            match = PREFIX_LINE.match(line)
+            if match:
+                digits = re.sub(r'[:\-]', '', match.group(1))
+                bits = int(match.group(2)) if match.group(2) else len(digits) * 4
+                (start, end) = prefix_range(digits, bits)
+                yield (start, end, match.group(3).decode('utf-8', 'replace'))
+
+def flatten(assignments):
+    """
+        Turns nested (start, end, vendor) assignments into where each
+        vendor's stretch starts, the most specific assignment winning
+        wherever they overlap (the first one given, if there's a tie).
+
+        Returns: List of Tuples: (start, vendor or None)
+    """
+    points = []
+    # Assignments that are still open, each inside the one before
+    stack = []
+
+    def close(position):
+        while stack and stack[-1][1] <= position:
+            closed = stack.pop()
+            points.append((closed[1], stack[-1][2] if stack else None))
+
+    # Biggest first where two start at the same place. Where two are
+    # the same size, the one that came first goes on top.
+    ordered = sorted(enumerate(assignments), key=lambda (index, a): (a[0], a[0] - a[1], -index))
+    for (index, (start, end, vendor)) in ordered:
+        close(start)
+        stack.append((start, end, vendor))
+        points.append((start, vendor))
+    close(1 << 48)
+
+    # Where two points land on the same spot the later one wins, and
+    # there's no point in a start that doesn't change the vendor
+    flat = []
+    for (position, vendor) in sorted(points, key=lambda point: point[0]):
+        if flat and flat[-1][0] == position:
+            flat.pop()
+        if not flat or flat[-1][1] != vendor:
+            flat.append((position, vendor))
+    return flat
+
+def build(path, sources):
+    """
+        Builds a database at path from the given registry files.
+        Returns: Number of assignments read
+    """
+    assignments = []
+    for source in sources:
+        assignments.extend(parse_registry(source))
+    flat = flatten(assignments)
+
+    names = sorted(set(vendor for (start, vendor) in flat if vendor is not None))
+    numbers = dict((name, number) for (number, name) in enumerate(names))
+    starts = array.array('d', [float(start) for (start, vendor) in flat])
+    vendors = array.array('i', [numbers[vendor] if vendor is not None else NO_VENDOR
+                                for (start, vendor) in flat])
+    if sys.byteorder == 'big':
+        starts.byteswap()
+        vendors.byteswap()
+    blob = u'\n'.join(names).encode('utf-8')
+
+    write_atomic(path, MAGIC + HEADER.pack(len(flat), len(blob)) +
+                 starts.tostring() + vendors.tostring() + blob)
+    return len(assignments)
+
+
+def main():
+    parser = ArgumentParser(description='Build or query the vendor database sauron.py --oui-db uses.')
+    parser.add_argument('command', choices=['build', 'lookup'], help="build: DB from REGISTRY files, lookup: vendor of each MAC")
+    parser.add_argument('database', metavar='DB', help="Vendor database")
+    parser.add_argument('items', nargs='+', metavar='REGISTRY|MAC', help="IEEE registry files to build from, or macs to look up")
+
+    options = parser.parse_args()
+
+    if options.command == 'build':
+        print "Read %d assignments" % build(options.database, options.items)
+        return
+
+    ouis = OUIDatabase(options.database)
+    for mac in options.items:
+        vendor = ouis.lookup(mac)
+        if is_local(mac):
+            vendor = '(Locally administered)'
+        print "%s\t%s" % (mac, (vendor or '(Unknown)').encode('utf-8'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+
+"""
+pcaparp v1.0
+Passive ARP ingestion from packet captures
+
+Instead of sweeping the network with arp-scan, this pulls sender
+mac/ip pairs out of the ARP requests and replies in a capture, and
+hands them back in the same shape get_macs does so they can go
+straight into CouchCoop.read_scan_data. Reads pcap and pcapng files,
+or a pcap stream on stdin, e.g.:
+
+    tcpdump -i eth0 -w - arp | sauron.py --pcap -
+
+Files are mmap'd and picked apart in place with struct.unpack_from,
+so nothing is copied and memory use stays flat no matter how big
+the capture is. Only the set of macs already seen grows, and that
+is bounded by the number of devices rather than the file size.
+"""
+
+import sys
+import mmap
+import struct
+
+# Link layer types we know how to find an ethertype in
+LINKTYPE_ETHERNET = 1
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_ARP = 0x0806
+# 802.1Q and 802.1ad VLAN tags
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+# pcap magic numbers, microsecond and nanosecond flavors
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+
+# pcapng block types
+PCAPNG_SECTION_HEADER = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER = 0x1a2b3c4d
+PCAPNG_INTERFACE = 1
+PCAPNG_SIMPLE_PACKET = 3
+PCAPNG_ENHANCED_PACKET = 6
+
+# What we call the vendor, since a capture doesn't tell us
+UNKNOWN_OUI = '(Unknown)'
+
+
+def arp_sender(data, offset, length, linktype):
+    """
+        Looks for an ARP request or reply in one captured frame.
+
+        Parms: data -- buffer the frame is in (a str or an mmap)
+               offset -- where the frame starts in data
+               length -- how much of it was captured
+               linktype -- link layer type of the capture
+        Returns: Tuple: (mac, ip) of the sender, or None
+    """
+    end = offset + length
+    if linktype == LINKTYPE_ETHERNET:
+        if length < 14:
+            return None
+        (ethertype,) = struct.unpack_from('!H', data, offset + 12)
+        position = offset + 14
+        # Skip over any VLAN tags
+        while ethertype in ETHERTYPE_VLAN and position + 4 <= end:
+            (ethertype,) = struct.unpack_from('!H', data, position + 2)
+            position += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if length < 16:
+            return None
+        (ethertype,) = struct.unpack_from('!H', data, offset + 14)
+        position = offset + 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if length < 20:
+            return None
+        (ethertype,) = struct.unpack_from('!H', data, offset)
+        position = offset + 20
+    else:
+        return None
+
+    # An ethernet/IPv4 ARP packet is 28 bytes
+    if ethertype != ETHERTYPE_ARP or end - position < 28:
+        return None
+
+    (htype, ptype, hlen, plen, operation) = struct.unpack_from('!HHBBH', data, position)
+    if htype != 1 or ptype != 0x0800 or hlen != 6 or plen != 4 or operation not in (1, 2):
+        return None
+
+    mac = struct.unpack_from('6B', data, position + 8)
+    ip = struct.unpack_from('4B', data, position + 14)
+    # ARP probes come from 0.0.0.0, which tells us nothing
+    if ip == (0, 0, 0, 0) or mac == (0, 0, 0, 0, 0, 0) or mac == (255, 255, 255, 255, 255, 255):
+        return None
+
+    return ("%02x:%02x:%02x:%02x:%02x:%02x" % mac, "%d.%d.%d.%d" % ip)
+
+def pcap_frames(data, size):
+    """
+        Walks the records of a classic pcap file.
+
+        Yields: Tuple: (timestamp, offset, length, linktype) per frame
+    """
+    if size < 24:
+        return
+    (magic,) = struct.unpack_from('<I', data, 0)
+    if magic in (PCAP_MAGIC, PCAP_MAGIC_NSEC):
+        endian = '<'
+    else:
+        endian = '>'
+        (magic,) = struct.unpack_from('>I', data, 0)
+    divisor = 1e9 if magic == PCAP_MAGIC_NSEC else 1e6
+
+    # The top bits of the link type can carry FCS info
+    (linktype,) = struct.unpack_from(endian + 'I', data, 20)
+    linktype &= 0xffff
+    record = endian + 'IIII'
+
+    position = 24
+    while position + 16 <= size:
+        (seconds, fraction, captured, original) = struct.unpack_from(record, data, position)
+        position += 16
+        if position + captured > size:
+            # Capture got cut off part way through a packet
+            return
+        yield (seconds + fraction / divisor, position, captured, linktype)
+        position += captured
+
+def pcapng_resolution(data, endian, start, end):
+    """
+        Digs the timestamp resolution (if_tsresol) out of an interface
+        description block's options. Returns ticks per second.
+    """
+    position = start
+    while position + 4 <= end:
+        (code, length) = struct.unpack_from(endian + 'HH', data, position)
+        if code == 0:
+            break
+        if code == 9 and length == 1:
+            (value,) = struct.unpack_from('B', data, position + 4)
+            if value & 0x80:
+                return 2 ** (value & 0x7f)
+            return 10 ** value
+        # Option values are padded out to 32 bits
+        position += 4 + ((length + 3) & ~3)
+    return 10 ** 6
+
+def pcapng_frames(data, size):
+    """
+        Walks the blocks of a pcapng file, keeping track of the
+        interfaces in each section so we know each packet's link
+        type and timestamp resolution.
+
+        Yields: Tuple: (timestamp, offset, length, linktype) per frame
+    """
+    endian = '<'
+    # (linktype, ticks per second) for each interface in this section
+    interfaces = []
+
+    position = 0
+    while position + 12 <= size:
+        (block_type,) = struct.unpack_from(endian + 'I', data, position)
+        if block_type == PCAPNG_SECTION_HEADER:
+            # Every section can have its own byte order
+            (byte_order,) = struct.unpack_from('<I', data, position + 8)
+            endian = '<' if byte_order == PCAPNG_BYTE_ORDER else '>'
+            interfaces = []
+        (block_length,) = struct.unpack_from(endian + 'I', data, position + 4)
+        if block_length < 12 or position + block_length > size:
+            return
+
+        if block_type == PCAPNG_INTERFACE:
+            (linktype,) = struct.unpack_from(endian + 'H', data, position + 8)
+            resolution = pcapng_resolution(data, endian, position + 16, position + block_length - 4)
+            interfaces.append((linktype, resolution))
+        elif block_type == PCAPNG_ENHANCED_PACKET:
+            (interface, high, low, captured) = struct.unpack_from(endian + 'IIII', data, position + 8)
+            if interface < len(interfaces):
+                (linktype, resolution) = interfaces[interface]
+                yield (((high << 32) | low) / float(resolution), position + 28, captured, linktype)
+        elif block_type == PCAPNG_SIMPLE_PACKET and interfaces:
+            (original,) = struct.unpack_from(endian + 'I', data, position + 8)
+            yield (None, position + 12, min(original, block_length - 16), interfaces[0][0])
+
+        position += block_length
+
+def read_file(path):
+    """
+        Pulls every ARP sender out of a pcap or pcapng file.
+
+        Yields: Tuple: (timestamp, mac, ip)
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        if size < 4:
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic,) = struct.unpack_from('<I', data, 0)
+            if magic == PCAPNG_SECTION_HEADER:
+                frames = pcapng_frames(data, size)
+            else:
+                frames = pcap_frames(data, size)
+
+            for (timestamp, offset, length, linktype) in frames:
+                sender = arp_sender(data, offset, length, linktype)
+                if sender:
+                    yield (timestamp, sender[0], sender[1])
+        finally:
+            data.close()
+
+def read_stream(f):
+    """
+        Pulls every ARP sender out of a pcap stream as it arrives,
+        such as tcpdump -w - writes. One packet is held at a time.
+
+        Yields: Tuple: (timestamp, mac, ip)
+    """
+    header = f.read(24)
+    if len(header) < 24:
+        return
+    (magic,) = struct.unpack_from('<I', header, 0)
+    if magic in (PCAP_MAGIC, PCAP_MAGIC_NSEC):
+        endian = '<'
+    else:
+        endian = '>'
+        (magic,) = struct.unpack_from('>I', header, 0)
+    divisor = 1e9 if magic == PCAP_MAGIC_NSEC else 1e6
+    (linktype,) = struct.unpack_from(endian + 'I', header, 20)
+    linktype &= 0xffff
+    record = struct.Struct(endian + 'IIII')
+
+    while True:
+        header = f.read(16)
+        if len(header) < 16:
+            return
+        (seconds, fraction, captured, original) = record.unpack(header)
+        frame = f.read(captured)
+        if len(frame) < captured:
+            return
+        sender = arp_sender(frame, 0, captured, linktype)
+        if sender:
+            yield (seconds + fraction / divisor, sender[0], sender[1])
+
+def read_capture(path):
+    """
+        Pulls every ARP sender out of a capture file, or a pcap
+        stream on stdin if path is '-'.
+
+        Yields: Tuple: (timestamp, mac, ip)
+    """
+    if path == '-':
+        return read_stream(sys.stdin)
+    return read_file(path)
+
+def add_sighting(devices, timestamp, mac, ip, interface):
+    """
+        Folds one ARP sender into devices, mac -> entry, keeping the
+        address it had last. The capture times go in as 'seen' and
+        'first_seen' (see read_scan_data), so an old capture doesn't
+        make anything look like it was here just now.
+    """
+    entry = devices.get(mac)
+    if entry is None:
+        entry = devices[mac] = dict(mac=mac, oui=UNKNOWN_OUI, interface=interface)
+    # Frames from different interfaces in a pcapng needn't be in order
+    if timestamp is None or timestamp >= entry.get('seen', timestamp):
+        entry['ip'] = ip
+    if timestamp is not None:
+        entry['seen'] = max(entry.get('seen', timestamp), timestamp)
+        entry['first_seen'] = min(entry.get('first_seen', timestamp), timestamp)
+
+def scan_data(sightings, interface=None):
+    """
+        Turns ARP senders into the same dicts get_macs hands back,
+        one per mac, with the last address it was seen with.
+
+        Returns: List of Dicts: (ip, mac, oui, interface, seen, first_seen)
+    """
+    devices = {}
+    for (timestamp, mac, ip) in sightings:
+        add_sighting(devices, timestamp, mac, ip, interface)
+    return devices.values()
+
+def windows(sightings, seconds, interface=None):
+    """
+        Chops a never ending stream of ARP senders up by capture time,
+        so it can be fed to read_scan_data every so often like a scan.
+        The last window is handed back whenever the stream ends.
+
+        Yields: List of Dicts: (ip, mac, oui, interface, seen,
+                first_seen), one per mac, as scan_data has them
+    """
+    window = {}
+    window_end = None
+    for (timestamp, mac, ip) in sightings:
+        if timestamp is None:
+            # Simple packet blocks don't have one, lump it in with the rest
+            pass
+        elif window_end is None:
+            window_end = timestamp + seconds
+        elif timestamp >= window_end:
+            yield window.values()
+            window = {}
+            window_end = timestamp + seconds
+        add_sighting(window, timestamp, mac, ip, interface)
+    if window:
+        yield window.values()
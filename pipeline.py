@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""
+pipeline v1.0
+Keeps the stages of a run from waiting on each other
+
+A run is arp-scan feeding read_scan_data, which looks devices up,
+writes them back, logs every one of them to syslog and hands alerts
+off to be mailed. Done one after the other, a slow stage holds up
+everything: arp-scan blocks on a full pipe while we wait on couchdb,
+and couchdb sits idle while we wait on syslog. So each stage gets a
+thread of its own, with a bounded queue in front of it:
+
+    read_ahead -- keeps reading the scan while the rest catches up
+    Worker     -- runs a function over whatever gets put in front
+                  of it, in order, such as writing out each batch
+                  while the next one is being looked up
+    log        -- syslog.syslog, without waiting on it
+
+A queue that fills up makes whoever is feeding it wait, so nothing
+runs away with the memory when a stage falls behind. An exception in
+a stage comes back out in the thread that was feeding it.
+
+This is threads rather than anything fancier since everything here is
+waiting on a socket, a pipe or a file, which releases the GIL, and the
+couchdb and SMTP libraries we use are blocking anyway.
+"""
+
+import sys
+import Queue
+import atexit
+import syslog
+import threading
+
+# How far logging can get behind before whoever is logging waits
+LOG_QUEUE_SIZE = 10000
+
+
+def read_ahead(iterable, size):
+    """
+        Works through iterable on a thread of its own, up to size items
+        ahead of whoever is iterating over this. If the consumer stops
+        early the reading stops too.
+
+        Yields: whatever iterable does
+    """
+    queue = Queue.Queue(maxsize=size)
+    stop = threading.Event()
+    # Put in the queue after the last item
+    done = object()
+    failure = []
+
+    def reader():
+        try:
+            for item in iterable:
+                queue.put(item)
+                if stop.is_set():
+                    break
+        except Exception:
+            failure.append(sys.exc_info())
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            queue.put(done)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item = queue.get()
+            if item is done:
+                break
+            yield item
+        if failure:
+            raise failure[0][0], failure[0][1], failure[0][2]
+    finally:
+        # If we're quitting early, keep the queue moving until the
+        # reader notices
+        stop.set()
+        while thread.is_alive():
+            try:
+                queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+
+class Worker:
+    def __init__(self, function, size=2):
+        """
+            Runs function(*args) for each put(*args) on a thread of its
+            own, in the order they were put. Used as a with block, it's
+            closed at the end, or aborted if something raised.
+
+            Parms:
+                function = what to run
+                size = how many calls can be waiting before put()
+                    waits for the thread to catch up. 0 runs each one
+                    right there in put() instead, for things that can't
+                    be used from another thread (like a SQLite
+                    connection).
+        """
+        self.function = function
+        self.size = size
+        # What each call returned, in order
+        self.results = []
+        self.failure = None
+        self.thread = None
+        if size:
+            self.queue = Queue.Queue(maxsize=size)
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            args = self.queue.get()
+            if args is None:
+                break
+            if self.failure:
+                # Something already fell over, just drain the queue
+                continue
+            try:
+                self.results.append(self.function(*args))
+            except Exception:
+                self.failure = sys.exc_info()
+
+    def put(self, *args):
+        """
+            Queues up a call, raising whatever went wrong with an earlier
+            one if something did
+        """
+        self.check()
+        if self.thread is None:
+            self.results.append(self.function(*args))
+        else:
+            self.queue.put(args)
+
+    def check(self):
+        if self.failure:
+            (failure, self.failure) = (self.failure, None)
+            raise failure[0], failure[1], failure[2]
+
+    def close(self):
+        """
+            Waits for every call to finish and stops the thread. Raises
+            whatever went wrong if something did.
+
+            Returns: List of what each call returned
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.check()
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        # Leaving the with block early shouldn't leave the thread behind
+        if kind is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        """
+            Stops the thread without raising anything, for when
+            something else already went wrong
+        """
+        if self.thread is not None:
+            self.failure = self.failure or True
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.failure = None
+
+
+# The thread log() hands lines to, started the first time it's needed
+log_worker = None
+log_lock = threading.Lock()
+
+def log(message):
+    """
+        Sends message to syslog in the background. Lines still go out
+        in order, and if syslog falls LOG_QUEUE_SIZE lines behind the
+        caller waits for it.
+    """
+    global log_worker
+    with log_lock:
+        if log_worker is None:
+            log_worker = Worker(syslog.syslog, LOG_QUEUE_SIZE)
+        worker = log_worker
+    worker.put(message)
+
+def flush_log():
+    """
+        Waits for everything log() was given to be sent
+    """
+    global log_worker
+    with log_lock:
+        if log_worker is not None:
+            log_worker.close()
+            log_worker = None
+
+# Don't lose the last few lines on the way out
+atexit.register(flush_log)
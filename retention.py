@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+retention v1.0
+Archives and removes devices that haven't been around in a long time
+
+Nothing ever leaves the sauron database on its own. A guest's phone
+with a randomized mac that was seen once, years ago, is still there
+for every pass over _all_docs to walk past. From cron, every so often:
+
+    retention.py --days 365 --archive /var/lib/sauron/archive.jsonl.gz
+
+copies every device not seen in the last 365 days to the archive, a
+line of JSON each (gzipped, and appended to if it's already there, so
+zcat gets you the lot), then deletes them from the database a chunk at
+a time with _bulk_docs. Anything seen again between being archived and
+being deleted is left where it is. Then the database and its views
+are compacted, which is when the space actually comes back, and how
+much did is reported.
+
+A device only ever gets deleted once it's safely in the archive. If
+this dies in between, the next run archives it again, so there may
+be the odd duplicate line.
+
+Old style '%x %X' dates don't sort in the by_lastseen view, run
+sauron.py --migrate-timestamps first if there are any left.
+"""
+
+import os
+import json
+import gzip
+import datetime
+from argparse import ArgumentParser
+from arpobj import CouchCoop, date_to_database, normalize_date
+from storage import chunks
+
+
+def archive_devices(macs, days, path):
+    """
+        Moves every device not seen in days days out of the database
+        and into the gzipped JSON lines file at path.
+
+        Parms: macs -- CouchCoop for the database
+               days -- how long a device can go unseen before it goes
+               path -- archive to append to
+        Returns: Tuple: (archived and deleted, seen again since)
+    """
+    oldest = datetime.datetime.now() - datetime.timedelta(days=days)
+    cutoff = date_to_database(oldest)
+    candidates = [mac for (mac, ip, last_seen) in macs.seen_between(None, oldest)]
+    (deleted, kept) = (0, 0)
+    archive = gzip.open(path, 'ab')
+    try:
+        for chunk in chunks(candidates, macs.chunk_size):
+            # Make sure nothing turned up again since the view was read
+            old = [doc for doc in macs.get_docs(chunk).values()
+                   if normalize_date(doc['lastSeen']) < cutoff]
+            kept += len(chunk) - len(old)
+            if not old:
+                continue
+
+            for doc in old:
+                record = dict(doc)
+                del record['_rev']
+                archive.write(json.dumps(record, sort_keys=True) + "\n")
+            # It has to be on disk before it goes from the database
+            archive.flush()
+            os.fsync(archive.fileobj.fileno())
+
+            results = macs.storage.save_many([{'_id': doc['_id'], '_rev': doc['_rev'], '_deleted': True}
+                                              for doc in old])
+            for (success, identifier, rev_or_exc) in results:
+                if success:
+                    deleted += 1
+                else:
+                    # Somebody wrote it in the meantime, so it's back
+                    kept += 1
+    finally:
+        archive.close()
+
+    macs.metrics.incr('devices_archived', deleted)
+    return (deleted, kept)
+
+
+def main():
+    parser = ArgumentParser(description='Archive devices that have been gone a long time, delete them from the sauron database and compact it.')
+    parser.add_argument('--days', action="store", type=int, dest="days", help="Archive devices not seen in this many days", default=365)
+    parser.add_argument('--archive', action="store", dest="archive", metavar="FILE", required=True, help="Gzipped JSON lines file to add archived devices to")
+    parser.add_argument('--storage', action="store", dest="storage", metavar="URL", help="Where the database is: sqlite:PATH for SQLite, or http://host:port for couchdb (the default, on localhost)")
+    parser.add_argument('--chunk-size', action="store", type=int, dest="chunk_size", help="Devices to delete in each bulk request", default=1000)
+    parser.add_argument('--no-compact', action="store_false", dest="compact", help="Don't compact the database afterwards", default=True)
+
+    options = parser.parse_args()
+
+    macs = CouchCoop(chunk_size=options.chunk_size, storage=options.storage)
+    before = macs.storage.disk_size()
+    (deleted, kept) = archive_devices(macs, options.days, options.archive)
+    print "Archived {Deleted: [%d], seen again: [%d]} to %s" % (deleted, kept, options.archive)
+
+    if options.compact:
+        macs.storage.compact()
+        after = macs.storage.disk_size()
+        print "Compacted {Before: [%d KB], after: [%d KB], reclaimed: [%d KB]}" % (
+            before / 1024, after / 1024, (before - after) / 1024)
+    macs.close()
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,260 @@
 """
 
 import re
+import time
+import datetime
+import cProfile
+import random
+import signal
+import syslog
+import threading
+import Queue
+import os
+import tempfile
+from argparse import ArgumentParser
 from subprocess import Popen, PIPE
 from arpobj import CouchCoop
+from metrics import Metrics
+from sightings import SightingLog, ip_to_int
+from oui import OUIDatabase
+from journal import ScanJournal
+from scheduler import ScanScheduler
+from fingerprint import ScanFingerprint
+import pcaparp
+
+# Compile the regex to look for IP addresses
+ip_regex = re.compile(r'^(?:(?:25[0-5]|2[0-4][0-9]|1?[0-9]{1,2})\.){3}(?:25[0-5]|2[0-4][0-9]|1?[0-9]{1,2})')
+
+# arp-scan tacks this on to the end of any duplicate responses
+dup_regex = re.compile(r'\s*\(DUP: \d+\)$')
+
+def parse_line(line):
+    """
+        Picks apart a single line of arp-scan output.
+
+        Parms: line -- one line of arp-scan output
+        Returns: Dict: (ip, mac, oui), or None if the line isn't a response
+    """
+    if not ip_regex.match(line):
+        return None
+
+    # This is a line with valid data in it, and we can extrapolate stuff to add to the DB
+    # Note that the split function splits on whitespace when no seperator is given, but
+    # I only want it to split it into a triple! The second parameter specifies how many
+    # splits I can perform. Forcing an explicit "None"-type to split on whitespace but
+    # only twice
+    (ip_address, mac_address, OUI) = line.rstrip('\r\n').split(None, 2)
+    return dict(ip=ip_address, mac=mac_address, oui=dup_regex.sub('', OUI))
+
+def parse_segment(segment):
+    """
+        Works out what to hand arp-scan for a segment given on the
+        command line. Any of these will do:
+            eth0                -- the local network on eth0
+            10.1.0.0/20         -- that range, on the default interface
+            eth1:10.1.0.0/20    -- that range, on eth1
+
+        Returns: Tuple: (interface, target), either of which may be None
+    """
+    if not segment:
+        return (None, None)
+    elif ':' in segment:
+        (interface, target) = segment.split(':', 1)
+        return (interface, target)
+    elif '/' in segment or ip_regex.match(segment):
+        return (None, segment)
+    else:
+        return (segment, None)
+
+def parse_lines(lines, interface=None, metrics=None):
+    """
+        Turns lines of arp-scan output into devices as they come in.
+        Duplicate responses are dropped.
+
+        Parms: lines -- any iterable of arp-scan output lines
+               interface -- interface the lines came from, if known
+               metrics -- optional Metrics to count parse time in
+        Yields: Dict: (ip, mac, oui, interface)
+    """
+    seen = set()
+    for line in lines:
+        started = time.time()
+        entry = parse_line(line)
+        if metrics:
+            metrics.add_time('parse', time.time() - started)
+        if entry is None or entry['mac'] in seen:
+            continue
+        seen.add(entry['mac'])
+        entry['interface'] = interface
+        yield entry
+
+def in_target(ip, target):
+    """
+        Is ip part of what arp-scan would scan for target? Anything
+        other than a single address or a network in CIDR notation (a
+        range, say) is taken to include everything.
+    """
+    if not target:
+        return True
+    try:
+        if '/' in target:
+            (network, bits) = target.split('/', 1)
+            mask = (0xffffffff << (32 - int(bits))) & 0xffffffff
+            return ip_to_int(ip) & mask == ip_to_int(network) & mask
+        if ip_regex.match(target) and '-' not in target:
+            return ip == target
+    except ValueError:
+        pass
+    return True
+
+def write_targets(addresses):
+    """
+        Writes addresses out one per line for arp-scan --file.
+        Returns: path of the file, for the caller to remove
+    """
+    (descriptor, path) = tempfile.mkstemp(prefix='sauron-targets-')
+    with os.fdopen(descriptor, 'w') as f:
+        f.write(''.join("%s\n" % address for address in addresses))
+    return path
+
+def iter_macs(arp_binary, interface=None, target=None, metrics=None, target_file=None):
+    """
+        Scans the network using arp-scan and hands back each device
+        as soon as arp-scan reports it, rather than waiting for the
+        whole sweep to finish. Duplicate responses are dropped.
+
+        Parms: arp_binary -- location of arp-scan binary
+               interface -- interface to scan on, default if None
+               target -- network to scan, the local net if None
+               metrics -- optional Metrics to count parse time in
+               target_file -- probe just the addresses in this file
+                   instead of target
+        Yields: Dict: (ip, mac, oui, interface)
+    """
+    command = [arp_binary]
+    if interface:
+        command.append("--interface=%s" % interface)
+    if target_file:
+        command.append("--file=%s" % target_file)
+    elif target:
+        command.append(target)
+    else:
+        command.append("--localnet")
+
+    # Run the command to scan the network
+    process = Popen(command, stdout=PIPE)
+    finished = False
+    try:
+        # Don't use "for line in process.stdout", it reads ahead in big
+        # chunks and would sit on lines until the buffer fills up.
+        for entry in parse_lines(iter(process.stdout.readline, ''), interface, metrics):
+            yield entry
+        finished = True
+    finally:
+        if not finished and process.poll() is None:
+            # Nobody wants the rest of the scan, don't wait for it
+            process.terminate()
+        process.stdout.close()
+        process.wait()
+
+def scan_segments(arp_binary, segments, metrics=None, queue_size=1000, addresses=None):
+    """
+        Runs one arp-scan per segment, all at the same time, and merges
+        what they find into a single stream. A mac that shows up on more
+        than one segment is only reported once, tagged with the interface
+        that saw it first. The whole thing takes about as long as the
+        slowest segment rather than all of them added up.
+
+        Parms: arp_binary -- location of arp-scan binary
+               segments -- list of segments, see parse_segment
+               metrics -- optional Metrics, handed to iter_macs
+               queue_size -- how far the scanners may run ahead of us
+               addresses -- if given, only probe these, each segment
+                   the ones inside it (see ScanScheduler)
+        Yields: Dict: (ip, mac, oui, interface)
+    """
+    scans = [parse_segment(segment) + (None,) for segment in segments]
+    if addresses is not None:
+        targeted = []
+        for (interface, target, target_file) in scans:
+            inside = [address for address in addresses if in_target(address, target)]
+            if inside:
+                targeted.append((interface, target, write_targets(inside)))
+        scans = targeted
+
+    try:
+        for entry in scan_all(arp_binary, scans, metrics, queue_size):
+            yield entry
+    finally:
+        for (interface, target, target_file) in scans:
+            if target_file:
+                os.unlink(target_file)
+
+def scan_all(arp_binary, scans, metrics, queue_size):
+    """
+        Does the work for scan_segments, given each scan as a tuple
+        of (interface, target, target_file) for iter_macs
+    """
+    if len(scans) == 1:
+        (interface, target, target_file) = scans[0]
+        scan = iter_macs(arp_binary, interface, target, metrics, target_file)
+        try:
+            for entry in scan:
+                yield entry
+        finally:
+            scan.close()
+        return
+
+    results = Queue.Queue(maxsize=queue_size)
+    # Each scanner drops one of these in the queue when it is finished
+    done = object()
+    # Set when we stop reading, so the scanners don't wait on us forever
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def scanner(interface, target, target_file):
+        scan = iter_macs(arp_binary, interface, target, metrics, target_file)
+        try:
+            for entry in scan:
+                if not put(entry):
+                    break
+        except Exception as e:
+            # Don't let one bad segment take the others down with it
+            syslog.syslog("Scan of %s failed: %s" % (target or interface or 'the local net', e))
+        finally:
+            # Stops arp-scan if it isn't done, and reaps it
+            scan.close()
+            put(done)
+
+    threads = []
+    for scan in scans:
+        thread = threading.Thread(target=scanner, args=scan)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    seen = set()
+    remaining = len(scans)
+    try:
+        while remaining:
+            entry = results.get()
+            if entry is done:
+                remaining -= 1
+            elif entry['mac'] not in seen:
+                seen.add(entry['mac'])
+                yield entry
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
 
 def get_macs(arp_binary):
     """
@@ -14,40 +266,301 @@ def get_macs(arp_binary):
         with the mac address.
 
         Parms: arp_binary -- location of arp-scan binary
-        Returns: Dict: (key: mac, value: ip address)
+        Returns: List of Dicts: (ip, mac, oui)
     """
-    retval = list()
-    # Run the command to scan the network
-    process = Popen([arp_binary, "--localnet"], stdout=PIPE)
-    (output, err) = process.communicate()
-    output = output.split('\n')
-
-    # Compile the regex to look for IP addresses
-    ip_regex = re.compile(r'^(?:(?:25[0-5]|2[0-4][0-9]|1?[0-9]{1,2})\.){3}(?:25[0-5]|2[0-4][0-9]|1?[0-9]{1,2})')
-
-    # Loop through the list looking for valid entries
-    for line in output:
-        if ip_regex.match(line):
-            # This is a line with valid data in it, and we can extrapolate stuff to add to the DB
-            # Note that the split function splits on whitespace when no seperator is given, but
-            # I only want it to split it into a triple! The second parameter specifies how many
-            # splits I can perform. Forcing an explicit "None"-type to split on whitespace but
-            # only twice
-            (ip_address, mac_address, OUI) = line.split(None, 2)
-            retval.append(dict(ip=ip_address, mac=mac_address, oui=OUI))
-
-    # At this point, we should have everything we need.
-    return retval
+    return list(iter_macs(arp_binary))
+
+def recorded(scan_data, found):
+    """
+        Passes scan_data through, noting the (ip, mac) of each entry
+        in found as it goes
+    """
+    for entry in scan_data:
+        found.append((entry['ip'], entry['mac']))
+        yield entry
+
+def run_scan(macs, segments, options, journal=None, scheduler=None, fingerprint=None, connect=None,
+             history=None, metrics=None):
+    """
+        Does one full scan of every segment at once, updating the
+        database and reporting as the results come in. Profiles it
+        if that was asked for on the command line.
+
+        With a journal the scan goes to disk first, then everything
+        in the journal is replayed into the database if we have one.
+        If we don't, or it falls over, the scan just waits there for
+        next time.
+
+        With a scheduler, unless a full sweep is due, only the
+        addresses of devices seen in the last --active-window minutes
+        are probed. A full sweep it is if there's no database to ask.
+
+        With a fingerprint, the whole scan is gathered up first and
+        only what changed since the last one goes any further, see
+        fingerprint.py. If macs is None and there's a connect(), we
+        only connect to the database once there's something for it,
+        and a scan with nothing new only goes in the history (macs'
+        or the one given). Until then it's counted in metrics.
+
+        Returns: the CouchCoop, if we have one by the end
+    """
+    full = True
+    expected = None
+    if scheduler and macs:
+        full = scheduler.full_due()
+        if not full:
+            since = datetime.datetime.now() - datetime.timedelta(minutes=options.active_window)
+            expected = dict((ip, mac) for (mac, ip, last_seen) in macs.seen_between(since, None))
+            macs.metrics.incr('addresses_probed', len(expected))
+        macs.metrics.incr('scans_full' if full else 'scans_targeted')
+
+    metrics = macs.metrics if macs else metrics
+    found = []
+    scan_data = recorded(scan_segments(options.arp_binary, segments, metrics,
+                                       addresses=None if full else expected.keys()), found)
+    if fingerprint:
+        entries = list(scan_data)
+        (scan_data, everything) = fingerprint.compare(entries, options.granularity)
+        if metrics:
+            metrics.incr('devices_unchanged', len(entries) - len(scan_data))
+        # Whatever doesn't go to read_scan_data still goes in the history
+        history = macs.history if macs else history
+        if history and not everything:
+            passed_on = set(id(entry) for entry in scan_data)
+            history.record((entry['mac'], entry['ip']) for entry in entries if id(entry) not in passed_on)
+        if not scan_data:
+            # Same as last time, nothing for the database to do
+            if scheduler:
+                scheduler.finished(full, expected, found)
+            return macs
+
+    if macs is None and connect:
+        try:
+            macs = connect()
+        except Exception as e:
+            if not journal:
+                raise
+            syslog.syslog("Database unavailable, journaling the scan: %s" % e)
+
+    if journal:
+        journal.write(scan_data)
+        if scheduler:
+            scheduler.finished(full, expected, found)
+        if fingerprint:
+            fingerprint.update(entries, everything)
+        if macs is None:
+            return macs
+        update = lambda: journal.replay(macs)
+    else:
+        update = lambda: macs.read_scan_data(scan_data)
+
+    try:
+        if options.profile:
+            profiler = cProfile.Profile()
+            profiler.runcall(update)
+            profiler.dump_stats(options.profile)
+        else:
+            update()
+    except Exception as e:
+        if not journal:
+            raise
+        syslog.syslog("Couldn't replay the journal, keeping it for next time: %s" % e)
+
+    if scheduler and not journal:
+        scheduler.finished(full, expected, found)
+    if fingerprint and not journal:
+        fingerprint.update(entries, everything)
+    return macs
+
+def run_capture(macs, options):
+    """
+        Reads devices out of the ARP traffic in a capture rather than
+        scanning for them. A file is read in one go like a scan would
+        be. A stream on stdin is handed to read_scan_data every
+        --window seconds of capture time until it runs dry.
+    """
+    sightings = pcaparp.read_capture(options.pcap)
+    if options.pcap == '-':
+        for window in pcaparp.windows(sightings, options.window):
+            macs.read_scan_data(window)
+            write_stats(macs, options)
+            macs.metrics.reset()
+    else:
+        macs.read_scan_data(pcaparp.scan_data(sightings))
+
+def write_stats(macs, options, metrics=None):
+    """
+        Writes out the timings and counters from the last run, in
+        whichever formats were asked for on the command line. metrics
+        is what to write if there's no macs, for a run that never
+        needed the database.
+    """
+    metrics = macs.metrics if macs else metrics
+    if metrics is None:
+        return
+    if options.prometheus:
+        metrics.write_prometheus(options.prometheus)
+    if options.json_stats:
+        metrics.write_json(options.json_stats)
+
+def run_daemon(macs, segments, options, journal=None, connect=None, scheduler=None, fingerprint=None):
+    """
+        Keeps scanning every interval seconds (give or take jitter
+        seconds, so a bunch of sensors don't all hit the database at
+        the same moment) until we get a SIGTERM or SIGINT. The same
+        CouchCoop hangs around the whole time, so we keep its
+        connections and macwatch cache rather than paying for them
+        on every scan like a cron job would.
+
+        If we're journaling and couldn't get at the database (macs is
+        None), connect() is tried again before every scan, and the scan
+        goes in the journal either way.
+
+        A signal never interrupts a scan in progress, it just stops
+        us from starting the next one.
+    """
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        syslog.syslog("Caught signal %d, shutting down" % signum)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    syslog.syslog("Running as a daemon, scanning every %d seconds" % options.interval)
+    while not stop.is_set():
+        started = time.time()
+        if macs is None and connect:
+            try:
+                macs = connect()
+            except Exception as e:
+                syslog.syslog("Database unavailable: %s" % e)
+        try:
+            if macs:
+                macs.metrics.reset()
+            # Without the database the scan still goes in the journal
+            if macs or journal:
+                run_scan(macs, segments, options, journal, scheduler, fingerprint)
+                write_stats(macs, options)
+        except Exception as e:
+            # Database down, arp-scan missing, whatever. Try again next
+            # time around rather than dying.
+            syslog.syslog("Scan failed: %s" % e)
+
+        delay = options.interval - (time.time() - started) + random.uniform(-options.jitter, options.jitter)
+        stop.wait(max(delay, 0))
+
+    syslog.syslog("Daemon stopped")
+    return macs
 
 def main():
+    parser = ArgumentParser(description='Scan the network and keep the sauron database up to date.')
+    parser.add_argument('segments', nargs='*', metavar='SEGMENT', help="Interface (eth0), network (10.1.0.0/20) or both (eth1:10.1.0.0/20) to scan. Scans the local net if none are given.")
+    parser.add_argument('-b', '--arp-scan', action="store", dest="arp_binary", help="Location of the arp-scan binary", default='/usr/local/bin/arp-scan')
+    parser.add_argument('-r', '--pcap', action="store", dest="pcap", metavar="FILE", help="Read devices from the ARP traffic in a pcap/pcapng file instead of scanning. Use - for a pcap stream on stdin (tcpdump -w -)")
+    parser.add_argument('--window', action="store", type=int, dest="window", help="Seconds of a --pcap stream to gather up before updating the database", default=60)
+    parser.add_argument('--storage', action="store", dest="storage", metavar="URL", help="Where to keep the database: sqlite:PATH for SQLite, or http://host:port for couchdb (the default, on localhost)")
+    parser.add_argument('--full-every', action="store", type=int, dest="full_every", metavar="MINUTES", help="Only probe the addresses of recently seen devices, and sweep everything at most this many minutes apart (or sooner, if too much has changed). Sweeps everything every time if not given")
+    parser.add_argument('--active-window', action="store", type=int, dest="active_window", metavar="MINUTES", help="Devices seen within this many minutes get probed between full sweeps", default=1440)
+    parser.add_argument('--churn', action="store", type=float, dest="churn", metavar="PERCENT", help="Sweep everything next time if more than this percent of the probed addresses go quiet or change hands", default=10)
+    parser.add_argument('--schedule-state', action="store", dest="schedule_state", metavar="FILE", help="Where to remember when the last full sweep was", default='/var/tmp/sauron_schedule.json')
+    parser.add_argument('--timeout', action="store", type=float, dest="timeout", metavar="SECONDS", help="Give up on a couchdb request that takes longer than this", default=60)
+    parser.add_argument('--retries', action="store", type=int, dest="retries", help="Times to retry a couchdb request when the connection fails, backing off a little longer each time", default=3)
+    parser.add_argument('--workers', action="store", type=int, dest="workers", help="Most couchdb lookups to have in flight at once", default=4)
+    parser.add_argument('--sensor', action="store", dest="sensor", metavar="NAME", help="Name of this sensor, when more than one sauron writes to the same database. Devices record which sensors saw them, and conflicting writes are merged instead of dropped")
+    parser.add_argument('-g', '--granularity', action="store", type=int, dest="granularity", help="Only write back a device whose IP changed or whose lastSeen is at least this many minutes old", default=0)
+    parser.add_argument('--fingerprint', action="store", dest="fingerprint", metavar="FILE", help="Remember what the last scan saw here, and only send what changed to the database until --granularity minutes are up, see fingerprint.py")
+    parser.add_argument('--departed', action="store", type=int, dest="departed", metavar="MINUTES", help="List devices that haven't been seen for at least this many minutes and exit")
+    parser.add_argument('--who-has', action="store", dest="who_has", metavar="IP", help="Show which device the database has on IP and exit")
+    parser.add_argument('--alert-ip-changes', action="store_true", dest="alert_ip_changes", help="Alert when a known device turns up on a different IP", default=False)
+    parser.add_argument('--migrate-timestamps', action="store_true", dest="migrate", help="Convert old style dates in the database to ISO-8601 and exit", default=False)
+    parser.add_argument('-w', '--alert-window', action="store", type=int, dest="alert_window", help="Minutes before alerting on the same device for the same reason again", default=60)
+    parser.add_argument('--digest', action="store_true", dest="digest", help="Send all of a scan's alerts as a single mail", default=False)
+    parser.add_argument('--spool', action="store", dest="spool_dir", help="Write alerts to this directory for alerts.py to deliver, rather than mailing them directly")
+    parser.add_argument('--history', action="store", dest="history", metavar="DIR", help="Keep a history of every sighting in this directory, see sightings.py")
+    parser.add_argument('--journal', action="store", dest="journal", metavar="DIR", help="Write each scan to this directory before the database, and keep it there until the database has it, see journal.py")
+    parser.add_argument('--replay', action="store_true", dest="replay", help="Replay everything waiting in the --journal into the database and exit", default=False)
+    parser.add_argument('--oui-db', action="store", dest="oui_db", metavar="FILE", help="Look vendors up in this database (see oui.py) instead of trusting arp-scan")
+    parser.add_argument('--enrich', action="store_true", dest="enrich", help="Fill in the vendor of every device in the database from --oui-db and exit", default=False)
+    parser.add_argument('--prometheus', action="store", dest="prometheus", metavar="FILE", help="Write timings and counters for each run here, in Prometheus textfile format")
+    parser.add_argument('--json-stats', action="store", dest="json_stats", metavar="FILE", help="Write timings and counters for each run here as JSON")
+    parser.add_argument('--profile', action="store", dest="profile", metavar="FILE", help="Dump cProfile output for read_scan_data here")
+    parser.add_argument('-D', '--daemon', action="store_true", dest="daemon", help="Keep running and scan on an interval instead of once", default=False)
+    parser.add_argument('-i', '--interval', action="store", type=int, dest="interval", help="Seconds between scans in daemon mode", default=300)
+    parser.add_argument('-j', '--jitter', action="store", type=int, dest="jitter", help="Randomly start each daemon scan up to this many seconds early or late", default=5)
+
+    options = parser.parse_args()
+    segments = options.segments or [None]
+    if options.enrich and not options.oui_db:
+        parser.error("--enrich needs --oui-db")
+    if options.replay and not options.journal:
+        parser.error("--replay needs --journal")
+    if options.fingerprint and not options.granularity:
+        parser.error("--fingerprint needs --granularity")
+
     # Hello World!
-    macs = CouchCoop()
-    
-    # Run the full scan of the network and report
-    report = get_macs('/usr/local/bin/arp-scan')
+    history = SightingLog(options.history) if options.history else None
+    ouis = OUIDatabase(options.oui_db) if options.oui_db else None
+    journal = ScanJournal(options.journal) if options.journal else None
+    fingerprint = ScanFingerprint(options.fingerprint) if options.fingerprint else None
+    scheduler = None
+    if options.full_every is not None:
+        scheduler = ScanScheduler(options.full_every, options.churn, options.schedule_state)
+
+    def connect():
+        return CouchCoop(granularity=options.granularity, alert_window=options.alert_window,
+                         digest=options.digest, spool_dir=options.spool_dir, history=history,
+                         ouis=ouis, storage=options.storage, timeout=options.timeout,
+                         retries=options.retries, workers=options.workers, sensor=options.sensor,
+                         alert_ip_changes=options.alert_ip_changes, metrics=metrics)
+
+    scanning = not (options.migrate or options.enrich or options.replay or options.who_has or
+                    options.departed is not None or options.pcap)
+    # A single scan with a fingerprint may not need the database at all
+    lazy = fingerprint and scanning and not options.daemon and not scheduler
+    # Counted in before we connect, if we ever do
+    metrics = Metrics() if lazy else None
+    try:
+        macs = None if lazy else connect()
+    except Exception as e:
+        # Scans can wait in the journal, nothing else can do without
+        # the database
+        if not (journal and scanning):
+            raise
+        syslog.syslog("Database unavailable, journaling the scan: %s" % e)
+        macs = None
+
+    if options.migrate:
+        print "Converted %d documents" % macs.migrate_timestamps()
+    elif options.enrich:
+        print "Updated %d documents" % macs.enrich_vendors()
+    elif options.who_has:
+        holders = macs.who_has(options.who_has)
+        if not holders:
+            print "Nothing on %s" % options.who_has
+        for (mac, last_seen) in holders:
+            print "%s\t%s\tlast seen %s" % (options.who_has, mac, last_seen)
+    elif options.replay:
+        print "Replayed %d scans" % journal.replay(macs)
+    elif options.departed is not None:
+        print "Devices not seen in the last %d minutes:" % options.departed
+        for (mac, ip, last_seen) in macs.departed_devices(options.departed):
+            print "%s\t%s\tlast seen %s" % (mac, ip, last_seen)
+    elif options.pcap:
+        run_capture(macs, options)
+    elif options.daemon:
+        macs = run_daemon(macs, segments, options, journal, connect, scheduler, fingerprint)
+    else:
+        macs = run_scan(macs, segments, options, journal, scheduler, fingerprint,
+                        connect if lazy else None, history, metrics)
+
+    # Make sure the alerts are out the door before we go
+    if macs:
+        macs.close()
 
-    # Now update the datbase and report
-    macs.read_scan_data(report)
+    if not options.daemon and options.pcap != '-':
+        write_stats(macs, options, metrics)
 
     # That's it.
 
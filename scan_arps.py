@@ -6,6 +6,7 @@
 """
 
 import re
+import syslog
 import couchdb
 import datetime
 import smtplib
@@ -52,14 +53,14 @@ class CouchCoop:
             of a date and work it into a date object that we can
             manipulate in the python way. Field is the datetime object
         """
-        return datetime.datetime.strptime(self.db[identifier][field], '%x %X')
+        return parse_date(self.db[identifier][field])
 
     def date_to_database(self, datetime_obj):
         """
             Just a wrapper for the strftime function, the return of this
             would get stored in couchdb
         """
-        return datetime_obj.strftime('%x %X')
+        return datetime_obj.strftime('%Y-%m-%dT%H:%M:%S')
 
     def get_doc(self, identifier):
         """
@@ -88,12 +89,19 @@ class CouchCoop:
         # What new entries should we alert on?
         alert_doc_list = []
 
+        # arp-scan can report the same mac more than once
+        seen = set()
+
         for entry in scan_data:
+            if entry['mac'] in seen:
+                continue
+            seen.add(entry['mac'])
+
             if self.does_mac_exist(entry['mac']):
                 # We know about this already. Check the date.
                 # Pull the doc.
                 doc = self.get_doc(entry['mac'])
-                working_date = datetime.datetime.strptime(doc['lastSeen'], '%x %X')
+                working_date = parse_date(doc['lastSeen'])
                 if working_date < comparedate:
                     # This is a really old mac that we haven't seen in a while.
                     pass
@@ -102,28 +110,36 @@ class CouchCoop:
                     pass
 
                 # Now update the doc
-                doc['lastSeen'] = rightnow.strftime('%x %X')
+                doc['lastSeen'] = rightnow.strftime('%Y-%m-%dT%H:%M:%S')
                 doc['ip'] = entry['ip']
                 update_doc_list.append(doc)
 
             else:
-                # This is a new mac on the network. Should we alert?
-                self.db[entry['mac']] = {'ip': entry['ip'], 'lastSeen': rightnow.strftime('%x %X'),
-                                         'firstSeen': rightnow.strftime('%x %X'), 'oui': entry['oui']}
-
-                doc = self.get_doc(entry['mac'])
+                # This is a new mac on the network. Should we alert? Build
+                # the doc here and send it along with the bulk update.
+                doc = {'_id': entry['mac'], 'ip': entry['ip'], 'lastSeen': rightnow.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'firstSeen': rightnow.strftime('%Y-%m-%dT%H:%M:%S'), 'oui': entry['oui']}
+                update_doc_list.append(doc)
                 alert_doc_list.append(doc)
 
 
-        # Now let's update all the entries as necessary
-        self.db.update(update_doc_list)
+        # Now let's update all the entries as necessary, and make sure
+        # they actually went in.
+        failed = set()
+        for (success, identifier, rev_or_exc) in self.db.update(update_doc_list):
+            if not success:
+                failed.add(identifier)
+                syslog.syslog("Failed to save %s: %s" % (identifier, rev_or_exc))
+
+        # Don't tell anybody about devices we couldn't record
+        alert_doc_list = [doc for doc in alert_doc_list if doc['_id'] not in failed]
 
         # And finally, formulate an alert with new mac addresses we find
         body = "I discovered one or more devices using our network.\n"
         body += "Just thought you should know.\n"
         body += "\n"
         for entry in alert_doc_list:
-            body += "Mac Address: %s\n" % entry.id
+            body += "Mac Address: %s\n" % entry['_id']
             body += "IP Address: %s\n" % entry['ip']
             body += "OUI: %s\n" % entry['oui']
             body += "\n"
@@ -132,6 +148,17 @@ class CouchCoop:
             mail_exec(body, "New Device(s) found on network", "sauron@example.com", "dan@example.com")
 
 
+def parse_date(value):
+    """
+        Dates are stored ISO-8601 style now, but older docs may still
+        have the '%x %X' kind until they're migrated.
+    """
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return datetime.datetime.strptime(value, '%x %X')
+
+
 def mail_exec(body, subj, m_from, m_to):
     """Does all the gruntwork for emailing data. Just
         send the proper data and it will send everything
@@ -158,34 +185,37 @@ def mail_exec(body, subj, m_from, m_to):
 
 def get_macs(arp_binary):
     """
-        Scans the network using arp-scan and returns a python object
-        with the mac address.
+        Scans the network using arp-scan and hands back each device
+        as arp-scan reports it, so the database work can start before
+        the sweep is done. Duplicate responses are dropped.
 
         Parms: arp_binary -- location of arp-scan binary
-        Returns: Dict: (key: mac, value: ip address)
+        Yields: Dict: (ip, mac, oui)
     """
-    retval = list()
+    seen = set()
     # Run the command to scan the network
     process = Popen([arp_binary, "--localnet"], stdout=PIPE)
-    (output, err) = process.communicate()
-    output = output.split('\n')
 
     # Compile the regex to look for IP addresses
     ip_regex = re.compile(r'^(?:(?:25[0-5]|2[0-4][0-9]|1?[0-9]{1,2})\.){3}(?:25[0-5]|2[0-4][0-9]|1?[0-9]{1,2})')
 
-    # Loop through the list looking for valid entries
-    for line in output:
+    # Loop through the output as it shows up looking for valid entries
+    for line in iter(process.stdout.readline, ''):
         if ip_regex.match(line):
             # This is a line with valid data in it, and we can extrapolate stuff to add to the DB
             # Note that the split function splits on whitespace when no seperator is given, but
             # I only want it to split it into a triple! The second parameter specifies how many
             # splits I can perform. Forcing an explicit "None"-type to split on whitespace but
             # only twice
-            (ip_address, mac_address, OUI) = line.split(None, 2)
-            retval.append(dict(ip=ip_address, mac=mac_address, oui=OUI))
-
-    # At this point, we should have everything we need.
-    return retval
+            (ip_address, mac_address, OUI) = line.rstrip('\r\n').split(None, 2)
+            if mac_address in seen:
+                # arp-scan reports duplicate responses with a (DUP: n)
+                continue
+            seen.add(mac_address)
+            yield dict(ip=ip_address, mac=mac_address, oui=OUI)
+
+    process.stdout.close()
+    process.wait()
 
 def main():
     """ Main Function """
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+scheduler v1.0
+Decides whether a scan sweeps the whole network or just checks in on
+the devices we already know about
+
+Sweeping a sparsely populated /16 with --localnet means waiting on
+tens of thousands of addresses that never answer, every run, when
+the devices on it hardly change from one run to the next. With
+sauron.py --full-every MINUTES, most runs only probe the addresses
+of devices seen recently (handed to arp-scan as a --file), which
+takes seconds. A full sweep still runs at least every MINUTES, so a
+new device is never missed for longer than that, and straight away
+on the run after a targeted one turned up too much churn: more than
+--churn percent of the addresses we probed not answering, or being
+answered by a different mac than last time.
+
+When the last full sweep ran, and whether one is due because of
+churn, is kept in a small JSON state file so this works the same
+from cron as it does with --daemon.
+"""
+
+import os
+import json
+import time
+import syslog
+from metrics import write_atomic
+
+
+class ScanScheduler:
+    def __init__(self, full_every=60, churn=10, state_file='/var/tmp/sauron_schedule.json'):
+        """
+            Parms:
+                full_every = most minutes between full sweeps
+                churn = percent of probed addresses that can go quiet
+                    or change hands before we sweep early
+                state_file = where to remember the last full sweep,
+                    so the schedule holds across runs. None to not
+                    bother.
+        """
+        self.full_every = full_every
+        self.churn = churn
+        self.state_file = state_file
+        self.state = self.load_state()
+
+    def load_state(self):
+        """
+            Reads back when the last full sweep was, and whether
+            there's one due
+        """
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (IOError, ValueError) as e:
+            syslog.syslog("Unable to read scan schedule from %s: %s" % (self.state_file, e))
+            return {}
+
+    def save_state(self):
+        if not self.state_file:
+            return
+        try:
+            write_atomic(self.state_file, json.dumps(self.state))
+        except (IOError, OSError) as e:
+            syslog.syslog("Unable to save scan schedule to %s: %s" % (self.state_file, e))
+
+    def full_due(self, now=None):
+        """
+            Returns: True if this run should sweep everything
+        """
+        now = now or time.time()
+        last_full = self.state.get('last_full')
+        return (last_full is None or self.state.get('churned', False) or
+                now - last_full >= self.full_every * 60)
+
+    def finished(self, full, expected=None, found=(), now=None):
+        """
+            Records a scan that made it into the database (or journal).
+
+            Parms: full -- whether it was a full sweep
+                   expected -- Dict: ip -> mac we probed, for a
+                       targeted scan
+                   found -- list of (ip, mac) that answered
+            Returns: Percent of the probed addresses that churned,
+                     None for a full sweep
+        """
+        if full:
+            self.state = {'last_full': now or time.time(), 'churned': False}
+            self.save_state()
+            return None
+
+        answered = dict(found)
+        changed = sum(1 for (ip, mac) in expected.items() if answered.get(ip) != mac)
+        percent = 100.0 * changed / len(expected) if expected else 100.0
+        if percent > self.churn:
+            syslog.syslog("%.0f%% of known addresses changed since the last scan, sweeping everything next time"
+                          % percent)
+            self.state['churned'] = True
+            self.save_state()
+        return percent
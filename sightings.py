@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+
+"""
+sightings v1.0
+Append-only history of every device sighting
+
+read_scan_data only keeps the latest lastSeen and ip for each device,
+which is no help with "was this thing on the network last Tuesday" or
+"what addresses has it had". A couchdb doc per sighting would bury the
+database, so the history is kept in flat files in a directory instead,
+one or the other per (UTC) day:
+
+    YYYY-MM-DD.log -- the day so far. Every sighting is appended as 16
+                      bytes: the mac as a 48-bit integer, the IPv4
+                      address as a uint32 and the epoch time.
+    YYYY-MM-DD.seg -- a finished day. Sightings are collapsed into runs
+                      of (mac, first, last, ip), sorted by mac and
+                      zlib'd a block at a time, with an index of the
+                      first mac in each block up front. Looking up one
+                      mac only inflates the block or two it's in.
+
+A day's log is sealed into a segment by the first write on a later
+day, or with "sightings.py DIR seal". Looking a device up in the log
+of the current day is a find() over the mmap'd file, so that's quick
+too. Query from the command line with:
+
+    sightings.py /var/lib/sauron/history presence 00:11:22:33:44:55
+    sightings.py /var/lib/sauron/history ips 00:11:22:33:44:55 --days 90
+"""
+
+import os
+import re
+import sys
+import mmap
+import time
+import zlib
+import array
+import socket
+import struct
+import bisect
+from argparse import ArgumentParser
+from metrics import write_atomic
+
+# One line of a day's log: mac, ip, time
+SIGHTING = struct.Struct('<QII')
+# One run in a segment: mac, first, last, ip
+RUN = struct.Struct('<QIII')
+# Segment header, after the magic: block count, run count
+HEADER = struct.Struct('<II')
+# Segment index entry per block: first mac, offset, length
+INDEX = struct.Struct('<QII')
+MAGIC = 'SAURSEG1'
+
+SEGMENT_NAME = re.compile(r'^(\d{4}-\d{2}-\d{2})\.(log|seg)$')
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class SightingLog:
+    def __init__(self, directory, gap=900, block_size=256):
+        """
+            Parms:
+                directory = where the log and segment files live
+                gap = seconds a device can go unseen and still count as
+                    having been there the whole time. Should be a few
+                    scan intervals.
+                block_size = runs per compressed block in a segment
+        """
+        self.directory = directory
+        self.gap = gap
+        self.block_size = block_size
+        # Day the last write went to, so we know when to seal
+        self.day = None
+        # Sealed segments never change, so their indexes can be kept.
+        # day -> (list of first macs, list of (offset, length))
+        self.indexes = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, day, kind):
+        return os.path.join(self.directory, '%s.%s' % (day, kind))
+
+    def days(self):
+        """
+            Returns: Dict: day -> set of what's there for it ('log', 'seg')
+        """
+        found = {}
+        for name in os.listdir(self.directory):
+            match = SEGMENT_NAME.match(name)
+            if match:
+                found.setdefault(match.group(1), set()).add(match.group(2))
+        return found
+
+    def record(self, sightings, when=None):
+        """
+            Appends a batch of sightings to the log of the day they were
+            seen, in one write per day. Anything that isn't a valid mac
+            and IPv4 address is skipped.
+
+            Parms: sightings -- iterable of (mac, ip) strings, or
+                       (mac, ip, when) for one seen at some other time
+                   when -- epoch time they were seen, now if None
+            Returns: Number of sightings written
+        """
+        today = day_of(time.time())
+        if today != self.day:
+            # First write of a new day, put the old ones away
+            self.day = today
+            self.seal_old(today)
+
+        when = int(when or time.time())
+        packed = {}
+        for sighting in sightings:
+            seen = int(sighting[2]) if len(sighting) > 2 else when
+            try:
+                packed.setdefault(day_of(seen), []).append(
+                    SIGHTING.pack(mac_to_int(sighting[0]), ip_to_int(sighting[1]), seen))
+            except (ValueError, socket.error):
+                continue
+        for (day, records) in packed.items():
+            with open(self.path(day, 'log'), 'ab') as f:
+                f.write(''.join(records))
+        return sum(len(records) for records in packed.values())
+
+    def seal_old(self, today=None):
+        """
+            Seals the log of every day before today into a segment.
+            Returns: Number of days sealed
+        """
+        today = today or day_of(time.time())
+        sealed = 0
+        for (day, kinds) in sorted(self.days().items()):
+            if day < today and 'log' in kinds:
+                self.seal(day)
+                sealed += 1
+        return sealed
+
+    def seal(self, day):
+        """
+            Collapses a day's log into a segment and removes the log.
+            The log only goes once the segment is safely in place, so
+            if we die part way we just do it again next time. If the
+            day was sealed already (sightings turned up late), the log
+            is merged into what's there.
+        """
+        runs = read_log(self.path(day, 'log'))
+        if os.path.exists(self.path(day, 'seg')):
+            runs.extend(self.segment_runs(day))
+        runs = collapse(sorted(runs), self.gap)
+
+        blocks = []
+        for start in xrange(0, len(runs), self.block_size):
+            chunk = runs[start:start + self.block_size]
+            blocks.append((chunk[0][0], zlib.compress(''.join(RUN.pack(*run) for run in chunk))))
+
+        data = [MAGIC, HEADER.pack(len(blocks), len(runs))]
+        offset = len(MAGIC) + HEADER.size + INDEX.size * len(blocks)
+        for (first, block) in blocks:
+            data.append(INDEX.pack(first, offset, len(block)))
+            offset += len(block)
+        data.extend(block for (first, block) in blocks)
+
+        write_atomic(self.path(day, 'seg'), ''.join(data))
+        self.indexes.pop(day, None)
+        os.unlink(self.path(day, 'log'))
+
+    def segment_index(self, day):
+        """
+            Reads (or remembers) the block index of a day's segment
+        """
+        if day not in self.indexes:
+            with open(self.path(day, 'seg'), 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError("%s is not a sighting segment" % self.path(day, 'seg'))
+                (block_count, run_count) = HEADER.unpack(f.read(HEADER.size))
+                entries = [INDEX.unpack(f.read(INDEX.size)) for block in xrange(block_count)]
+            self.indexes[day] = ([entry[0] for entry in entries], [entry[1:] for entry in entries])
+        return self.indexes[day]
+
+    def segment_runs(self, day, mac=None):
+        """
+            Pulls one mac's runs out of a day's segment, only
+            inflating the blocks it could be in. Every run in the
+            segment if mac is None.
+        """
+        (firsts, blocks) = self.segment_index(day)
+        if mac is None:
+            (position, end) = (0, len(firsts))
+        else:
+            # A mac's runs can spill over from the block before
+            position = max(bisect.bisect_left(firsts, mac) - 1, 0)
+            end = bisect.bisect_right(firsts, mac)
+        runs = []
+        with open(self.path(day, 'seg'), 'rb') as f:
+            while position < end:
+                (offset, length) = blocks[position]
+                f.seek(offset)
+                block = zlib.decompress(f.read(length))
+                for start in xrange(0, len(block), RUN.size):
+                    run = RUN.unpack_from(block, start)
+                    if mac is None or run[0] == mac:
+                        runs.append(run)
+                    elif run[0] > mac:
+                        break
+                position += 1
+        return runs
+
+    def runs(self, mac, since=None, until=None):
+        """
+            Every run of sightings of a mac at a single address
+            between since and until (epoch times, either may be None).
+
+            Returns: List of Tuples: (ip, first, last), oldest first
+        """
+        mac = mac_to_int(mac)
+        first_day = day_of(since) if since is not None else ''
+        last_day = day_of(until) if until is not None else '9999'
+
+        runs = []
+        for (day, kinds) in sorted(self.days().items()):
+            if not first_day <= day <= last_day:
+                continue
+            try:
+                if 'seg' in kinds:
+                    runs.extend(self.segment_runs(day, mac))
+                if 'log' in kinds:
+                    runs.extend(collapse(sorted(log_sightings(self.path(day, 'log'), mac)), self.gap))
+            except (IOError, OSError):
+                # Got sealed out from under us, it'll be there next time
+                continue
+
+        return [(int_to_ip(ip), first, last) for (run_mac, first, last, ip) in sorted(runs)
+                if (since is None or last >= since) and (until is None or first <= until)]
+
+    def presence(self, mac, since=None, until=None):
+        """
+            When was this mac on the network, whatever its address?
+
+            Returns: List of Tuples: (first, last) epoch times
+        """
+        intervals = []
+        for (ip, first, last) in self.runs(mac, since, until):
+            if intervals and first - intervals[-1][1] <= self.gap:
+                intervals[-1] = (intervals[-1][0], max(last, intervals[-1][1]))
+            else:
+                intervals.append((first, last))
+        return intervals
+
+    def ip_history(self, mac, since=None, until=None):
+        """
+            Which addresses has this mac had, and when?
+
+            Returns: List of Tuples: (ip, first, last), oldest first
+        """
+        history = []
+        for (ip, first, last) in self.runs(mac, since, until):
+            if history and history[-1][0] == ip:
+                history[-1] = (ip, history[-1][1], max(last, history[-1][2]))
+            else:
+                history.append((ip, first, last))
+        return history
+
+
+def read_log(path):
+    """
+        Reads a whole day's log, each sighting as a run of its own.
+
+        Returns: List of Tuples: (mac, time, time, ip)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Lose any half written sighting on the end
+    words = array.array('I', data[:len(data) - len(data) % SIGHTING.size])
+    if sys.byteorder == 'big':
+        words.byteswap()
+    return [((words[index + 1] << 32) | words[index], words[index + 3], words[index + 3], words[index + 2])
+            for index in xrange(0, len(words), 4)]
+
+def log_sightings(path, mac):
+    """
+        Finds one mac's sightings in a day's log without unpacking
+        the rest of it.
+
+        Returns: List of Tuples: (mac, time, time, ip)
+    """
+    key = struct.pack('<Q', mac)
+    sightings = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        size -= size % SIGHTING.size
+        if not size:
+            return sightings
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = data.find(key)
+            while position != -1 and position < size:
+                # The bytes could turn up inside some other field too
+                if position % SIGHTING.size == 0:
+                    (found, ip, when) = SIGHTING.unpack_from(data, position)
+                    sightings.append((found, when, when, ip))
+                position = data.find(key, position + 1)
+        finally:
+            data.close()
+    return sightings
+
+def collapse(runs, gap):
+    """
+        Merges runs sorted by mac and time into as few as possible:
+        stretches of time a mac was seen at the same address, never
+        going more than gap seconds without being seen. A sighting is
+        a run that starts and ends at the same time.
+
+        Parms: runs -- sorted list of (mac, first, last, ip)
+        Returns: List of Tuples: (mac, first, last, ip)
+    """
+    merged = []
+    for (mac, first, last, ip) in runs:
+        if merged:
+            (run_mac, run_first, run_last, run_ip) = merged[-1]
+            if run_mac == mac and run_ip == ip and first - run_last <= gap:
+                merged[-1] = (mac, run_first, max(last, run_last), ip)
+                continue
+        merged.append((mac, first, last, ip))
+    return merged
+
+def day_of(when):
+    """ The UTC day an epoch time falls on, as YYYY-MM-DD """
+    return time.strftime('%Y-%m-%d', time.gmtime(when))
+
+def mac_to_int(mac):
+    """
+        Any of 00:11:22:33:44:55, 00-11-22-33-44-55 or 0011.2233.4455
+        as a 48-bit integer. Raises ValueError if it isn't one.
+    """
+    digits = re.sub(r'[:.\-]', '', mac)
+    if len(digits) != 12:
+        raise ValueError("Not a mac address: %r" % mac)
+    return int(digits, 16)
+
+def int_to_mac(value):
+    return ':'.join('%02x' % ((value >> shift) & 0xff) for shift in range(40, -8, -8))
+
+def ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+def parse_time(value):
+    """ A local YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS as an epoch time """
+    for date_format in (DATE_FORMAT, '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(value, date_format))
+        except ValueError:
+            pass
+    raise ValueError("Can't make sense of %r, try YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS" % value)
+
+def format_time(when):
+    return time.strftime(DATE_FORMAT, time.localtime(when))
+
+def duration(seconds):
+    """ seconds as 1d 2h 3m """
+    (minutes, seconds) = divmod(int(seconds), 60)
+    (hours, minutes) = divmod(minutes, 60)
+    (days, hours) = divmod(hours, 24)
+    parts = [('%dd' % days) if days else '', ('%dh' % hours) if hours else '', '%dm' % minutes]
+    return ' '.join(part for part in parts if part)
+
+
+def main():
+    parser = ArgumentParser(description='Look up the sighting history sauron.py --history keeps.')
+    parser.add_argument('directory', metavar='DIR', help="History directory")
+    parser.add_argument('command', choices=['presence', 'ips', 'seal'], help="presence: when was MAC on the network, ips: what addresses has MAC had, seal: compact finished days")
+    parser.add_argument('mac', nargs='?', metavar='MAC', help="Device to look up")
+    parser.add_argument('--since', action="store", dest="since", help="Only look from here on (YYYY-MM-DD[THH:MM:SS])")
+    parser.add_argument('--until', action="store", dest="until", help="Only look up to here (YYYY-MM-DD[THH:MM:SS])")
+    parser.add_argument('--days', action="store", type=int, dest="days", help="Only look at the last this many days")
+    parser.add_argument('--gap', action="store", type=int, dest="gap", help="Seconds unseen before a device counts as gone", default=900)
+
+    options = parser.parse_args()
+    history = SightingLog(options.directory, gap=options.gap)
+
+    if options.command == 'seal':
+        print "Sealed %d day(s)" % history.seal_old()
+        return
+    if not options.mac:
+        parser.error("%s needs a MAC" % options.command)
+
+    since = parse_time(options.since) if options.since else None
+    until = parse_time(options.until) if options.until else None
+    if options.days:
+        since = time.time() - options.days * 86400
+
+    if options.command == 'presence':
+        for (first, last) in history.presence(options.mac, since, until):
+            print "%s\t%s\t%s" % (format_time(first), format_time(last), duration(last - first))
+    else:
+        for (ip, first, last) in history.ip_history(options.mac, since, until):
+            print "%s\t%s\t%s" % (ip, format_time(first), format_time(last))
+
+if __name__ == '__main__':
+    main()
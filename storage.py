@@ -0,0 +1,733 @@
+#!/usr/bin/env python
+
+"""
+storage v1.0
+Where CouchCoop and MacWatch keep their data
+
+Both of them talk to one of these rather than to couchdb directly:
+
+    CouchStorage  -- the sauron and all_seeing_eye couchdb databases,
+                     same as it always was
+    SQLiteStorage -- a single SQLite file, for little sites where
+                     running couchdb just for sauron is overkill and
+                     the HTTP round trips are most of the run time
+
+Pick one with a URL, see open_storage: http://host:5984 for couchdb
+or sqlite:/var/lib/sauron/sauron.db for SQLite. Move everything from
+one to the other with:
+
+    storage.py copy http://localhost:5984 sqlite:/var/lib/sauron/sauron.db
+
+Devices are docs shaped the way couchdb has them, _id, _rev and all,
+so nothing above this cares which one it's talking to. A failed write
+comes back as a couchdb.ResourceConflict either way.
+
+Everything in a process shares one couchdb connection setup: a
+RetryingSession keeps its connections open between requests and
+tries again (backing off) when one drops, or a lookup times out, the databases
+are only checked for and their views synced the first time they're
+opened, and bulk lookups can run a few chunks at once on a small
+thread pool. Over a slow link to a remote couchdb that's most of the
+time a run takes.
+"""
+
+import os
+import json
+import time
+import errno
+import socket
+import sqlite3
+import syslog
+import threading
+import couchdb
+import couchdb.http
+import urlparse
+from multiprocessing.pool import ThreadPool
+from contextlib import contextmanager
+from argparse import ArgumentParser
+from couchdb.design import ViewDefinition
+
+# Views for the sauron database, kept in sync by CouchStorage
+SAURON_VIEWS = [
+    ViewDefinition('sauron', 'by_lastseen', '''
+        function(doc) {
+            if (doc.lastSeen) {
+                emit(doc.lastSeen, doc.ip);
+            }
+        }
+    '''),
+    ViewDefinition('sauron', 'by_ip', '''
+        function(doc) {
+            if (doc.ip) {
+                emit(doc.ip, doc.lastSeen);
+            }
+        }
+    '''),
+]
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS devices (
+    mac TEXT PRIMARY KEY,
+    ip TEXT,
+    lastSeen TEXT,
+    firstSeen TEXT,
+    rev INTEGER NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS devices_lastseen ON devices (lastSeen);
+CREATE INDEX IF NOT EXISTS devices_ip ON devices (ip);
+CREATE TABLE IF NOT EXISTS watchlist (
+    mac TEXT PRIMARY KEY,
+    persistent INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS watchlist_seq ON watchlist (seq);
+'''
+
+# SQLite won't take more than 999 ? in a statement
+SQLITE_MAX_VARIABLES = 500
+
+# Errors connecting, before anything of the request has been sent
+CONNECT_ERRORS = frozenset([errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH,
+                            errno.EHOSTDOWN, errno.ENETDOWN])
+
+# (url, database) for every couchdb database this process has already
+# made sure of, so opening it again doesn't cost any requests
+opened_databases = set()
+
+
+class RetryingSession(couchdb.http.Session):
+    """
+        A couchdb HTTP session that tries a request again, backing off
+        a bit longer each time, rather than failing the whole run over
+        a blip. Connections are kept open and reused between requests
+        (and shared between threads) by couchdb's own connection pool.
+
+        A connection that drops part way through a request is retried
+        by couchdb itself, through retry_delays. One that can't be made
+        at all (refused, unreachable) is retried here, since nothing
+        was sent. A request that times out may well have been done
+        anyway, so that's only tried again if it just reads (see
+        read_only), never a write like _bulk_docs.
+    """
+    def __init__(self, retries=3, backoff=0.5, **kwargs):
+        """
+            Parms:
+                retries = how many more times to try a request
+                backoff = seconds to wait before the first retry,
+                    doubling each time after that
+                Anything else (timeout, say) goes to couchdb.http.Session
+        """
+        self.delays = [backoff * 2 ** attempt for attempt in range(retries)]
+        if not self.delays:
+            # couchdb can't cope with an empty retry_delays
+            kwargs['retryable_errors'] = ()
+        couchdb.http.Session.__init__(self, retry_delays=self.delays or [0], **kwargs)
+        self.retry_delays = Backoff(self, self.retry_delays)
+        # The request each thread is making, for Backoff to report
+        self.current = threading.local()
+
+    def request(self, method, url, *args, **kwargs):
+        self.current.request = (method, url)
+        delays = iter(self.delays if read_only(method, url) else ())
+        connect_delays = iter(self.delays)
+        while True:
+            try:
+                return couchdb.http.Session.request(self, method, url, *args, **kwargs)
+            except socket.timeout as e:
+                delay = next(delays, None)
+            except socket.error as e:
+                if e.args[0] not in CONNECT_ERRORS:
+                    raise
+                delay = next(connect_delays, None)
+            if delay is None:
+                raise
+            self.retrying(method, url, e, delay)
+            time.sleep(delay)
+
+    def retrying(self, method, url, error, delay):
+        """
+            Called before each retry, with how long it'll wait first
+        """
+        syslog.syslog("%s %s failed (%s), trying again in %.1f seconds" % (method, url, error, delay))
+
+
+class Backoff(list):
+    """
+        The retry_delays a RetryingSession hands couchdb, which tells
+        the session about each retry as couchdb gets to it
+    """
+    def __init__(self, session, delays):
+        list.__init__(self, delays)
+        self.session = session
+
+    def __iter__(self):
+        for delay in list.__iter__(self):
+            (method, url) = getattr(self.session.current, 'request', (None, None))
+            self.session.retrying(method, url, 'connection failed', delay)
+            yield delay
+
+
+def read_only(method, url):
+    """
+        Is this a request that only reads, so that doing it twice does
+        no harm? Bulk lookups POST their keys to _all_docs or a view.
+    """
+    method = method.upper()
+    if method in ('GET', 'HEAD'):
+        return True
+    path = urlparse.urlsplit(url).path
+    return method == 'POST' and (path.endswith('/_all_docs') or '/_view/' in path)
+
+
+def open_storage(url=None, database_name='sauron', macwatch_name='all_seeing_eye', session=None,
+                 workers=4):
+    """
+        Opens whatever storage url points at:
+
+            sqlite:/path/to/file.db  (or sqlite:///path/to/file.db)
+            http://host:port         couchdb, the default on localhost
+
+        database_name, macwatch_name, session (a couchdb.http.Session,
+        a RetryingSession if None) and workers (how many bulk lookups
+        may be in flight at once) only matter for couchdb.
+    """
+    url = url or 'http://localhost:5984'
+    if url.startswith('sqlite:'):
+        path = url[len('sqlite:'):]
+        if path.startswith('//'):
+            path = path[2:]
+        return SQLiteStorage(path)
+    return CouchStorage(url, database_name, macwatch_name, session, workers)
+
+def chunks(iterable, size):
+    """
+        Breaks any iterable up into lists of at most size entries.
+        Handy for keeping bulk requests to couchdb a sane size.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class CouchStorage:
+    # Safe to use from more than one thread at a time
+    concurrent = True
+
+    def __init__(self, url='http://localhost:5984', database_name='sauron',
+                 macwatch_name='all_seeing_eye', session=None, workers=4):
+        """
+            Opens (creating if need be) the device and macwatch
+            databases, and makes sure the views are up to date.
+
+            workers is how many get_chunks lookups run at once.
+        """
+        self.url = url
+        self.server = couchdb.Server(url=url, session=session or RetryingSession())
+        self.db = self.open_database(database_name, SAURON_VIEWS)
+        self.watch_db = self.open_database(macwatch_name)
+        self.workers = workers
+        # Started the first time get_chunks needs it, which can be from
+        # more than one thread (see pipeline.py)
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    def open_database(self, name, views=None):
+        """
+            Creates the database if it doesn't exist and syncs its
+            views, the first time this process opens it. After that
+            it's taken as read.
+        """
+        if (self.url, name) not in opened_databases:
+            try:
+                # create if database doesn't exist
+                self.server.create(name)
+            except couchdb.PreconditionFailed:
+                # Database already exists
+                pass
+            if views:
+                # Only writes anything if the views actually changed
+                ViewDefinition.sync_many(couchdb.Database(self.server.resource(name), name), views)
+            opened_databases.add((self.url, name))
+        # Unlike server[name], this doesn't go and check it's there
+        return couchdb.Database(self.server.resource(name), name)
+
+    @contextmanager
+    def transaction(self):
+        """
+            couchdb doesn't have them, every write stands on its own
+        """
+        yield
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def exists(self, identifier):
+        return identifier in self.db
+
+    def get(self, identifier):
+        """
+            Returns the doc, or None if it doesn't exist
+        """
+        return self.db.get(identifier)
+
+    def get_many(self, identifiers):
+        """
+            Pulls every identifier in one _all_docs?include_docs=true
+            request. Returns a dict of identifier -> doc, anything that
+            doesn't exist (or was deleted) just won't be in it.
+        """
+        found = {}
+        for row in self.db.view('_all_docs', keys=identifiers, include_docs=True):
+            # Missing keys come back with an error and no doc, and
+            # deleted ones come back with a null doc.
+            doc = row.doc
+            if doc is not None:
+                found[row.key] = doc
+        return found
+
+    def get_chunks(self, chunk_list):
+        """
+            get_many for each list of identifiers in chunk_list, up to
+            workers of them at a time, all over the same pool of open
+            connections.
+
+            Returns a dict of identifier -> doc for all of them.
+        """
+        chunk_list = list(chunk_list)
+        if len(chunk_list) < 2 or self.workers < 2:
+            results = [self.get_many(chunk) for chunk in chunk_list]
+        else:
+            with self.pool_lock:
+                if self.pool is None:
+                    self.pool = ThreadPool(self.workers)
+            results = self.pool.map(self.get_many, chunk_list)
+        found = {}
+        for result in results:
+            found.update(result)
+        return found
+
+    def save_many(self, doc_list):
+        """
+            Writes every doc in one _bulk_docs request. A doc needs the
+            _rev it was read with to update it, and _deleted to delete
+            it, same as couchdb always wants.
+
+            Returns: List of Tuples: (success, identifier, rev or exception)
+        """
+        return self.db.update(doc_list)
+
+    def seen_between(self, start, end):
+        """
+            Range query on the by_lastseen view, start and end being
+            DATE_FORMAT strings or None for an open end.
+
+            Returns: List of Tuples: (mac, ip, lastSeen), oldest first
+        """
+        options = {}
+        if start is not None:
+            options['startkey'] = start
+        if end is not None:
+            options['endkey'] = end
+        return [(row.id, row.value, row.key) for row in self.db.view('sauron/by_lastseen', **options)]
+
+    def holders(self, ips):
+        """
+            Who has each of ips, off the by_ip view, all in one request.
+
+            Returns: Dict: ip -> list of (mac, lastSeen)
+        """
+        found = {}
+        for row in self.db.view('sauron/by_ip', keys=list(ips)):
+            found.setdefault(row.key, []).append((row.id, row.value))
+        return found
+
+    def iter_devices(self, batch):
+        """
+            Every device doc, batch at a time
+        """
+        for row in self.db.iterview('_all_docs', batch, include_docs=True):
+            if not row.id.startswith('_design/'):
+                yield row.doc
+
+    def watch_changes(self, since):
+        """
+            What changed on the watchlist since the given sequence.
+
+            Returns: Tuple: (list of (mac, persistent, rev), last sequence)
+                     where persistent is None for a mac that was removed
+        """
+        changes = self.watch_db.changes(since=since, include_docs=True)
+        results = []
+        for change in changes['results']:
+            if change['id'].startswith('_design/'):
+                continue
+            if change.get('deleted'):
+                results.append((change['id'], None, None))
+            else:
+                results.append((change['id'], change['doc'].get('persistent', False), change['doc']['_rev']))
+        return (results, changes['last_seq'])
+
+    def watch_save(self, entries):
+        """
+            Adds or overwrites each (mac, persistent) on the watchlist,
+            looking up the revisions of those already there in one
+            request and writing them all in another.
+
+            Returns: List of Tuples: (mac, exception) that didn't make it
+        """
+        # Last one wins if a mac is in here twice
+        wanted = dict(entries)
+        doc_list = []
+        for row in self.watch_db.view('_all_docs', keys=list(wanted)):
+            doc = {'_id': row.key, 'persistent': wanted[row.key]}
+            # Missing macs come back with an error, deleted ones as
+            # deleted. Both get created from scratch.
+            if row.value and not row.value.get('deleted'):
+                doc['_rev'] = row.value['rev']
+            doc_list.append(doc)
+        return [(identifier, rev_or_exc) for (success, identifier, rev_or_exc)
+                in self.watch_db.update(doc_list) if not success]
+
+    def watch_remove(self, entries):
+        """
+            Removes each (mac, rev) from the watchlist in one request.
+            Returns: List of Tuples: (mac, exception) that didn't go
+        """
+        doc_list = [{'_id': mac, '_rev': rev, '_deleted': True} for (mac, rev) in entries]
+        return [(identifier, rev_or_exc) for (success, identifier, rev_or_exc)
+                in self.watch_db.update(doc_list) if not success]
+
+    def watch_delete(self, mac):
+        """
+            Removes a mac from the watchlist. Returns False if it wasn't there.
+        """
+        doc = self.watch_db.get(mac)
+        if doc is None:
+            return False
+        self.watch_db.delete(doc)
+        return True
+
+    def watch_exists(self, mac):
+        return mac in self.watch_db
+
+    def disk_size(self):
+        """
+            Bytes on disk for the device database and its views
+        """
+        size = file_size(self.db.info())
+        for design in set(view.design for view in SAURON_VIEWS):
+            size += file_size(self.db.info(design)['view_index'])
+        return size
+
+    def compact(self, poll=1.0):
+        """
+            Compacts the device database and its views, throwing away
+            old revisions and deleted docs' bodies, clears out index
+            files for views that are gone, and waits for it all to
+            finish.
+        """
+        designs = set(view.design for view in SAURON_VIEWS)
+        self.db.compact()
+        for design in designs:
+            self.db.compact(design)
+        self.db.cleanup()
+        while (self.db.info().get('compact_running') or
+               any(self.db.info(design)['view_index'].get('compact_running') for design in designs)):
+            time.sleep(poll)
+
+    def watch_iter(self, page_size):
+        """
+            The watchlist page_size entries at a time, paging through
+            _all_docs with limit/startkey.
+
+            Yields: Tuple: (mac, persistent)
+        """
+        for row in self.watch_db.iterview('_all_docs', page_size, include_docs=True):
+            if not row.id.startswith('_design/'):
+                yield (row.id, row.doc.get('persistent', False))
+
+
+class SQLiteStorage:
+    # A connection can only be used from the thread that opened it
+    concurrent = False
+
+    def __init__(self, path):
+        """
+            Opens (creating if need be) the SQLite database at path.
+            It runs in WAL mode, so reports can read while a scan is
+            writing.
+        """
+        self.path = path
+        # A scan holds its transaction open the whole time, so anybody
+        # else writing may have to wait a while
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # With WAL this can only lose the last transaction on a power
+        # cut, never corrupt anything
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SQLITE_SCHEMA)
+        # How many transaction() blocks we're inside of
+        self.depth = 0
+
+    @contextmanager
+    def transaction(self):
+        """
+            Everything inside goes in as one transaction, which is a lot
+            quicker than committing every write on its own. Nests, only
+            the outermost one commits.
+        """
+        if self.depth == 0:
+            self.connection.execute('BEGIN IMMEDIATE')
+        self.depth += 1
+        try:
+            yield
+        except:
+            self.depth -= 1
+            if self.depth == 0:
+                self.connection.execute('ROLLBACK')
+            raise
+        self.depth -= 1
+        if self.depth == 0:
+            self.connection.execute('COMMIT')
+
+    def close(self):
+        self.connection.close()
+
+    def disk_size(self):
+        """
+            Bytes on disk, write-ahead log and all
+        """
+        return sum(os.path.getsize(path) for path in (self.path, self.path + '-wal')
+                   if os.path.exists(path))
+
+    def compact(self, poll=None):
+        """
+            Rebuilds the file without the space deleted devices left
+            behind, then folds the write-ahead log (which the rebuild
+            goes through) back in
+        """
+        self.connection.execute('VACUUM')
+        self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def select_in(self, query, keys):
+        """
+            Runs query with "IN (%s)" filled in for keys, a few hundred
+            at a time so SQLite doesn't run out of variables.
+        """
+        for chunk in chunks(keys, SQLITE_MAX_VARIABLES):
+            for row in self.connection.execute(query % ','.join('?' * len(chunk)), chunk):
+                yield row
+
+    def exists(self, identifier):
+        return self.get(identifier) is not None
+
+    def get(self, identifier):
+        return self.get_many([identifier]).get(identifier)
+
+    def get_many(self, identifiers):
+        found = {}
+        for (mac, rev, doc) in self.select_in('SELECT mac, rev, doc FROM devices WHERE mac IN (%s)', identifiers):
+            found[mac] = to_doc(mac, rev, doc)
+        return found
+
+    def get_chunks(self, chunk_list):
+        """
+            One connection can't be shared between threads, and
+            there's no round trip to wait on anyway
+        """
+        found = {}
+        for chunk in chunk_list:
+            found.update(self.get_many(chunk))
+        return found
+
+    def save_many(self, doc_list):
+        """
+            Writes every doc, checking revisions the way couchdb would:
+            a new doc mustn't have a _rev, an existing one must have the
+            current one.
+
+            Returns: List of Tuples: (success, identifier, rev or exception)
+        """
+        results = []
+        with self.transaction():
+            current = dict(self.select_in('SELECT mac, rev FROM devices WHERE mac IN (%s)',
+                                          [doc['_id'] for doc in doc_list]))
+            for doc in doc_list:
+                identifier = doc['_id']
+                rev = current.get(identifier)
+                if doc.get('_rev') != (str(rev) if rev is not None else None):
+                    results.append((False, identifier, couchdb.ResourceConflict('Document update conflict.')))
+                    continue
+
+                if doc.get('_deleted'):
+                    if rev is None:
+                        results.append((False, identifier, couchdb.ResourceNotFound('missing')))
+                        continue
+                    self.connection.execute('DELETE FROM devices WHERE mac = ?', (identifier,))
+                    current.pop(identifier)
+                    results.append((True, identifier, str(rev + 1)))
+                    continue
+
+                rev = (rev or 0) + 1
+                body = dict((key, value) for (key, value) in doc.items() if key not in ('_id', '_rev'))
+                self.connection.execute('INSERT OR REPLACE INTO devices (mac, ip, lastSeen, firstSeen, rev, doc) '
+                                        'VALUES (?, ?, ?, ?, ?, ?)',
+                                        (identifier, doc.get('ip'), doc.get('lastSeen'), doc.get('firstSeen'),
+                                         rev, json.dumps(body)))
+                current[identifier] = rev
+                # Like couchdb-python, leave the doc with its new revision
+                doc['_rev'] = str(rev)
+                results.append((True, identifier, str(rev)))
+        return results
+
+    def seen_between(self, start, end):
+        query = 'SELECT mac, ip, lastSeen FROM devices WHERE lastSeen IS NOT NULL'
+        parameters = []
+        if start is not None:
+            query += ' AND lastSeen >= ?'
+            parameters.append(start)
+        if end is not None:
+            query += ' AND lastSeen <= ?'
+            parameters.append(end)
+        return self.connection.execute(query + ' ORDER BY lastSeen, mac', parameters).fetchall()
+
+    def holders(self, ips):
+        found = {}
+        for (ip, mac, last_seen) in self.select_in('SELECT ip, mac, lastSeen FROM devices WHERE ip IN (%s)', list(ips)):
+            found.setdefault(ip, []).append((mac, last_seen))
+        return found
+
+    def iter_devices(self, batch):
+        last = ''
+        while True:
+            rows = self.connection.execute('SELECT mac, rev, doc FROM devices WHERE mac > ? ORDER BY mac LIMIT ?',
+                                           (last, batch)).fetchall()
+            for (mac, rev, doc) in rows:
+                yield to_doc(mac, rev, doc)
+            if len(rows) < batch:
+                return
+            last = rows[-1][0]
+
+    def next_seq(self):
+        return self.connection.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM watchlist').fetchone()[0]
+
+    def watch_changes(self, since):
+        rows = self.connection.execute('SELECT mac, persistent, deleted, seq FROM watchlist '
+                                       'WHERE seq > ? ORDER BY seq', (since,)).fetchall()
+        results = [(mac, None if deleted else bool(persistent), None if deleted else str(seq))
+                   for (mac, persistent, deleted, seq) in rows]
+        return (results, rows[-1][3] if rows else since)
+
+    def watch_save(self, entries):
+        with self.transaction():
+            seq = self.next_seq()
+            for (mac, persistent) in entries:
+                self.connection.execute('INSERT OR REPLACE INTO watchlist (mac, persistent, deleted, seq) '
+                                        'VALUES (?, ?, 0, ?)', (mac, int(bool(persistent)), seq))
+                seq += 1
+        return []
+
+    def watch_remove(self, entries):
+        failed = []
+        with self.transaction():
+            seq = self.next_seq()
+            for (mac, rev) in entries:
+                cursor = self.connection.execute('UPDATE watchlist SET deleted = 1, seq = ? '
+                                                 'WHERE mac = ? AND seq = ? AND deleted = 0', (seq, mac, int(rev or 0)))
+                if cursor.rowcount:
+                    seq += 1
+                else:
+                    failed.append((mac, couchdb.ResourceConflict('Document update conflict.')))
+        return failed
+
+    def watch_delete(self, mac):
+        with self.transaction():
+            cursor = self.connection.execute('UPDATE watchlist SET deleted = 1, seq = ? WHERE mac = ? AND deleted = 0',
+                                             (self.next_seq(), mac))
+        return cursor.rowcount > 0
+
+    def watch_exists(self, mac):
+        return self.connection.execute('SELECT 1 FROM watchlist WHERE mac = ? AND deleted = 0',
+                                       (mac,)).fetchone() is not None
+
+    def watch_iter(self, page_size):
+        last = ''
+        while True:
+            rows = self.connection.execute('SELECT mac, persistent FROM watchlist WHERE deleted = 0 AND mac > ? '
+                                           'ORDER BY mac LIMIT ?', (last, page_size)).fetchall()
+            for (mac, persistent) in rows:
+                yield (mac, bool(persistent))
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+
+def to_doc(mac, rev, doc):
+    """
+        Turns a devices row back into a doc, couchdb style
+    """
+    doc = json.loads(doc)
+    doc['_id'] = mac
+    doc['_rev'] = str(rev)
+    return doc
+
+def file_size(info):
+    """
+        How big a database or view index is on disk, from what
+        couchdb's info says. 2.x has it in sizes, 1.x as disk_size.
+    """
+    return info.get('sizes', {}).get('file', info.get('disk_size', 0))
+
+def copy_storage(source, destination, chunk_size=1000):
+    """
+        Copies every device and the whole watchlist from one storage to
+        another, chunk_size at a time, overwriting whatever was there.
+
+        Returns: Tuple: (devices copied, watchlist entries copied)
+    """
+    devices = 0
+    for chunk in chunks(source.iter_devices(chunk_size), chunk_size):
+        existing = destination.get_many([doc['_id'] for doc in chunk])
+        doc_list = []
+        for doc in chunk:
+            doc = dict(doc)
+            doc.pop('_rev', None)
+            if doc['_id'] in existing:
+                doc['_rev'] = existing[doc['_id']]['_rev']
+            doc_list.append(doc)
+        devices += len([result for result in destination.save_many(doc_list) if result[0]])
+
+    watched = 0
+    for chunk in chunks(source.watch_iter(chunk_size), chunk_size):
+        watched += len(chunk) - len(destination.watch_save(chunk))
+
+    return (devices, watched)
+
+
+def main():
+    parser = ArgumentParser(description='Copy the sauron database from one storage to another.')
+    parser.add_argument('command', choices=['copy'], help="copy: everything in SOURCE to DESTINATION")
+    parser.add_argument('source', metavar='SOURCE', help="Where to copy from, sqlite:PATH or http://host:port")
+    parser.add_argument('destination', metavar='DESTINATION', help="Where to copy to, sqlite:PATH or http://host:port")
+    parser.add_argument('-c', '--chunk-size', action="store", type=int, dest="chunk_size", help="Devices to copy at a time", default=1000)
+
+    options = parser.parse_args()
+
+    source = open_storage(options.source)
+    destination = open_storage(options.destination)
+    with destination.transaction():
+        (devices, watched) = copy_storage(source, destination, options.chunk_size)
+    print "Copied %d devices and %d watchlist entries" % (devices, watched)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+make_captures v1.0
+Writes the small captures test_pcaparp.py reads
+
+They're checked in, so this only needs running again to change them:
+
+    cd tests/fixtures && python make_captures.py
+
+Each one holds a handful of ARP packets plus a few that should be
+skipped (not ARP, or an ARP probe from 0.0.0.0):
+
+    ethernet.pcap   -- little endian, microseconds, plain ethernet
+    vlan.pcap       -- big endian, nanoseconds, 802.1Q and 802.1ad tags
+    sll.pcap        -- Linux cooked capture (tcpdump -i any)
+    capture.pcapng  -- an ethernet interface in microseconds and a
+                       Linux cooked v2 one in milliseconds, plus a
+                       simple packet block
+"""
+
+import struct
+
+# 2001-09-09 01:46:40 UTC
+EPOCH = 1000000000
+
+
+def mac_bytes(mac):
+    return ''.join(chr(int(part, 16)) for part in mac.split(':'))
+
+def ip_bytes(ip):
+    return ''.join(chr(int(part)) for part in ip.split('.'))
+
+def arp(mac, ip, operation=1, target_ip='10.0.0.254'):
+    """
+        An ethernet/IPv4 ARP packet from mac and ip
+    """
+    return (struct.pack('!HHBBH', 1, 0x0800, 6, 4, operation) + mac_bytes(mac) + ip_bytes(ip) +
+            '\x00' * 6 + ip_bytes(target_ip))
+
+def ethernet(payload, ethertype=0x0806, source='aa:00:00:00:00:ff', tags=()):
+    """
+        An ethernet frame, with a VLAN tag for each (tpid, vlan) in tags
+    """
+    header = '\xff' * 6 + mac_bytes(source)
+    for (tpid, vlan) in tags:
+        header += struct.pack('!HH', tpid, vlan)
+    return header + struct.pack('!H', ethertype) + payload
+
+def sll(payload, ethertype=0x0806, source='aa:00:00:00:00:ff'):
+    return struct.pack('!HHH', 0, 1, 6) + mac_bytes(source) + '\x00\x00' + struct.pack('!H', ethertype) + payload
+
+def sll2(payload, ethertype=0x0806, source='aa:00:00:00:00:ff'):
+    return (struct.pack('!HHIHBB', ethertype, 0, 2, 1, 0, 6) + mac_bytes(source) + '\x00\x00' + payload)
+
+def pcap(path, linktype, packets, endian='<', nanoseconds=False):
+    """
+        Writes a classic pcap file of (timestamp, frame) packets
+    """
+    magic = 0xa1b23c4d if nanoseconds else 0xa1b2c3d4
+    scale = 10 ** 9 if nanoseconds else 10 ** 6
+    with open(path, 'wb') as f:
+        f.write(struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, 65535, linktype))
+        for (timestamp, frame) in packets:
+            seconds = int(timestamp)
+            fraction = int(round((timestamp - seconds) * scale))
+            f.write(struct.pack(endian + 'IIII', seconds, fraction, len(frame), len(frame)) + frame)
+
+def pad(data):
+    return data + '\x00' * (-len(data) % 4)
+
+def block(block_type, body):
+    length = 12 + len(body)
+    return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+def pcapng(path, interfaces, packets, simple=()):
+    """
+        Writes a pcapng file. interfaces is a list of (linktype,
+        if_tsresol or None), packets (interface, timestamp, frame)
+        and simple a list of frames for simple packet blocks.
+    """
+    data = block(0x0a0d0d0a, struct.pack('<IHHq', 0x1a2b3c4d, 1, 0, -1))
+    resolutions = []
+    for (linktype, tsresol) in interfaces:
+        options = ''
+        if tsresol is not None:
+            options = struct.pack('<HH', 9, 1) + pad(chr(tsresol)) + struct.pack('<HH', 0, 0)
+        data += block(1, struct.pack('<HHI', linktype, 0, 65535) + options)
+        resolutions.append(10 ** (tsresol if tsresol is not None else 6))
+    for (interface, timestamp, frame) in packets:
+        ticks = int(round(timestamp * resolutions[interface]))
+        data += block(6, struct.pack('<IIIII', interface, ticks >> 32, ticks & 0xffffffff, len(frame), len(frame)) +
+                      pad(frame))
+    for frame in simple:
+        data += block(3, struct.pack('<I', len(frame)) + pad(frame))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def main():
+    not_arp = ethernet('\x45' + '\x00' * 27, ethertype=0x0800)
+    probe = ethernet(arp('aa:00:00:00:00:07', '0.0.0.0'))
+
+    pcap('ethernet.pcap', 1, [
+        (EPOCH + 0.5, ethernet(arp('aa:00:00:00:00:01', '10.0.0.1'))),
+        (EPOCH + 1.25, ethernet(arp('aa:00:00:00:00:02', '10.0.0.2', operation=2))),
+        (EPOCH + 2, not_arp),
+        (EPOCH + 3, probe),
+        # aa:..:01 moves to a new address later in the capture
+        (EPOCH + 4, ethernet(arp('aa:00:00:00:00:01', '10.0.0.9'))),
+    ])
+
+    pcap('vlan.pcap', 1, [
+        (EPOCH + 0.000000001, ethernet(arp('aa:00:00:00:00:03', '10.0.1.3'), tags=[(0x8100, 10)])),
+        (EPOCH + 1, ethernet(arp('aa:00:00:00:00:04', '10.0.2.4'), tags=[(0x88a8, 100), (0x8100, 20)])),
+        (EPOCH + 2, ethernet('\x45' + '\x00' * 27, ethertype=0x0800, tags=[(0x8100, 10)])),
+    ], endian='>', nanoseconds=True)
+
+    pcap('sll.pcap', 113, [
+        (EPOCH, sll(arp('aa:00:00:00:00:05', '10.0.0.5'))),
+        (EPOCH + 1, sll('\x45' + '\x00' * 27, ethertype=0x0800)),
+    ])
+
+    pcapng('capture.pcapng', [(1, None), (276, 3)], [
+        (0, EPOCH + 0.5, ethernet(arp('aa:00:00:00:00:01', '10.0.0.1'))),
+        (1, EPOCH + 1.5, sll2(arp('aa:00:00:00:00:06', '10.0.0.6', operation=2))),
+        (0, EPOCH + 2, probe),
+    ], simple=[ethernet(arp('aa:00:00:00:00:08', '10.0.0.8'))])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""
+Checks pcaparp against the captures in fixtures/ (see
+fixtures/make_captures.py). From the top of the tree:
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pcaparp
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+EPOCH = 1000000000
+
+
+def fixture(name):
+    return os.path.join(FIXTURES, name)
+
+
+class ReadFileTest(unittest.TestCase):
+    def test_ethernet(self):
+        self.assertEqual(list(pcaparp.read_file(fixture('ethernet.pcap'))), [
+            (EPOCH + 0.5, 'aa:00:00:00:00:01', '10.0.0.1'),
+            (EPOCH + 1.25, 'aa:00:00:00:00:02', '10.0.0.2'),
+            (EPOCH + 4, 'aa:00:00:00:00:01', '10.0.0.9'),
+        ])
+
+    def test_vlan_tags(self):
+        sightings = list(pcaparp.read_file(fixture('vlan.pcap')))
+        self.assertEqual([(mac, ip) for (timestamp, mac, ip) in sightings], [
+            ('aa:00:00:00:00:03', '10.0.1.3'),
+            ('aa:00:00:00:00:04', '10.0.2.4'),
+        ])
+        self.assertAlmostEqual(sightings[1][0], EPOCH + 1)
+
+    def test_linux_cooked(self):
+        self.assertEqual(list(pcaparp.read_file(fixture('sll.pcap'))),
+                         [(EPOCH, 'aa:00:00:00:00:05', '10.0.0.5')])
+
+    def test_pcapng(self):
+        self.assertEqual(list(pcaparp.read_file(fixture('capture.pcapng'))), [
+            (EPOCH + 0.5, 'aa:00:00:00:00:01', '10.0.0.1'),
+            (EPOCH + 1.5, 'aa:00:00:00:00:06', '10.0.0.6'),
+            (None, 'aa:00:00:00:00:08', '10.0.0.8'),
+        ])
+
+
+class ReadStreamTest(unittest.TestCase):
+    def test_same_as_file(self):
+        for name in ('ethernet.pcap', 'vlan.pcap', 'sll.pcap'):
+            with open(fixture(name), 'rb') as f:
+                self.assertEqual(list(pcaparp.read_stream(f)), list(pcaparp.read_file(fixture(name))))
+
+    def test_cut_off(self):
+        with open(fixture('ethernet.pcap'), 'rb') as f:
+            data = f.read()
+        from StringIO import StringIO
+        # Lose the end of the last packet
+        self.assertEqual(len(list(pcaparp.read_stream(StringIO(data[:-5])))), 2)
+
+
+class ScanDataTest(unittest.TestCase):
+    def test_last_sighting_wins(self):
+        entries = dict((entry['mac'], entry) for entry in
+                       pcaparp.scan_data(pcaparp.read_file(fixture('ethernet.pcap')), 'eth0'))
+        self.assertEqual(sorted(entries), ['aa:00:00:00:00:01', 'aa:00:00:00:00:02'])
+        moved = entries['aa:00:00:00:00:01']
+        self.assertEqual(moved['ip'], '10.0.0.9')
+        self.assertEqual(moved['seen'], EPOCH + 4)
+        self.assertEqual(moved['first_seen'], EPOCH + 0.5)
+        self.assertEqual(moved['interface'], 'eth0')
+
+    def test_no_timestamp(self):
+        entries = dict((entry['mac'], entry) for entry in
+                       pcaparp.scan_data(pcaparp.read_file(fixture('capture.pcapng'))))
+        self.assertNotIn('seen', entries['aa:00:00:00:00:08'])
+        self.assertEqual(entries['aa:00:00:00:00:06']['seen'], EPOCH + 1.5)
+
+    def test_windows(self):
+        windows = list(pcaparp.windows(pcaparp.read_file(fixture('ethernet.pcap')), 2))
+        self.assertEqual([sorted((entry['mac'], entry['ip']) for entry in window) for window in windows], [
+            [('aa:00:00:00:00:01', '10.0.0.1'), ('aa:00:00:00:00:02', '10.0.0.2')],
+            [('aa:00:00:00:00:01', '10.0.0.9')],
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()